@@ -0,0 +1,432 @@
+"""Mede o desempenho do Database sobre bases sintéticas de 10 mil a 10 milhões de chips.
+
+Uso:
+    python benchmark.py gerar --quantidade 1000000 [--semente 42] [--banco bench.db]
+    python benchmark.py executar --quantidade 100000 [--repeticoes 5] [--saida atual.json] [--comparar base.json]
+    python benchmark.py comparar atual.json base.json [--tolerancia 0.25]
+    python benchmark.py carga --quantidade 100000 [--clientes 24] [--duracao 10] [--modos servico direto]
+
+A base é determinística: a mesma semente gera os mesmos ICCIDs (válidos, 19 e 20 dígitos), remessas,
+operadoras, datas e retiradas. Ela é gerada uma vez pela própria API do Database e guardada em --pasta;
+cada execução trabalha sobre uma cópia. O resultado é um JSON com a mediana, o mínimo e o máximo de
+cada cenário; com --comparar, cenários mais lentos que a referência além da tolerância são apontados
+e o script termina com código 1.
+
+"carga" simula várias estações ao mesmo tempo (um processo por estação) cadastrando, retirando e consultando
+durante --duracao segundos, pelo serviço HTTP (servico.py) e/ou abrindo o banco diretamente, e mostra
+operações por segundo, latências e erros de cada modo.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import chain
+
+from iccid import digito_verificador, validar_iccids
+from monitoramento import OPERADORAS, Database
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+VERSAO_GERADOR = 1   # mude ao alterar o gerador, para não reaproveitar bases antigas
+DATA_INICIAL = datetime(2024, 1, 1, 8, 0, 0)
+DIAS_DE_DADOS = 365
+PESOS_OPERADORAS = {'Vivo': 30, 'Claro': 25, 'Tim': 25, 'Arquia': 8, 'Quectel Tim': 6, 'Quectel Vivo': 6}
+PESSOAS = ['Ana', 'Bruno', 'Carla', 'Diego', 'Elisa', 'Fábio', 'Gabi', 'Hugo']
+REMESSA_MIN, REMESSA_MAX = 1000, 9000
+FRACAO_MAX_RETIRADOS = 0.6
+EMISSORES = {operadora: 10 + indice for indice, operadora in enumerate(OPERADORAS)}
+EMISSOR_BENCHMARK = 99   # ICCIDs cadastrados durante os cenários, fora da faixa da base
+TOLERANCIA_PADRAO = 0.25
+PISO_MS = 1.0            # diferenças menores que isto são ruído, qualquer que seja a proporção
+CLIENTES_CARGA = 24
+DURACAO_CARGA = 10
+FRACAO_ESCRITAS_CARGA = 0.3
+CHIPS_POR_REMESSA_CARGA = 50
+RETIRADOS_POR_VEZ_CARGA = 10
+MODOS_CARGA = ('servico', 'direto')
+
+
+def gerar_iccid(emissor, serial):
+    # 89 + 55 (Brasil) + emissor + serial + dígito de Luhn; emissores ímpares usam 20 dígitos, os pares 19
+    corpo = f"8955{emissor:02d}{serial:0{13 if emissor % 2 else 12}d}"
+    return corpo + digito_verificador(corpo)
+
+
+def planejar_remessas(quantidade, semente):
+    # [(operadora, primeiro serial, tamanho, data de entrada)] em ordem cronológica
+    rng = random.Random(semente)
+    operadoras, pesos = list(PESOS_OPERADORAS), list(PESOS_OPERADORAS.values())
+    tamanhos = []
+    restante = quantidade
+    while restante > 0:
+        tamanho = min(restante, rng.randint(REMESSA_MIN, REMESSA_MAX))
+        tamanhos.append(tamanho)
+        restante -= tamanho
+    remessas, serial = [], 0
+    for numero, tamanho in enumerate(tamanhos):
+        data = DATA_INICIAL + timedelta(days=numero * DIAS_DE_DADOS // len(tamanhos),
+                                        minutes=rng.randrange(8 * 60))
+        remessas.append((rng.choices(operadoras, pesos)[0], serial, tamanho, data))
+        serial += tamanho
+    return remessas
+
+
+def gerar_base(caminho, quantidade, semente=42, saida=sys.stderr):
+    # Cadastra as remessas com adicionar_chips_lote e retira uma parte de cada uma com retirar_chips_lote,
+    # para que contadores, índice de busca e livro de movimentos fiquem exatamente como em produção
+    for sufixo in ('', '-wal', '-shm'):
+        if os.path.exists(caminho + sufixo):
+            os.remove(caminho + sufixo)
+    rng = random.Random(semente + 1)
+    db = Database(caminho)
+    inicio = time.perf_counter()
+    cadastrados = 0
+    try:
+        for operadora, primeiro, tamanho, data in planejar_remessas(quantidade, semente):
+            iccids = [gerar_iccid(EMISSORES[operadora], serial) for serial in range(primeiro, primeiro + tamanho)]
+            with db.transacao():
+                remessa_id, _ = db.criar_remessa(operadora, 0, 'benchmark')
+                sucesso, _ = db.adicionar_chips_lote(((iccid, operadora) for iccid in iccids), remessa_id,
+                                                     data_entrada=data.strftime('%Y-%m-%d %H:%M:%S'))
+                db.definir_quantidade_remessa(remessa_id, sucesso)
+            retirados = rng.sample(iccids, int(tamanho * rng.uniform(0, FRACAO_MAX_RETIRADOS)))
+            for parte in range(3):
+                quando = data + timedelta(days=rng.randint(1, 90), minutes=rng.randrange(600))
+                db.retirar_chips_lote(retirados[parte::3], rng.choice(PESSOAS),
+                                      data_saida=quando.strftime('%Y-%m-%d %H:%M:%S'))
+            cadastrados += sucesso
+            print(f"\r{cadastrados}/{quantidade} chips ({time.perf_counter() - inicio:.0f} s)", end='', file=saida)
+        print(file=saida)
+    finally:
+        db.fechar()
+    return cadastrados
+
+
+def obter_base(pasta, quantidade, semente):
+    caminho = os.path.join(pasta, f"benchmark_v{VERSAO_GERADOR}_{quantidade}_{semente}.db")
+    if not os.path.exists(caminho):
+        print(f"gerando {caminho}", file=sys.stderr)
+        gerar_base(caminho + '.tmp', quantidade, semente)
+        os.replace(caminho + '.tmp', caminho)
+    return caminho
+
+
+def medir(repeticoes, funcao, preparar=None):
+    # Executa funcao(*preparar(i)) `repeticoes` vezes; só a chamada é cronometrada
+    tempos = []
+    for repeticao in range(repeticoes):
+        argumentos = preparar(repeticao) if preparar else ()
+        inicio = time.perf_counter()
+        funcao(*argumentos)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return {'mediana_ms': round(statistics.median(tempos), 3), 'min_ms': round(min(tempos), 3),
+            'max_ms': round(max(tempos), 3), 'repeticoes': repeticoes}
+
+
+def cenarios(db, repeticoes, semente):
+    # (nome, repetições, função, preparar); os que gravam usam ICCIDs/remessas diferentes a cada repetição
+    novos = (gerar_iccid(EMISSOR_BENCHMARK, serial) for serial in range(10 ** 12))
+    disponiveis = [iccid for iccid, in db.executar(
+        "SELECT iccid FROM chips WHERE status = 'Disponível' ORDER BY id LIMIT ?", (repeticoes * 1000,))]
+    remessas = [remessa_id for remessa_id, in db.executar(
+        'SELECT id FROM remessas ORDER BY id DESC LIMIT ?', (repeticoes,))]
+    operadora, dia = OPERADORAS[0], DATA_INICIAL.strftime('%Y-%m-%d')
+    semana = (DATA_INICIAL + timedelta(days=6)).strftime('%Y-%m-%d')
+    ultimo_id = db.executar('SELECT MAX(id) FROM chips').fetchone()[0]
+    amostra = db.executar('SELECT iccid, remessa_id FROM chips WHERE id >= ? ORDER BY id LIMIT 1',
+                          (random.Random(semente).randint(1, ultimo_id),)).fetchone()
+    filtros = {
+        'todos': {},
+        'operadora': {'filtro_operadora': operadora},
+        'status': {'filtro_status': 'Disponível'},
+        'operadora_status': {'filtro_operadora': operadora, 'filtro_status': 'Retirado'},
+        'periodo': {'data_inicio': dia, 'data_fim': semana},
+        'remessa': {'remessa_id': amostra[1]},
+    }
+    lista = [
+        ('adicionar_chip', repeticoes * 20, lambda iccid: db.adicionar_chip(iccid, operadora),
+         lambda _: (next(novos),)),
+        ('adicionar_chips_lote[10000]', repeticoes,
+         lambda chips: db.adicionar_chips_lote(chips), lambda _: ([(next(novos), operadora) for _ in range(10000)],)),
+        ('retirar_chips_lote[1000]', repeticoes, lambda iccids: db.retirar_chips_lote(iccids, 'benchmark'),
+         lambda i: (disponiveis[i * 1000:(i + 1) * 1000],)),
+        ('estatisticas', repeticoes * 20, db.estatisticas, None),
+        ('estatisticas_por_operadora', repeticoes * 20, db.estatisticas_por_operadora, None),
+        ('gerar_numero_remessa', repeticoes * 20, db.gerar_numero_remessa, None),
+        ('buscar_iccid[final]', repeticoes * 20, lambda: db.buscar_iccid(amostra[0][-7:]), None),
+    ]
+    for nome, filtro in filtros.items():
+        lista.append((f'listar_chips_pagina[{nome}]', repeticoes * 4, lambda f=filtro: db.listar_chips_pagina(**f), None))
+        lista.append((f'contar_chips[{nome}]', repeticoes * 4, lambda f=filtro: db.contar_chips(**f), None))
+    for nome in ('periodo', 'remessa'):
+        # listar_chips devolve tudo de uma vez; só os filtros de resultado limitado fazem sentido aqui
+        lista.append((f'listar_chips[{nome}]', repeticoes, lambda f=filtros[nome]: db.listar_chips(**f), None))
+    lista.append(('excluir_remessa', len(remessas), lambda remessa_id: db.excluir_remessa(remessa_id, True),
+                  lambda i: (remessas[i],)))
+    lote_validacao = []
+
+    def iccids_validacao(_):
+        # Gerado só quando o cenário roda: 1 milhão de ICCIDs de 19 e 20 dígitos, metade com espaços em volta
+        if not lote_validacao:
+            for serial in range(10 ** 6):
+                iccid = gerar_iccid(1 + serial % 2, serial)
+                lote_validacao.append(f' {iccid} ' if serial % 2 else iccid)
+        return lote_validacao, set()
+
+    lista.append(('validar_iccids[1000000]', repeticoes, validar_iccids, iccids_validacao))
+    return lista
+
+
+def processador():
+    # platform.processor() costuma vir vazio no Linux; lá o modelo está em /proc/cpuinfo
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as arquivo:
+            for linha in arquivo:
+                if linha.startswith('model name'):
+                    return linha.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def copiar_base(base, pasta):
+    # Cada execução grava numa cópia, para a base gerada continuar igual
+    copia = os.path.join(pasta, 'benchmark_execucao.db')
+    for sufixo in ('-wal', '-shm'):
+        if os.path.exists(copia + sufixo):
+            os.remove(copia + sufixo)
+    shutil.copyfile(base, copia)
+    return copia
+
+
+def executar(args):
+    base = obter_base(args.pasta, args.quantidade, args.semente)
+    db = Database(copiar_base(base, args.pasta))
+    resultados = {}
+    try:
+        for nome, repeticoes, funcao, preparar in cenarios(db, args.repeticoes, args.semente):
+            if args.cenarios and not any(nome.startswith(prefixo) for prefixo in args.cenarios):
+                continue
+            resultados[nome] = medir(repeticoes, funcao, preparar)
+            print(f"{nome:40s} {resultados[nome]['mediana_ms']:10.3f} ms", file=sys.stderr)
+    finally:
+        db.fechar()
+    return {
+        'quantidade': args.quantidade, 'semente': args.semente, 'versao_gerador': VERSAO_GERADOR,
+        'data': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version, 'plataforma': platform.platform(),
+        'processador': processador(), 'nucleos': os.cpu_count(), 'cenarios': resultados,
+    }
+
+
+def cliente_carga(modo, destino, indice, inicio, duracao, semente):
+    # Uma estação simulada: cadastra remessas pequenas, retira parte dos próprios chips e faz as consultas
+    # da interface até o fim do tempo. Devolve [(operação, ms, erro ou None)]
+    rng = random.Random(semente * 1000 + indice)
+    if modo == 'servico':
+        from servico import ClienteServico
+        db = ClienteServico(destino)
+    else:
+        db = Database(destino)
+    operadora = OPERADORAS[indice % len(OPERADORAS)]
+    serial = indice * 10 ** 9
+    proprios, medidas = [], []
+    time.sleep(max(0.0, inicio - time.time()))
+    try:
+        while time.time() < inicio + duracao:
+            if rng.random() < FRACAO_ESCRITAS_CARGA:
+                if len(proprios) >= RETIRADOS_POR_VEZ_CARGA and rng.random() < 0.5:
+                    lote = [proprios.pop() for _ in range(RETIRADOS_POR_VEZ_CARGA)]
+                    nome, funcao = 'retirar_chips_lote', lambda: db.retirar_chips_lote(lote, 'carga')
+                else:
+                    lote = [(gerar_iccid(EMISSOR_BENCHMARK, serial + i), operadora)
+                            for i in range(CHIPS_POR_REMESSA_CARGA)]
+                    serial += CHIPS_POR_REMESSA_CARGA
+                    nome, funcao = 'cadastrar_remessa', lambda: db.cadastrar_remessa(lote, operadora, 'carga')
+            else:
+                nome, funcao = rng.choice((
+                    ('contar_chips', lambda: db.contar_chips(filtro_operadora=operadora)),
+                    ('listar_chips_pagina', lambda: db.listar_chips_pagina(filtro_operadora=operadora, limite=100)),
+                    ('buscar_iccid', lambda: db.buscar_iccid(f"{rng.randrange(10 ** 7):07d}")),
+                    ('estatisticas_por_operadora', db.estatisticas_por_operadora),
+                ))
+            comeco = time.perf_counter()
+            try:
+                funcao()
+            except Exception as e:
+                medidas.append((nome, (time.perf_counter() - comeco) * 1000, f"{type(e).__name__}: {e}"))
+                continue
+            medidas.append((nome, (time.perf_counter() - comeco) * 1000, None))
+            if nome == 'cadastrar_remessa':
+                proprios.extend(iccid for iccid, _ in lote)
+    finally:
+        db.fechar()
+    return medidas
+
+
+def resumir_carga(medidas, duracao):
+    por_operacao, erros = {}, Counter()
+    for nome, ms, erro in medidas:
+        tempos, falhas = por_operacao.setdefault(nome, ([], []))
+        (falhas if erro else tempos).append(ms)
+        if erro:
+            erros[erro] += 1
+    operacoes = {}
+    for nome, (tempos, falhas) in sorted(por_operacao.items()):
+        tempos.sort()
+        def percentil(p):
+            return round(tempos[min(len(tempos) - 1, int(p * len(tempos)))], 3) if tempos else None
+        operacoes[nome] = {'quantidade': len(tempos), 'por_s': round(len(tempos) / duracao, 1),
+                           'p50_ms': percentil(0.50), 'p95_ms': percentil(0.95), 'erros': len(falhas)}
+    concluidas = sum(item['quantidade'] for item in operacoes.values())
+    escritas = sum(operacoes.get(nome, {}).get('quantidade', 0) for nome in ('cadastrar_remessa', 'retirar_chips_lote'))
+    return {'operacoes_por_s': round(concluidas / duracao, 1), 'escritas_por_s': round(escritas / duracao, 1),
+            'erros': sum(erros.values()), 'erros_mais_comuns': erros.most_common(3), 'operacoes': operacoes}
+
+
+def executar_carga(args):
+    from servico import ServicoMonitoramento
+    base = obter_base(args.pasta, args.quantidade, args.semente)
+    modos = {}
+    # spawn: os clientes não herdam as conexões nem as threads do serviço que roda neste processo
+    contexto = multiprocessing.get_context('spawn')
+    for modo in args.modos:
+        db = Database(copiar_base(base, args.pasta))
+        servico = None
+        try:
+            if modo == 'servico':
+                servico = ServicoMonitoramento(db, porta=0, leitores=args.leitores).iniciar()
+            destino = servico.url if servico else db.db_name
+            with contexto.Pool(args.clientes) as pool:
+                inicio = time.time() + 2   # tempo para os processos subirem e começarem juntos
+                partes = pool.starmap(cliente_carga, [(modo, destino, indice, inicio, args.duracao, args.semente)
+                                                      for indice in range(args.clientes)])
+        finally:
+            if servico:
+                servico.encerrar()
+            db.fechar()
+        modos[modo] = resumir_carga(chain.from_iterable(partes), args.duracao)
+        if servico:
+            modos[modo]['grupos'] = servico.situacao()
+        print(f"{modo:10s} {modos[modo]['operacoes_por_s']:10.1f} op/s {modos[modo]['escritas_por_s']:10.1f} "
+              f"gravações/s {modos[modo]['erros']:6d} erros", file=sys.stderr)
+    return {
+        'quantidade': args.quantidade, 'semente': args.semente, 'clientes': args.clientes, 'duracao_s': args.duracao,
+        'data': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version, 'plataforma': platform.platform(), 'modos': modos,
+    }
+
+
+def gravar_json(dados, caminho):
+    texto = json.dumps(dados, ensure_ascii=False, indent=2)
+    if caminho:
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto + '\n')
+    else:
+        print(texto)
+
+
+def comparar_resultados(atual, referencia, tolerancia=TOLERANCIA_PADRAO, piso_ms=PISO_MS):
+    # [(cenário, ms referência, ms atual, variação, situação)]; situação: regressao | melhora | ok | novo | ausente
+    comparacao = []
+    antes, depois = referencia['cenarios'], atual['cenarios']
+    for nome in sorted(set(antes) | set(depois)):
+        if nome not in antes or nome not in depois:
+            comparacao.append((nome, antes.get(nome, {}).get('mediana_ms'), depois.get(nome, {}).get('mediana_ms'),
+                               None, 'novo' if nome in depois else 'ausente'))
+            continue
+        ms_antes, ms_depois = antes[nome]['mediana_ms'], depois[nome]['mediana_ms']
+        variacao = ms_depois / ms_antes - 1 if ms_antes else 0.0
+        situacao = 'ok'
+        if abs(ms_depois - ms_antes) >= piso_ms:
+            if variacao > tolerancia:
+                situacao = 'regressao'
+            elif variacao < -tolerancia:
+                situacao = 'melhora'
+        comparacao.append((nome, ms_antes, ms_depois, variacao, situacao))
+    return comparacao
+
+
+def relatar_comparacao(comparacao, atual, referencia, saida=sys.stderr):
+    if (atual['quantidade'], atual['semente']) != (referencia['quantidade'], referencia['semente']):
+        print(f"aviso: bases diferentes ({referencia['quantidade']}/{referencia['semente']} x "
+              f"{atual['quantidade']}/{atual['semente']})", file=saida)
+    for nome, ms_antes, ms_depois, variacao, situacao in comparacao:
+        if variacao is None:
+            print(f"{nome:40s} {situacao}", file=saida)
+        else:
+            print(f"{nome:40s} {ms_antes:10.3f} -> {ms_depois:10.3f} ms {variacao:+8.1%}  {situacao}", file=saida)
+    regressoes = sum(1 for item in comparacao if item[-1] == 'regressao')
+    print(f"{regressoes} regressão(ões)", file=saida)
+    return regressoes
+
+
+def ler_json(caminho):
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    cmd = comandos.add_parser('gerar', help="gera uma base sintética")
+    cmd.add_argument('--quantidade', type=int, required=True)
+    cmd.add_argument('--semente', type=int, default=42)
+    cmd.add_argument('--banco', required=True)
+
+    cmd = comandos.add_parser('executar', help="roda os cenários e grava o resultado em JSON")
+    cmd.add_argument('--quantidade', type=int, default=100000)
+    cmd.add_argument('--semente', type=int, default=42)
+    cmd.add_argument('--repeticoes', type=int, default=5)
+    cmd.add_argument('--pasta', default=PASTA, help="onde guardar as bases geradas (padrão: pasta do script)")
+    cmd.add_argument('--cenarios', nargs='*', help="só os cenários que começam com estes nomes")
+    cmd.add_argument('--saida', help="arquivo JSON do resultado (padrão: saída padrão)")
+    cmd.add_argument('--comparar', metavar='REFERENCIA', help="JSON de uma execução anterior")
+    cmd.add_argument('--tolerancia', type=float, default=TOLERANCIA_PADRAO)
+
+    cmd = comandos.add_parser('comparar', help="compara dois resultados já gravados")
+    cmd.add_argument('atual')
+    cmd.add_argument('referencia')
+    cmd.add_argument('--tolerancia', type=float, default=TOLERANCIA_PADRAO)
+
+    cmd = comandos.add_parser('carga', help="várias estações simultâneas, pelo serviço e/ou direto no banco")
+    cmd.add_argument('--quantidade', type=int, default=100000)
+    cmd.add_argument('--semente', type=int, default=42)
+    cmd.add_argument('--clientes', type=int, default=CLIENTES_CARGA)
+    cmd.add_argument('--duracao', type=float, default=DURACAO_CARGA, help="segundos de carga em cada modo")
+    cmd.add_argument('--modos', nargs='+', choices=MODOS_CARGA, default=list(MODOS_CARGA))
+    cmd.add_argument('--leitores', type=int, default=4, help="threads de leitura do serviço")
+    cmd.add_argument('--pasta', default=PASTA, help="onde guardar as bases geradas (padrão: pasta do script)")
+    cmd.add_argument('--saida', help="arquivo JSON do resultado (padrão: saída padrão)")
+    args = parser.parse_args()
+
+    if args.comando == 'gerar':
+        gerar_base(args.banco, args.quantidade, args.semente)
+        return
+    if args.comando == 'carga':
+        gravar_json(executar_carga(args), args.saida)
+        return
+    if args.comando == 'comparar':
+        atual, referencia = ler_json(args.atual), ler_json(args.referencia)
+    else:
+        atual = executar(args)
+        gravar_json(atual, args.saida)
+        if not args.comparar:
+            return
+        referencia = ler_json(args.comparar)
+    comparacao = comparar_resultados(atual, referencia, args.tolerancia)
+    if relatar_comparacao(comparacao, atual, referencia):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
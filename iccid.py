@@ -0,0 +1,137 @@
+import re
+
+# Validação de ICCIDs em lote (ITU-T E.118): 19 ou 20 dígitos, prefixo 89 (telecomunicações) e dígito
+# verificador de Luhn. Tudo é feito sobre buffers de bytes da coluna inteira, sem laço por caractere.
+TAMANHOS_ICCID = (19, 20)
+PREFIXO_ICCID = b'89'
+
+MOTIVO_ICCID_INVALIDO = 'ICCID inválido'
+MOTIVO_TAMANHO_ICCID = 'Tamanho inválido'
+MOTIVO_PREFIXO_ICCID = 'Prefixo diferente de 89'
+MOTIVO_DIGITO_VERIFICADOR = 'Dígito verificador inválido'
+MOTIVO_DUPLICADO_LOTE = 'Duplicado no lote'
+
+class FalhaChip(str):
+    # ICCID recusado no cadastro em lote; continua sendo a string do ICCID, com o motivo anexado
+    def __new__(cls, iccid, motivo):
+        falha = super().__new__(cls, iccid)
+        falha.motivo = motivo
+        return falha
+
+_DIGITOS = b'0123456789'
+_NAO_DIGITOS = bytes(b for b in range(256) if b not in _DIGITOS)
+_NAO_DIGITOS_NEM_SEPARADOR = _NAO_DIGITOS.replace(b'\n', b'')
+# Valor de cada dígito na soma de Luhn: normal e dobrado (2d, somando os algarismos quando passa de 9)
+_LUHN_NORMAL = bytes.maketrans(_DIGITOS, bytes(range(10)))
+_LUHN_DOBRADO = bytes.maketrans(_DIGITOS, bytes((2 * d) % 9 if d != 9 else 9 for d in range(10)))
+# Soma por ICCID (0..180, cabe num byte) -> 0 se múltipla de 10, 1 caso contrário
+_LUHN_FALHOU = bytes(0 if v % 10 == 0 else 1 for v in range(256))
+_DIFERENTE_DE = {d: bytes(0 if b == d else 1 for b in range(256)) for d in PREFIXO_ICCID}
+_NAO_NULO = re.compile(rb'[^\x00]')
+
+def normalizar_iccid(iccid):
+    # Mantém só os dígitos ASCII (espaços, hífens, aspas e afins somem)
+    if iccid.isdigit() and iccid.isascii():
+        return iccid
+    return iccid.encode('ascii', 'ignore').translate(None, _NAO_DIGITOS).decode('ascii')
+
+def normalizar_iccids(iccids):
+    # A coluna inteira vira um único buffer: um translate remove os não dígitos de todos de uma vez
+    if not iccids:
+        return []
+    texto = '\n'.join(iccids)
+    if texto.count('\n') != len(iccids) - 1:
+        return [normalizar_iccid(iccid) for iccid in iccids]
+    buffer = texto.encode('ascii', 'ignore')
+    if len(buffer) == len(texto) and not buffer.translate(None, _DIGITOS + b'\n'):
+        return list(iccids)
+    buffer = buffer.translate(None, _NAO_DIGITOS_NEM_SEPARADOR)
+    return buffer.decode('ascii').split('\n')
+
+def _falhas_luhn_prefixo(buffer, tamanho, quantidade):
+    # buffer tem `quantidade` ICCIDs de `tamanho` dígitos concatenados; a coluna k é buffer[k::tamanho].
+    # Cada coluna vira um inteiro com um byte por ICCID, e somar os inteiros soma todos os ICCIDs em paralelo
+    # (sem vai-um entre bytes, pois a soma máxima é 9 * 20)
+    soma = 0
+    for coluna in range(tamanho):
+        tabela = _LUHN_DOBRADO if (tamanho - 1 - coluna) % 2 else _LUHN_NORMAL
+        soma += int.from_bytes(buffer[coluna::tamanho].translate(tabela), 'big')
+    luhn = soma.to_bytes(quantidade, 'big').translate(_LUHN_FALHOU)
+    prefixo = 0
+    for coluna, digito in enumerate(PREFIXO_ICCID):
+        prefixo += int.from_bytes(buffer[coluna::tamanho].translate(_DIFERENTE_DE[digito]), 'big')
+    prefixo = prefixo.to_bytes(quantidade, 'big')
+    return ([m.start() for m in _NAO_NULO.finditer(prefixo)],
+            [m.start() for m in _NAO_NULO.finditer(luhn)])
+
+def validar_iccids(iccids, vistos=None):
+    # Retorna (normalizados, motivos): a lista normalizada, na mesma ordem da entrada, e {índice: motivo}
+    # apenas para os recusados. `vistos` (set) acumula os válidos entre chamadas para achar duplicatas
+    # entre blocos de um mesmo lote.
+    normalizados = normalizar_iccids(iccids)
+    motivos = {}
+    tamanhos = list(map(len, normalizados))
+    grupos = {}
+    if tamanhos and min(tamanhos) == max(tamanhos):
+        grupos[tamanhos[0]] = range(len(normalizados))
+    else:
+        for indice, tamanho in enumerate(tamanhos):
+            grupos.setdefault(tamanho, []).append(indice)
+    for tamanho, indices in grupos.items():
+        if tamanho not in TAMANHOS_ICCID:
+            motivo = MOTIVO_TAMANHO_ICCID if tamanho else MOTIVO_ICCID_INVALIDO
+            motivos.update(dict.fromkeys(indices, motivo))
+            continue
+        if isinstance(indices, range):
+            texto = ''.join(normalizados)
+        else:
+            texto = ''.join([normalizados[i] for i in indices])
+        prefixo, luhn = _falhas_luhn_prefixo(texto.encode('ascii'), tamanho, len(indices))
+        for posicao in luhn:
+            motivos[indices[posicao]] = MOTIVO_DIGITO_VERIFICADOR
+        for posicao in prefixo:
+            motivos[indices[posicao]] = MOTIVO_PREFIXO_ICCID
+
+    # Duplicatas: caminho rápido quando não há nenhuma (o caso comum)
+    if vistos is None:
+        vistos = set()
+    if motivos:
+        validos = [iccid for indice, iccid in enumerate(normalizados) if indice not in motivos]
+    else:
+        validos = normalizados
+    novos = set(validos)
+    if len(novos) == len(validos) and vistos.isdisjoint(novos):
+        vistos |= novos
+        return normalizados, motivos
+    for indice, iccid in enumerate(normalizados):
+        if indice in motivos:
+            continue
+        if iccid in vistos:
+            motivos[indice] = MOTIVO_DUPLICADO_LOTE
+        else:
+            vistos.add(iccid)
+    return normalizados, motivos
+
+def validar_iccid(iccid):
+    # (normalizado, motivo ou None) para um ICCID avulso
+    normalizados, motivos = validar_iccids([iccid])
+    return normalizados[0], motivos.get(0)
+
+def digito_verificador(corpo):
+    # Dígito de Luhn a acrescentar ao final de `corpo` (só dígitos)
+    soma = sum((_LUHN_DOBRADO if posicao % 2 == 0 else _LUHN_NORMAL)[ord(caractere)]
+               for posicao, caractere in enumerate(reversed(corpo)))
+    return str((10 - soma % 10) % 10)
+
+def resumir_falhas(falhas, limite=10):
+    # Texto curto: total por motivo e alguns exemplos de cada
+    por_motivo = {}
+    for falha in falhas:
+        por_motivo.setdefault(getattr(falha, 'motivo', MOTIVO_ICCID_INVALIDO), []).append(falha)
+    linhas = []
+    for motivo, itens in sorted(por_motivo.items(), key=lambda item: -len(item[1])):
+        linhas.append(f"{motivo}: {len(itens)}")
+        linhas.extend(f"   {falha or '(vazio)'}" for falha in itens[:limite])
+        if len(itens) > limite:
+            linhas.append(f"   ... e mais {len(itens) - limite}")
+    return '\n'.join(linhas)
@@ -0,0 +1,304 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+
+# Instrumentação do Database: tempo de cada instrução SQL (conexões com cursores que cronometram execute/
+# executemany, mais o trace do SQLite para o texto com os valores e os disparos de triggers) e de cada método
+# público, agregados por consulta normalizada e por método, com log rotativo das instruções lentas.
+# Num SELECT, execute mede até a primeira linha; a leitura do restante entra no tempo do método.
+# Sem um objeto Instrumentacao, o Database usa conexões comuns e nada disto roda; com ele desativado,
+# sobra uma verificação de atributo por chamada.
+LIMITE_LENTA_MS = 200
+AMOSTRAS_PERCENTIS = 1024           # p50/p95 sobre as últimas N execuções de cada consulta/método
+TAMANHO_LOG_LENTAS = 5 * 1024 * 1024
+COPIAS_LOG_LENTAS = 3
+MAX_SQL_LOG = 2000
+
+_CO_GERADOR = 0x20      # inspect.CO_GENERATOR, sem importar inspect (a interface importa este módulo ao abrir)
+
+# Métodos do Database que não são medidos: infraestrutura usada pelos próprios métodos medidos
+METODOS_NAO_MEDIDOS = {'get_connection', 'transacao', 'executar', 'fechar', 'iterar'}
+
+_LITERAIS = re.compile(r"'(?:[^']|'')*'|(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+
+
+@lru_cache(maxsize=4096)
+def normalizar_sql(sql):
+    # Mesmo formato de consulta -> mesma chave: espaços colapsados e literais trocados por ?
+    return _LITERAIS.sub('?', ' '.join(sql.split()))
+
+
+class Estatistica:
+    __slots__ = ('quantidade', 'total_ms', 'max_ms', 'amostras', 'lentas', 'eventos')
+
+    def __init__(self):
+        self.quantidade = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.amostras = deque(maxlen=AMOSTRAS_PERCENTIS)
+        self.lentas = 0
+        self.eventos = 0
+
+    def registrar(self, ms):
+        self.quantidade += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        self.amostras.append(ms)
+
+    def resumo(self):
+        ordenadas = sorted(self.amostras)
+        def percentil(p):
+            return ordenadas[min(len(ordenadas) - 1, int(p * len(ordenadas)))] if ordenadas else 0.0
+        return {'quantidade': self.quantidade, 'total_ms': round(self.total_ms, 3),
+                'p50_ms': round(percentil(0.50), 3), 'p95_ms': round(percentil(0.95), 3),
+                'max_ms': round(self.max_ms, 3), 'lentas': self.lentas}
+
+
+class CursorInstrumentado(sqlite3.Cursor):
+    def execute(self, sql, parametros=()):
+        instrumentacao = self.connection.instrumentacao
+        if not instrumentacao.ativa:
+            if self.connection.rastreando:
+                instrumentacao.parar_rastreio(self.connection)
+            return super().execute(sql, parametros)
+        inicio = instrumentacao.iniciar_instrucao(self.connection, sql)
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            instrumentacao.registrar_instrucao(sql, inicio)
+
+    def executemany(self, sql, sequencia):
+        instrumentacao = self.connection.instrumentacao
+        if not instrumentacao.ativa:
+            if self.connection.rastreando:
+                instrumentacao.parar_rastreio(self.connection)
+            return super().executemany(sql, sequencia)
+        inicio = instrumentacao.iniciar_instrucao(self.connection, sql)
+        try:
+            return super().executemany(sql, sequencia)
+        finally:
+            instrumentacao.registrar_instrucao(sql, inicio)
+
+
+class ConexaoInstrumentada(sqlite3.Connection):
+    # sqlite3.connect(..., factory=ConexaoInstrumentada); conn.instrumentacao é atribuído logo depois
+    instrumentacao = None
+    rastreando = False
+
+    def cursor(self, factory=CursorInstrumentado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, sequencia):
+        return self.cursor().executemany(sql, sequencia)
+
+
+class Instrumentacao:
+    def __init__(self, ativa=True, limite_lenta_ms=LIMITE_LENTA_MS, log_lentas=None):
+        self.ativa = ativa
+        self.limite_lenta_ms = limite_lenta_ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._consultas = {}
+        self._metodos = {}
+        self._desde = datetime.now()
+        self._log = None
+        if log_lentas:
+            import logging.handlers
+            self._log = logging.getLogger(f'monitoramento.lentas.{id(self)}')
+            self._log.propagate = False
+            self._log.setLevel(logging.INFO)
+            manipulador = logging.handlers.RotatingFileHandler(log_lentas, maxBytes=TAMANHO_LOG_LENTAS,
+                                                               backupCount=COPIAS_LOG_LENTAS, encoding='utf-8', delay=True)
+            manipulador.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self._log.addHandler(manipulador)
+
+    def ativar(self, ativa=True):
+        self.ativa = ativa
+
+    def zerar(self):
+        with self._lock:
+            self._consultas, self._metodos = {}, {}
+            self._desde = datetime.now()
+
+    def fechar(self):
+        if self._log:
+            for manipulador in list(self._log.handlers):
+                manipulador.close()
+                self._log.removeHandler(manipulador)
+
+    # --- conexões e instruções
+    def conectar(self, *args, **kwargs):
+        conn = sqlite3.connect(*args, factory=ConexaoInstrumentada, **kwargs)
+        conn.instrumentacao = self
+        return conn
+
+    def _rastrear(self, texto):
+        # Trace do SQLite: uma chamada traz a instrução com os valores; as demais são os triggers disparados, as
+        # instruções internas (ex.: do FTS5) e, no executemany, as linhas depois da primeira
+        local = self._local
+        if local.expandido is None and texto[:len(local.comando)].upper() == local.comando:
+            local.expandido = texto
+        else:
+            local.eventos += 1
+
+    def iniciar_instrucao(self, conn, sql):
+        # O trace é ligado na conexão na primeira instrução com a instrumentação ativa e desligado na primeira
+        # depois de desativada, sempre pela thread dona da conexão
+        if not conn.rastreando:
+            conn.set_trace_callback(self._rastrear)
+            conn.rastreando = True
+        local = self._local
+        local.expandido, local.eventos = None, 0
+        local.comando = sql.lstrip()[:6].upper()
+        return time.perf_counter()
+
+    def parar_rastreio(self, conn):
+        conn.set_trace_callback(None)
+        conn.rastreando = False
+
+    def registrar_instrucao(self, sql, inicio):
+        ms = (time.perf_counter() - inicio) * 1000
+        local = self._local
+        chave = normalizar_sql(sql)
+        lenta = ms >= self.limite_lenta_ms
+        with self._lock:
+            estatistica = self._consultas.get(chave)
+            if estatistica is None:
+                estatistica = self._consultas[chave] = Estatistica()
+            estatistica.registrar(ms)
+            estatistica.eventos += local.eventos
+            if lenta:
+                estatistica.lentas += 1
+        if lenta and self._log:
+            metodo = ' > '.join(getattr(local, 'metodos', ())) or '-'
+            texto = ' '.join((local.expandido or sql).split())[:MAX_SQL_LOG]
+            self._log.info('%.1f ms [%s] trace=%d %s', ms, metodo, local.eventos, texto)
+
+    # --- métodos do Database
+    def instrumentar(self, objeto, ignorar=METODOS_NAO_MEDIDOS):
+        # Troca, na instância, cada método público por um que mede o tempo da chamada (nos geradores, a soma
+        # dos passos da iteração)
+        for nome, funcao in vars(type(objeto)).items():
+            if nome.startswith('_') or nome in ignorar or not hasattr(funcao, '__code__'):
+                continue
+            metodo = getattr(objeto, nome)
+            if funcao.__code__.co_flags & _CO_GERADOR:
+                setattr(objeto, nome, self._medir_gerador(nome, metodo))
+            else:
+                setattr(objeto, nome, self._medir_metodo(nome, metodo))
+
+    def _pilha(self):
+        # Métodos em andamento na thread, do mais externo ao mais interno (vão para o log de lentas)
+        pilha = getattr(self._local, 'metodos', None)
+        if pilha is None:
+            pilha = self._local.metodos = []
+        return pilha
+
+    def _registrar_metodo(self, nome, ms):
+        with self._lock:
+            estatistica = self._metodos.get(nome)
+            if estatistica is None:
+                estatistica = self._metodos[nome] = Estatistica()
+            estatistica.registrar(ms)
+            if ms >= self.limite_lenta_ms:
+                estatistica.lentas += 1
+
+    def _medir_metodo(self, nome, metodo):
+        def medido(*args, **kwargs):
+            if not self.ativa:
+                return metodo(*args, **kwargs)
+            pilha = self._pilha()
+            pilha.append(nome)
+            inicio = time.perf_counter()
+            try:
+                return metodo(*args, **kwargs)
+            finally:
+                pilha.pop()
+                self._registrar_metodo(nome, (time.perf_counter() - inicio) * 1000)
+        medido.__name__ = nome
+        return medido
+
+    def _medir_gerador(self, nome, metodo):
+        def medido(*args, **kwargs):
+            if not self.ativa:
+                yield from metodo(*args, **kwargs)
+                return
+            # Conta só o tempo em que o gerador trabalha, não o de quem consome cada item
+            gerador = metodo(*args, **kwargs)
+            total = 0.0
+            try:
+                while True:
+                    pilha = self._pilha()
+                    pilha.append(nome)
+                    inicio = time.perf_counter()
+                    try:
+                        item = next(gerador)
+                    except StopIteration:
+                        return
+                    finally:
+                        total += time.perf_counter() - inicio
+                        pilha.pop()
+                    yield item
+            finally:
+                gerador.close()
+                self._registrar_metodo(nome, total * 1000)
+        medido.__name__ = nome
+        return medido
+
+    # --- instantâneo e formatos de saída
+    def instantaneo(self):
+        with self._lock:
+            consultas = [dict(sql=sql, eventos_trace=estatistica.eventos, **estatistica.resumo())
+                         for sql, estatistica in self._consultas.items()]
+            metodos = [dict(metodo=nome, **estatistica.resumo()) for nome, estatistica in self._metodos.items()]
+            desde = self._desde
+        consultas.sort(key=lambda item: -item['total_ms'])
+        metodos.sort(key=lambda item: -item['total_ms'])
+        return {'ativa': self.ativa, 'desde': desde.strftime('%Y-%m-%d %H:%M:%S'),
+                'limite_lenta_ms': self.limite_lenta_ms, 'consultas': consultas, 'metodos': metodos}
+
+    def json(self):
+        return json.dumps(self.instantaneo(), ensure_ascii=False, indent=2)
+
+    def prometheus(self):
+        # Formato de texto do Prometheus: summaries em segundos (p50/p95, _sum, _count) e o máximo como gauge
+        dados = self.instantaneo()
+        linhas = []
+        for nome, rotulo, itens, descricao in (
+                ('monitoramento_sql_duracao_segundos', 'consulta', dados['consultas'],
+                 "Duração das instruções SQL por consulta normalizada"),
+                ('monitoramento_metodo_duracao_segundos', 'metodo', dados['metodos'],
+                 "Duração das chamadas aos métodos do Database")):
+            linhas += [f'# HELP {nome} {descricao}', f'# TYPE {nome} summary']
+            maximos = [f'# TYPE {nome}_max gauge']
+            lentas = [f'# TYPE {nome}_lentas_total counter']
+            for item in itens:
+                valor = item['sql' if rotulo == 'consulta' else 'metodo']
+                valor = valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+                rotulos = f'{rotulo}="{valor}"'
+                linhas.append(f'{nome}{{{rotulos},quantile="0.5"}} {item["p50_ms"] / 1000:.6f}')
+                linhas.append(f'{nome}{{{rotulos},quantile="0.95"}} {item["p95_ms"] / 1000:.6f}')
+                linhas.append(f'{nome}_sum{{{rotulos}}} {item["total_ms"] / 1000:.6f}')
+                linhas.append(f'{nome}_count{{{rotulos}}} {item["quantidade"]}')
+                maximos.append(f'{nome}_max{{{rotulos}}} {item["max_ms"] / 1000:.6f}')
+                lentas.append(f'{nome}_lentas_total{{{rotulos}}} {item["lentas"]}')
+            linhas += maximos + lentas
+        return '\n'.join(linhas) + '\n'
+
+    def gravar(self, caminho, formato=None):
+        # formato: 'json' ou 'prometheus' (padrão: pela extensão, .prom/.txt -> prometheus)
+        if formato is None:
+            formato = 'prometheus' if caminho.lower().endswith(('.prom', '.txt')) else 'json'
+        texto = self.prometheus() if formato == 'prometheus' else self.json() + '\n'
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto)
+        return formato
@@ -0,0 +1,69 @@
+"""Mede o tempo de inicialização do monitoramento.py até a primeira pintura da janela.
+
+Uso:
+    python medir_inicializacao.py [--repeticoes 5] [--orcamento-ms 1000]
+
+Cada repetição abre um processo Python novo (cache de imports frio do ponto de vista do
+interpretador) com MONITORAMENTO_MEDIR_INICIO=1; o programa avisa quando a janela foi
+pintada e fecha. Cada processo roda numa pasta temporária nova e cria nela o próprio
+chips.db (o banco da pasta do programa nunca é aberto). Também mede só o
+`import monitoramento_gui` (banco + interface), para separar custo de import do custo
+de montar a interface. Termina com código 1 se a mediana passar do orçamento.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+ORCAMENTO_PRIMEIRA_PINTURA_MS = 1000
+
+
+def medir_processo(argumentos, marcador=None):
+    # O chips.db padrão é relativo à pasta atual: numa pasta temporária, o banco medido é descartável
+    env = dict(os.environ, MONITORAMENTO_MEDIR_INICIO='1',
+               PYTHONPATH=os.pathsep.join(filter(None, (PASTA, os.environ.get('PYTHONPATH')))))
+    with tempfile.TemporaryDirectory() as pasta_temporaria:
+        inicio = time.perf_counter()
+        processo = subprocess.Popen([sys.executable] + argumentos, cwd=pasta_temporaria, env=env,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if marcador:
+            for linha in processo.stdout:
+                if linha.strip() == marcador:
+                    break
+            else:
+                processo.wait()
+                raise RuntimeError(f"o programa terminou sem sinalizar {marcador}:\n{processo.stderr.read()}")
+            decorrido = (time.perf_counter() - inicio) * 1000
+        processo.communicate()
+        if not marcador:
+            decorrido = (time.perf_counter() - inicio) * 1000
+    if processo.returncode:
+        raise RuntimeError(f"falha ao executar {' '.join(argumentos)} (código {processo.returncode})")
+    return decorrido
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--orcamento-ms', type=float, default=ORCAMENTO_PRIMEIRA_PINTURA_MS)
+    args = parser.parse_args()
+
+    imports = [medir_processo(['-c', 'import monitoramento_gui']) for _ in range(args.repeticoes)]
+    programa = os.path.join(PASTA, 'monitoramento.py')
+    pinturas = [medir_processo([programa], 'PRIMEIRA_PINTURA') for _ in range(args.repeticoes)]
+
+    print(f"import monitoramento_gui: mediana {statistics.median(imports):.0f} ms (mín {min(imports):.0f} ms)")
+    print(f"primeira pintura:        mediana {statistics.median(pinturas):.0f} ms (mín {min(pinturas):.0f} ms)")
+    mediana = statistics.median(pinturas)
+    if mediana > args.orcamento_ms:
+        print(f"ACIMA do orçamento de {args.orcamento_ms:.0f} ms")
+        sys.exit(1)
+    print(f"Dentro do orçamento de {args.orcamento_ms:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
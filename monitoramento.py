@@ -1,568 +1,2246 @@
 
 import sqlite3
-import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext, filedialog
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from operator import itemgetter
+import argparse
 import csv
-
-
-# Tentar importar openpyxl para suporte XLSX
-try:
+import gzip
+import heapq
+import importlib.util
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from iccid import FalhaChip, normalizar_iccid, normalizar_iccids, resumir_falhas, validar_iccid, validar_iccids
+
+# Este módulo (banco de dados + linha de comando) não importa tkinter; a interface gráfica fica em
+# monitoramento_gui.py e só é carregada quando o programa é aberto sem subcomando.
+
+# Dependências opcionais: só se verifica se estão instaladas; o import de fato acontece no primeiro uso
+XLSX_AVAILABLE = importlib.util.find_spec('openpyxl') is not None
+
+def carregar_openpyxl():
     import openpyxl
-    XLSX_AVAILABLE = True
-except ImportError:
-    XLSX_AVAILABLE = False
-
-# Para gráficos dinâmicos
-try:
-    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-    import matplotlib.pyplot as plt
-    MATPLOTLIB_AVAILABLE = True
-except ImportError:
-    MATPLOTLIB_AVAILABLE = False
-
-# Paleta de cores modernas
-COR_PRIMARIA = '#6366f1'
-COR_SECUNDARIA = '#8b5cf6'
-COR_ACCENT = '#06b6d4'
-COR_SUCESSO = '#10b981'
-COR_ERRO = '#ef4444'
-COR_FUNDO = '#f8fafc'
-COR_CARD = '#ffffff'
-COR_TEXTO = '#1e293b'
-COR_TEXTO_SECUNDARIO = '#64748b'
+    return openpyxl
 
 OPERADORAS = ['Claro', 'Tim', 'Arquia', 'Quectel Tim', 'Quectel Vivo', 'Vivo']
 
-# Botão moderno
-class ModernButton(tk.Canvas):
-    def __init__(self, parent, text, command, width=150, height=40,
-    
-                 bg_color=COR_PRIMARIA, hover_color=COR_SECUNDARIA,
-                 text_color='white', font=('Segoe UI', 10, 'bold')):
-        super().__init__(parent, width=width, height=height,
-                         highlightthickness=0, relief=tk.FLAT, bg=parent.cget('bg'))
-        self.command = command
-        self.bg_color = bg_color
-        self.hover_color = hover_color
-        self.text_color = text_color
-        self.font = font
-        self.text = text
-        self.button_id = self.create_rectangle(2, 2, width-2, height-2,
-                                               fill=bg_color, outline='', width=0)
-        self.text_id = self.create_text(width//2, height//2, text=text,
-                                        fill=text_color, font=font)
-        self.bind('<Enter>', self.on_enter)
-        self.bind('<Leave>', self.on_leave)
-        self.tag_bind(self.button_id, '<Button-1>', lambda e: self.command())
-        self.tag_bind(self.text_id, '<Button-1>', lambda e: self.command())
-
-    def on_enter(self, event):
-        self.itemconfig(self.button_id, fill=self.hover_color)
-        self.configure(cursor='hand2')
-
-    def on_leave(self, event):
-        self.itemconfig(self.button_id, fill=self.bg_color)
-        self.configure(cursor='')
-
-class CardFrame(tk.Frame):
-    def __init__(self, parent, **kwargs):
-        bg = kwargs.pop('bg', COR_CARD)
-        super().__init__(parent, bg=bg, **kwargs)
-        self.config(relief=tk.FLAT, bd=0)
-        self.inner_frame = tk.Frame(self, bg=bg, relief=tk.FLAT)
-        self.inner_frame.pack(fill=tk.BOTH, expand=True, padx=2, pady=2)
+# Cadastro em lote
+TAMANHO_LOTE_PADRAO = 100000
+
+MOTIVO_JA_CADASTRADO = 'Já cadastrado'
+
+def _acumular_chips(deltas, sinal, quantidade, operadora, status, remessa_id, data_entrada, data_saida):
+    # Espelho em Python dos triggers de contadores (ver DIMENSOES_CHIPS), usado pelas operações em lote
+    chaves = (('geral', ''), ('operadora', operadora), ('remessa', '' if remessa_id is None else str(remessa_id)),
+              ('entrada_dia', data_entrada[:10]), ('saida_dia', (data_saida or '')[:10]))
+    disponiveis = quantidade if status == 'Disponível' else 0
+    retirados = quantidade if status == 'Retirado' else 0
+    for chave in chaves:
+        valores = deltas.setdefault(chave, [0, 0, 0])
+        valores[0] += sinal * quantidade
+        valores[1] += sinal * disponiveis
+        valores[2] += sinal * retirados
+
+def em_blocos(iteravel, tamanho):
+    iterador = iter(iteravel)
+    while True:
+        bloco = list(islice(iterador, tamanho))
+        if not bloco:
+            return
+        yield bloco
+
+# Importação de arquivos (CSV com ';' ou XLSX: coluna A ICCID, coluna B operadora)
+LINHAS_PREVIA = 50
+MOTIVO_OPERADORA_INVALIDA = 'Operadora inválida'
+
+def ler_linhas_arquivo(arquivo):
+    # Gera (iccid, operadora) linha a linha, sem carregar o arquivo inteiro em memória ('-' lê da entrada padrão)
+    if arquivo == '-':
+        for row in csv.reader(sys.stdin, delimiter=';'):
+            if row and row[0]:
+                yield row[0], row[1].strip() if len(row) > 1 else ''
+    elif arquivo.lower().endswith('.xlsx'):
+        if not XLSX_AVAILABLE:
+            raise RuntimeError("Instale o openpyxl para importar arquivos XLSX.")
+        wb = carregar_openpyxl().load_workbook(arquivo, read_only=True)
+        try:
+            for row in wb.active.iter_rows(values_only=True):
+                if row and row[0]:
+                    yield str(row[0]), str(row[1]).strip() if len(row) > 1 and row[1] else ''
+        finally:
+            wb.close()
+    else:
+        with open(arquivo, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f, delimiter=';'):
+                if row and row[0]:
+                    yield row[0], row[1].strip() if len(row) > 1 else ''
+
+def ler_linhas_texto(texto):
+    # Mesmo formato da digitação manual: ICCID,Operadora por linha
+    for linha in texto.splitlines():
+        partes = [p.strip() for p in linha.split(',')]
+        if partes[0]:
+            yield partes[0], partes[1] if len(partes) > 1 else ''
+
+def contar_linhas_arquivo(arquivo):
+    # Estimativa barata do total, usada só para a barra de progresso
+    if arquivo.lower().endswith('.xlsx'):
+        if not XLSX_AVAILABLE:
+            return None
+        wb = carregar_openpyxl().load_workbook(arquivo, read_only=True)
+        try:
+            return wb.active.max_row
+        finally:
+            wb.close()
+    total = 0
+    with open(arquivo, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            total += bloco.count(b'\n')
+    return total
+
+def preparar_chips(linhas, operadora_padrao, falhas):
+    # Descarta cabeçalhos/linhas sem dígitos e aplica a operadora da remessa quando a linha não traz uma
+    for iccid, operadora in linhas:
+        if not any(c.isdigit() for c in iccid):
+            continue
+        operadora = operadora or operadora_padrao
+        if operadora not in OPERADORAS:
+            falhas.append(FalhaChip(iccid, MOTIVO_OPERADORA_INVALIDA))
+            continue
+        yield iccid, operadora
+
+def validar_linhas(linhas, operadora_padrao, progresso=None):
+    # Passada de validação sem gravar nada: (linhas com ICCID, quantos seriam cadastrados, recusados)
+    falhas, vistos, total = [], set(), 0
+    for bloco in em_blocos(preparar_chips(linhas, operadora_padrao, falhas), TAMANHO_LOTE_PADRAO):
+        iccids, motivos = validar_iccids([iccid for iccid, _ in bloco], vistos)
+        falhas.extend(FalhaChip(iccids[indice] or bloco[indice][0], motivo)
+                      for indice, motivo in sorted(motivos.items()))
+        total += len(bloco)
+        if progresso:
+            progresso(total)
+    validos = total - sum(1 for falha in falhas if falha.motivo != MOTIVO_OPERADORA_INVALIDA)
+    return total, validos, falhas
+
+# Exportação: linha a linha, com memória constante, em CSV (';', como na importação), CSV + gzip ou XLSX
+FORMATOS_EXPORTACAO = ('csv', 'csv.gz', 'xlsx')
+TAMANHO_BLOCO_EXPORTACAO = 5000
+CABECALHO_CHIPS = ('ICCID', 'Operadora', 'Status', 'Entrada', 'Saída', 'Retirado Por')
+CABECALHO_REMESSAS = ('ID', 'Número', 'Data', 'Operadora', 'Quantidade', 'Observações')
+
+def formato_exportacao(caminho):
+    nome = caminho.lower()
+    if nome.endswith('.xlsx'):
+        return 'xlsx'
+    if nome.endswith('.gz'):
+        return 'csv.gz'
+    return 'csv'
+
+def escrever_tabela(destino, cabecalho, linhas, formato=None, progresso=None, nome_planilha='Dados'):
+    # destino: caminho, ou um arquivo já aberto (texto para csv, binário para csv.gz). Retorna quantas linhas
+    # foram escritas; em caso de erro ou cancelamento, o arquivo incompleto é apagado
+    formato = formato or (formato_exportacao(destino) if isinstance(destino, str) else 'csv')
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError(f"Formato de exportação desconhecido: {formato}")
+    if formato == 'xlsx' and not XLSX_AVAILABLE:
+        raise RuntimeError("Instale o openpyxl para exportar arquivos XLSX.")
+    total = 0
+
+    def contar(linhas):
+        nonlocal total
+        for total, linha in enumerate(linhas, 1):
+            if progresso and total % TAMANHO_BLOCO_EXPORTACAO == 0:
+                progresso(total)
+            yield linha
+
+    try:
+        if formato == 'xlsx':
+            wb = carregar_openpyxl().Workbook(write_only=True)
+            ws = wb.create_sheet(nome_planilha)
+            ws.append(cabecalho)
+            for linha in contar(linhas):
+                ws.append(linha)
+            wb.save(destino)
+        else:
+            if formato == 'csv.gz':
+                arquivo = gzip.open(destino, 'wt', encoding='utf-8', newline='')
+            elif isinstance(destino, str):
+                arquivo = open(destino, 'w', encoding='utf-8', newline='')
+            else:
+                arquivo = destino
+            try:
+                escritor = csv.writer(arquivo, delimiter=';', lineterminator='\n')
+                escritor.writerow(cabecalho)
+                escritor.writerows(contar(linhas))
+            finally:
+                if arquivo is not destino:
+                    arquivo.close()
+    except BaseException:
+        if isinstance(destino, str) and os.path.exists(destino):
+            os.remove(destino)
+        raise
+    if progresso:
+        progresso(total)
+    return total
 
 # Banco de dados
+# Pragmas aplicados a cada conexão persistente (uma por thread)
+# BEGIN IMMEDIATE disputado: além da espera do próprio SQLite (timeout da conexão), novas tentativas com
+# espera exponencial e aleatória, limitada
+TENTATIVAS_BLOQUEIO = 5
+ESPERA_INICIAL_BLOQUEIO = 0.05
+ESPERA_MAXIMA_BLOQUEIO = 2.0
+
+PRAGMAS_CONEXAO = (
+    'PRAGMA cache_size=-65536',       # 64 MB de cache de páginas
+    'PRAGMA mmap_size=268435456',     # 256 MB mapeados em memória
+    'PRAGMA temp_store=MEMORY',
+)
+
+# Armazenamento compacto (migração 10): chips_dados e remessas_dados guardam o ICCID como inteiro, as datas em
+# segundos (o horário local gravado, lido como se fosse UTC: datetime(x, 'unixepoch') devolve o mesmo texto) e
+# operadora, status e responsável como ids das tabelas operadoras, status e pessoas. As views chips e remessas
+# mostram as colunas como antes (e aceitam INSERT/UPDATE/DELETE por triggers INSTEAD OF); o Database filtra e
+# ordena pelas colunas codificadas, com índices menores, e só decodifica as linhas devolvidas
+STATUS_IDS = {'Disponível': 1, 'Retirado': 2}
+COLUNAS_CHIPS = 'iccid, operadora, status, data_entrada, data_saida, retirado_por'
+
+def codificar_iccid(iccid):
+    # Os 18 dígitos depois do "89" (com um 0 no fim nos ICCIDs de 19 dígitos) vezes 2, mais 1 nos de 20 dígitos:
+    # cabe em 8 bytes e mantém a ordem do texto. O que não for um ICCID de 19 ou 20 dígitos fica como texto
+    if len(iccid) in (19, 20) and iccid.startswith('89') and iccid.isascii() and iccid.isdigit():
+        return int((iccid + '0')[2:20]) * 2 + (len(iccid) == 20)
+    return iccid
+
+def faixa_prefixo_iccid(prefixo):
+    # (menor, maior) código de codificar_iccid entre os ICCIDs que começam por `prefixo` (só dígitos), ou None
+    if len(prefixo) > 20 or not (prefixo.startswith('89') or '89'.startswith(prefixo)):
+        return None
+    resto = prefixo[2:]
+    return int(resto.ljust(18, '0')) * 2 + (len(prefixo) == 20), int(resto.ljust(18, '9')) * 2 + 1
+
+def _sql_codificar_iccid(x):
+    return (f"CASE WHEN length({x}) IN (19, 20) AND {x} GLOB '89*' AND {x} NOT GLOB '*[^0-9]*' "
+            f"THEN CAST(substr({x} || '0', 3, 18) AS INTEGER) * 2 + (length({x}) = 20) ELSE {x} END")
+
+def _sql_iccid(x):
+    # A partir de 2 * 10^17 não há zeros à esquerda a repor e a divisão basta (printf custa bem mais); texto nunca
+    # fica entre dois inteiros, então o BETWEEN também dispensa o typeof no caso comum
+    return (f"CASE WHEN {x} BETWEEN 200000000000000000 AND 1999999999999999999 "
+            f"THEN '89' || ({x} / CASE WHEN {x} % 2 THEN 2 ELSE 20 END) "
+            f"WHEN typeof({x}) = 'integer' THEN '89' || substr(printf('%018d', {x} / 2), 1, 17 + {x} % 2) ELSE {x} END")
+
+def _sql_status(x):
+    return f'CASE {x}' + ''.join(f" WHEN {id_status} THEN '{nome}'" for nome, id_status in STATUS_IDS.items()) + ' END'
+
+def _sql_nome(tabela, x):
+    return f'(SELECT nome FROM {tabela} WHERE id = {x})'
+
+def _sql_id(tabela, x):
+    return f'(SELECT id FROM {tabela} WHERE nome = {x})'
+
+def _sql_segundos(x):
+    return f"CAST(strftime('%s', {x}) AS INTEGER)"
+
+def _sql_data(x):
+    return f"datetime({x}, 'unixepoch')"
+
+def _sql_dia(x):
+    return f"date({x}, 'unixepoch')"
+
+def _sql_decodificar_chips(c, operadora, retirado_por):
+    # COLUNAS_CHIPS lidas de uma linha compacta (alias c), com as expressões dadas para os dois nomes
+    return ', '.join((f'{_sql_iccid(c + ".iccid")} AS iccid', f'{operadora} AS operadora',
+                      f'{_sql_status(c + ".status")} AS status', f'{_sql_data(c + ".data_entrada")} AS data_entrada',
+                      f'{_sql_data(c + ".data_saida")} AS data_saida', f'{retirado_por} AS retirado_por'))
+
+def _sql_codificar_chips(l):
+    # COLUNAS_CHIPS de uma linha no formato antigo (alias ou NEW), codificadas; os nomes já devem estar nas tabelas
+    return ', '.join((_sql_codificar_iccid(f'{l}.iccid'), _sql_id('operadoras', f'{l}.operadora'),
+                      _sql_id('status', f"COALESCE({l}.status, 'Disponível')"), _sql_segundos(f'{l}.data_entrada'),
+                      _sql_segundos(f'{l}.data_saida'), _sql_id('pessoas', f'{l}.retirado_por')))
+
+# Nas consultas do Database os nomes vêm de LEFT JOINs (mais baratos que uma subconsulta por linha, e o LEFT
+# mantém chips_dados como tabela externa, percorrida pelo índice do ORDER BY)
+COLUNAS_CHIPS_DECODIFICADAS = _sql_decodificar_chips('c', 'o.nome', 'p.nome')
+NOMES_CHIPS = ' LEFT JOIN operadoras o ON o.id = c.operadora LEFT JOIN pessoas p ON p.id = c.retirado_por'
+
+# Números REM-AAAAMMDD-NNNN: uma linha por dia em sequencias_remessa, incrementada na transação que cria a remessa
+SQL_ALOCAR_NUMERO_REMESSA = '''
+    INSERT INTO sequencias_remessa (dia, ultimo) VALUES (?, 1)
+    ON CONFLICT (dia) DO UPDATE SET ultimo = ultimo + 1
+'''
+
+# Consultas do Database que passam pela verificação de plano (EXPLAIN QUERY PLAN)
+SQL_SEQUENCIA_REMESSA = 'SELECT ultimo FROM sequencias_remessa WHERE dia = ?'
+SQL_LISTAR_REMESSAS = f'''
+    SELECT r.id, r.numero_remessa, {_sql_data('r.data_remessa')}, {_sql_nome('operadoras', 'r.operadora')}, r.quantidade,
+           r.observacoes
+    FROM remessas_dados r ORDER BY r.data_remessa DESC
+'''
+SQL_ESTATISTICAS = '''
+    SELECT dimensao, total, disponiveis, retirados FROM contadores
+    WHERE dimensao IN ('geral', 'remessas') AND chave = ''
+'''
+SQL_CONTADOR = 'SELECT total, disponiveis, retirados FROM contadores WHERE dimensao=? AND chave=?'
+SQL_CONTADOR_ARQUIVO = 'SELECT total, disponiveis, retirados FROM arquivo.contadores_arquivo WHERE dimensao=? AND chave=?'
+SQL_CONTADORES_DIMENSAO = '''
+    SELECT chave, total, disponiveis, retirados FROM contadores
+    WHERE dimensao=? AND total > 0 ORDER BY chave
+'''
+SQL_CONTADORES_DIMENSAO_ARQUIVO = SQL_CONTADORES_DIMENSAO.replace('FROM contadores', 'FROM arquivo.contadores_arquivo')
+SQL_SERIE_DIARIA = '''
+    SELECT dimensao, chave, total FROM contadores
+    WHERE dimensao IN ('entrada_dia', 'saida_dia') AND chave >= ?
+'''
+
+# Dimensões dos contadores de chips: (dimensão, expressão da chave sobre uma linha de chips, com {l} = NEW/OLD/chips)
+_DIMENSOES_CHIPS_V3 = (
+    ('geral', "''"),
+    ('operadora', '{l}.operadora'),
+    ('remessa', "COALESCE(CAST({l}.remessa_id AS TEXT), '')"),
+)
+DIMENSOES_CHIPS = _DIMENSOES_CHIPS_V3 + (
+    ('entrada_dia', 'substr({l}.data_entrada, 1, 10)'),
+    ('saida_dia', "COALESCE(substr({l}.data_saida, 1, 10), '')"),
+)
+# As mesmas chaves sobre chips_dados (e o arquivo), com os valores de status de cada formato
+DIMENSOES_CHIPS_COMPACTOS = (
+    ('geral', "''"),
+    ('operadora', _sql_nome('operadoras', '{l}.operadora')),
+    ('remessa', "COALESCE(CAST({l}.remessa_id AS TEXT), '')"),
+    ('entrada_dia', _sql_dia('{l}.data_entrada')),
+    ('saida_dia', f"COALESCE({_sql_dia('{l}.data_saida')}, '')"),
+)
+STATUS_TEXTO = ("'Disponível'", "'Retirado'")
+STATUS_COMPACTO = (str(STATUS_IDS['Disponível']), str(STATUS_IDS['Retirado']))
+# Como os triggers de chips leem cada coluna ('{0}' é a coluna de NEW/OLD): no formato em texto (migrações 3 a 9),
+# o próprio valor; no compacto (migração 10), decodificado. 'status' são os valores de Disponível e Retirado
+FORMATO_TEXTO = {'iccid': '{0}', 'operadora': '{0}', 'data': '{0}', 'pessoa': '{0}', 'status': STATUS_TEXTO}
+FORMATO_COMPACTO = {'iccid': _sql_iccid('{0}'), 'operadora': _sql_nome('operadoras', '{0}'),
+                    'data': _sql_data('{0}'), 'pessoa': _sql_nome('pessoas', '{0}'), 'status': STATUS_COMPACTO}
+
+def _sql_recalcular_contadores(dimensoes, tabela='chips', status=STATUS_TEXTO, remessas=True):
+    # Recalcula do zero todos os contadores; usado nas migrações e na verificação de divergências
+    partes = [f'''
+        SELECT '{dimensao}', {expressao.format(l=tabela)}, COUNT(*),
+               SUM(status = {status[0]}), SUM(status = {status[1]})
+        FROM {tabela} GROUP BY 2''' for dimensao, expressao in dimensoes]
+    if remessas:
+        partes.append("SELECT 'remessas', '', COUNT(*), 0, 0 FROM remessas")
+    return '\nUNION ALL\n'.join(partes)
+
+SQL_RECALCULAR_CONTADORES = _sql_recalcular_contadores(DIMENSOES_CHIPS_COMPACTOS, 'chips_dados', STATUS_COMPACTO)
+
+SQL_CRIAR_LOTE_CHIPS = '''
+    CREATE TEMP TABLE IF NOT EXISTS lote_chips (
+        iccid TEXT NOT NULL,
+        operadora TEXT NOT NULL
+    )
+'''
+SQL_CHIPS_JA_CADASTRADOS = f'''
+    SELECT l.iccid FROM temp.lote_chips l JOIN chips_dados c ON c.iccid = {_sql_codificar_iccid('l.iccid')}
+'''
+SQL_GRAVAR_LOTE_CHIPS = f'''
+    INSERT OR IGNORE INTO chips_dados (iccid, operadora, data_entrada, remessa_id)
+    SELECT {_sql_codificar_iccid('l.iccid')}, o.id, {_sql_segundos('?')}, ?
+    FROM temp.lote_chips l JOIN operadoras o ON o.nome = l.operadora
+    ORDER BY l.iccid
+'''
+# Retirada: lotes de TAMANHO_LOTE_RETIRADA ICCIDs, todos na mesma transação (o progresso é informado entre eles)
+TAMANHO_LOTE_RETIRADA = 5000
+SQL_CRIAR_LOTE_RETIRADA = 'CREATE TEMP TABLE IF NOT EXISTS lote_retirada (iccid TEXT PRIMARY KEY)'
+SQL_DIAGNOSTICO_RETIRADA = f'''
+    SELECT l.iccid, {_sql_status('c.status')}, {_sql_nome('pessoas', 'c.retirado_por')},
+           {_sql_data('c.data_saida')}, {_sql_nome('operadoras', 'c.operadora')}, c.remessa_id,
+           {_sql_data('c.data_entrada')}
+    FROM temp.lote_retirada l LEFT JOIN chips_dados c ON c.iccid = {_sql_codificar_iccid('l.iccid')}
+'''
+SQL_RETIRAR_LOTE = f'''
+    UPDATE chips_dados SET status = {STATUS_IDS['Retirado']}, data_saida = {_sql_segundos('?')},
+                           retirado_por = {_sql_id('pessoas', '?')}
+    WHERE status = {STATUS_IDS['Disponível']}
+      AND iccid IN (SELECT {_sql_codificar_iccid('iccid')} FROM temp.lote_retirada)
+'''
+# Busca por parte do ICCID: início pelo índice UNIQUE de iccid (a faixa de faixa_prefixo_iccid e, para os
+# guardados como texto, [trecho, trecho + ':'], já que ':' vem logo depois de '9' e todo texto vem depois dos
+# inteiros), final ou trecho pelo índice de trigramas chips_busca (LIKE com 3+ dígitos)
+SQL_BUSCA_PREFIXO = f'''
+    SELECT {COLUNAS_CHIPS_DECODIFICADAS} FROM {{tabela}} c{NOMES_CHIPS}
+    WHERE c.iccid BETWEEN ? AND ? ORDER BY c.iccid LIMIT ?
+'''
+SQL_BUSCA_TRECHO = f'''
+    SELECT {COLUNAS_CHIPS_DECODIFICADAS}
+    FROM chips_busca b JOIN chips_dados c ON c.id = b.rowid{NOMES_CHIPS}
+    WHERE b.iccid LIKE ? LIMIT ?
+'''
+SQL_INDEXAR_BUSCA_NOVOS = f'INSERT INTO chips_busca (rowid, iccid) SELECT c.id, {_sql_iccid("c.iccid")} FROM chips_dados c WHERE c.id > ?'
+BUSCA_INICIO = 'inicio'
+BUSCA_FINAL = 'final'
+BUSCA_CONTEM = 'contem'
+MIN_DIGITOS_BUSCA = 3
+LIMITE_BUSCA_ICCID = 50
+
+# Arquivamento: chips retirados há mais de IDADE_ARQUIVAMENTO_DIAS saem de chips para o banco anexado como
+# "arquivo" (por padrão <banco>_arquivo.db, ao lado do principal), em lotes com transações curtas. O id do chip
+# é mantido, então chips e arquivo nunca repetem ids e as consultas podem juntar os dois em ordem
+IDADE_ARQUIVAMENTO_DIAS = 365
+TAMANHO_LOTE_ARQUIVAMENTO = 5000
+PAUSA_LOTE_ARQUIVAMENTO = 0.05      # segundos entre lotes, para as outras conexões gravarem
+TAMANHO_LOTE_EXCLUSAO = 5000
+MOTIVO_JA_ARQUIVADO = 'Já cadastrado (arquivado)'
+# (tabela de chips, índice de busca, contadores) do banco principal e do arquivo; as duas tabelas de chips têm
+# as mesmas colunas compactas
+TABELAS_PRINCIPAL = ('chips_dados', 'chips_busca', 'contadores')
+TABELAS_ARQUIVO = ('arquivo.chips_arquivados', 'arquivo.arquivados_busca', 'arquivo.contadores_arquivo')
+
+SQL_RECALCULAR_CONTADORES_ARQUIVO = _sql_recalcular_contadores(DIMENSOES_CHIPS_COMPACTOS, TABELAS_ARQUIVO[0],
+                                                               STATUS_COMPACTO, remessas=False)
+SQL_CRIAR_LOTE_IDS = 'CREATE TEMP TABLE IF NOT EXISTS lote_ids (id INTEGER PRIMARY KEY)'
+# INDEXED BY: sem estatísticas (ANALYZE) o planejador prefere idx_chips_dados_status_entrada e ordena à parte
+SQL_CANDIDATOS_ARQUIVAMENTO = f'''
+    INSERT INTO temp.lote_ids (id)
+    SELECT id FROM chips_dados INDEXED BY idx_chips_dados_retirados_saida
+    WHERE status = {STATUS_IDS['Retirado']} AND data_saida < {_sql_segundos('?')} ORDER BY data_saida LIMIT ?
+'''
+SQL_LOTE_CHIPS_REMESSA = 'INSERT INTO temp.lote_ids (id) SELECT id FROM {tabela} WHERE remessa_id = ? LIMIT ?'
+SQL_RESUMO_LOTE_IDS = f'''
+    SELECT {_sql_nome('operadoras', 'c.operadora')}, {_sql_status('c.status')}, c.remessa_id,
+           {_sql_dia('c.data_entrada')}, {_sql_dia('c.data_saida')}, COUNT(*)
+    FROM temp.lote_ids l JOIN {{tabela}} c ON c.id = l.id {{condicao}}
+    GROUP BY c.operadora, c.status, c.remessa_id, 4, 5
+'''
+# Copiados para o arquivo só os que ainda não estão lá (um lote interrompido entre as duas transações é refeito)
+SQL_NAO_ARQUIVADOS = 'WHERE NOT EXISTS (SELECT 1 FROM arquivo.chips_arquivados a WHERE a.id = c.id)'
+SQL_INDEXAR_ARQUIVO_LOTE = f'''
+    INSERT INTO arquivo.arquivados_busca (rowid, iccid)
+    SELECT c.id, {_sql_iccid('c.iccid')} FROM temp.lote_ids l JOIN chips_dados c ON c.id = l.id {SQL_NAO_ARQUIVADOS}
+'''
+SQL_COPIAR_PARA_ARQUIVO = f'''
+    INSERT INTO arquivo.chips_arquivados (id, iccid, operadora, status, data_entrada, data_saida, retirado_por,
+                                          observacoes, remessa_id, data_arquivamento)
+    SELECT c.id, c.iccid, c.operadora, c.status, c.data_entrada, c.data_saida, c.retirado_por, c.observacoes,
+           c.remessa_id, {_sql_segundos('?')}
+    FROM temp.lote_ids l JOIN chips_dados c ON c.id = l.id {SQL_NAO_ARQUIVADOS}
+'''
+# Chips do lote alterados (ou apagados) em chips depois de copiados: a cópia no arquivo é descartada
+SQL_ARQUIVADOS_DIVERGENTES = f'''
+    SELECT l.id FROM temp.lote_ids l JOIN arquivo.chips_arquivados a ON a.id = l.id
+    LEFT JOIN chips_dados c ON c.id = l.id
+    WHERE c.id IS NULL OR c.status IS NOT {STATUS_IDS['Retirado']} OR c.iccid IS NOT a.iccid
+       OR c.operadora IS NOT a.operadora OR c.data_entrada IS NOT a.data_entrada OR c.data_saida IS NOT a.data_saida
+       OR c.retirado_por IS NOT a.retirado_por OR c.observacoes IS NOT a.observacoes
+       OR c.remessa_id IS NOT a.remessa_id
+'''
+SQL_DESINDEXAR_LOTE = f'''
+    INSERT INTO {{busca}} ({{nome_busca}}, rowid, iccid)
+    SELECT 'delete', c.id, {_sql_iccid('c.iccid')} FROM temp.lote_ids l JOIN {{tabela}} c ON c.id = l.id
+'''
+SQL_EXCLUIR_LOTE = 'DELETE FROM {tabela} WHERE id IN (SELECT id FROM temp.lote_ids)'
+SQL_MOVIMENTOS_EXCLUSAO_LOTE = f'''
+    INSERT INTO movimentos (data, tipo, iccid, operadora, remessa_id, responsavel)
+    SELECT ?, ?, {_sql_iccid('c.iccid')}, {_sql_nome('operadoras', 'c.operadora')}, c.remessa_id, ''
+    FROM temp.lote_ids l JOIN {{tabela}} c ON c.id = l.id
+'''
+SQL_JA_ARQUIVADOS = f'''
+    SELECT l.iccid FROM temp.lote_chips l JOIN arquivo.chips_arquivados a ON a.iccid = {_sql_codificar_iccid('l.iccid')}
+'''
+SQL_RETIRADA_ARQUIVADOS = f'''
+    SELECT l.iccid, {_sql_nome('pessoas', 'a.retirado_por')}, {_sql_data('a.data_saida')}
+    FROM temp.lote_retirada l JOIN arquivo.chips_arquivados a ON a.iccid = {_sql_codificar_iccid('l.iccid')}
+'''
+SQL_BUSCA_TRECHO_ARQUIVO = f'''
+    SELECT {COLUNAS_CHIPS_DECODIFICADAS}
+    FROM arquivo.arquivados_busca b JOIN arquivo.chips_arquivados c ON c.id = b.rowid{NOMES_CHIPS}
+    WHERE b.iccid LIKE ? LIMIT ?
+'''
+
+# Conciliação por intercalação: os chips na ordem do índice UNIQUE de iccid (o código guardado, sem decodificar
+# para ordenar), lidos uma vez junto com o inventário já ordenado pela mesma chave
+SQL_CONCILIAR = f'''
+    SELECT c.iccid, {_sql_iccid('c.iccid')}, o.nome, {_sql_status('c.status')}, p.nome, {_sql_data('c.data_saida')}
+    FROM {{tabela}} c{NOMES_CHIPS}
+    ORDER BY c.iccid
+'''
+
+# Categorias da conciliação de um inventário externo com o banco
+CONCILIACAO_NAO_CADASTRADO = 'nao_cadastrado'
+CONCILIACAO_OPERADORA_DIVERGENTE = 'operadora_divergente'
+CONCILIACAO_RETIRADO = 'retirado_no_banco'
+CONCILIACAO_AUSENTE_ARQUIVO = 'ausente_no_arquivo'
+CONCILIACAO_DUPLICADO = 'duplicado_no_arquivo'
+
+def _chave_iccid(codigo):
+    # Ordem do SQLite na coluna iccid: os inteiros de codificar_iccid antes dos textos
+    return (1, codigo) if isinstance(codigo, str) else (0, codigo)
+
+def _gravar_bloco_ordenado(bloco):
+    # A chave vai junto para o arquivo temporário, para não codificar de novo cada ICCID na intercalação
+    arquivo = tempfile.TemporaryFile('w+', encoding='utf-8', newline='')
+    csv.writer(arquivo, delimiter=';', lineterminator='\n').writerows(
+        (tipo, codigo, iccid, operadora) for (tipo, codigo), iccid, operadora in bloco)
+    arquivo.seek(0)
+    return arquivo
+
+def _ler_bloco_ordenado(arquivo):
+    for tipo, codigo, iccid, operadora in csv.reader(arquivo, delimiter=';'):
+        yield ((0, int(codigo)) if tipo == '0' else (1, codigo)), iccid, operadora
+
+def ordenar_inventario(linhas, tamanho_lote=TAMANHO_LOTE_PADRAO):
+    # Ordenação externa de [(iccid, operadora)]: blocos de tamanho_lote linhas são ordenados em memória e
+    # gravados em arquivos temporários, depois intercalados (heapq.merge lê uma linha de cada por vez).
+    # Gera (chave, iccid normalizado, operadora); linhas sem dígitos (cabeçalhos) são descartadas
+    gravados, ultimo = [], []
+    try:
+        for bloco in em_blocos(linhas, tamanho_lote):
+            if ultimo:
+                gravados.append(_gravar_bloco_ordenado(ultimo))
+            iccids = normalizar_iccids([iccid for iccid, _ in bloco])
+            ultimo = sorted(((_chave_iccid(codificar_iccid(iccid)), iccid, operadora)
+                             for iccid, (_, operadora) in zip(iccids, bloco) if iccid), key=itemgetter(0))
+        # Ordenação e intercalação estáveis pela chave: entre ICCIDs repetidos, vem primeiro o do início do arquivo
+        yield from heapq.merge(*(_ler_bloco_ordenado(arquivo) for arquivo in gravados), ultimo, key=itemgetter(0))
+    finally:
+        for arquivo in gravados:
+            arquivo.close()
+
+# Livro de movimentos (somente inclusão) e resumos por período. tipo: entrada | retirada | devolucao | exclusao
+MOVIMENTO_ENTRADA = 'entrada'
+MOVIMENTO_RETIRADA = 'retirada'
+MOVIMENTO_DEVOLUCAO = 'devolucao'      # Retirado -> Disponível
+MOVIMENTO_EXCLUSAO = 'exclusao'
+TIPOS_MOVIMENTO = (MOVIMENTO_ENTRADA, MOVIMENTO_RETIRADA, MOVIMENTO_DEVOLUCAO, MOVIMENTO_EXCLUSAO)
+# Granularidade -> (tabela de resumo, tamanho do prefixo de movimentos.data que forma o período)
+RESUMOS_MOVIMENTOS = {'dia': ('movimentos_dia', 10), 'mes': ('movimentos_mes', 7)}
+AGRUPAMENTOS_MOVIMENTOS = ('responsavel', 'operadora')
+
+SQL_MOVIMENTOS_ENTRADA_NOVOS = f'''
+    INSERT INTO movimentos (data, tipo, iccid, operadora, remessa_id, responsavel)
+    SELECT {_sql_data('c.data_entrada')}, '{MOVIMENTO_ENTRADA}', {_sql_iccid('c.iccid')},
+           {_sql_nome('operadoras', 'c.operadora')}, c.remessa_id, ''
+    FROM chips_dados c WHERE c.id > ? ORDER BY c.id
+'''
+SQL_MOVIMENTOS_RETIRADA_LOTE = f'''
+    INSERT INTO movimentos (data, tipo, iccid, operadora, remessa_id, responsavel)
+    SELECT ?, '{MOVIMENTO_RETIRADA}', l.iccid, {_sql_nome('operadoras', 'c.operadora')}, c.remessa_id, ?
+    FROM temp.lote_retirada l JOIN chips_dados c ON c.iccid = {_sql_codificar_iccid('l.iccid')}
+    WHERE c.status = {STATUS_IDS['Disponível']}
+'''
+SQL_HISTORICO_CHIP = 'SELECT data, tipo, operadora, remessa_id, responsavel FROM movimentos WHERE iccid = ? ORDER BY id'
+
+def _sql_resumir_movimentos(granularidade):
+    # Soma ao resumo os movimentos com id > ? (com 0, recalcula tudo a partir do livro)
+    tabela, tamanho = RESUMOS_MOVIMENTOS[granularidade]
+    return f'''
+        INSERT INTO {tabela} (tipo, periodo, responsavel, operadora, quantidade)
+        SELECT tipo, substr(data, 1, {tamanho}), responsavel, operadora, COUNT(*)
+        FROM movimentos WHERE id > ? GROUP BY 1, 2, 3, 4
+        ON CONFLICT (tipo, periodo, responsavel, operadora) DO UPDATE SET quantidade = quantidade + excluded.quantidade
+    '''
+
+def _sql_somar_resumo(granularidade):
+    # Soma ao resumo totais já conhecidos (tipo, data, responsavel, operadora, quantidade), sem ler o livro
+    tabela, tamanho = RESUMOS_MOVIMENTOS[granularidade]
+    return f'''
+        INSERT INTO {tabela} (tipo, periodo, responsavel, operadora, quantidade) VALUES (?, substr(?, 1, {tamanho}), ?, ?, ?)
+        ON CONFLICT (tipo, periodo, responsavel, operadora) DO UPDATE SET quantidade = quantidade + excluded.quantidade
+    '''
+
+TAMANHO_PAGINA = 500
+
+def _ler_dia(dia):
+    try:
+        return datetime.strptime(dia, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"Data inválida: {dia} (use AAAA-MM-DD)") from None
+
+def _filtros_chips(filtro_operadora=None, filtro_status=None, data_inicio=None, data_fim=None, remessa_id=None):
+    # data_inicio/data_fim: 'AAAA-MM-DD', ambos inclusivos, sobre data_entrada. Sobre as colunas compactas:
+    # os nomes viram ids e as datas, segundos, dentro da própria consulta
+    where = ' WHERE 1=1'
+    params = []
+    if filtro_operadora:
+        where += f" AND c.operadora = {_sql_id('operadoras', '?')}"
+        params.append(filtro_operadora)
+    if filtro_status:
+        where += ' AND c.status = ?'
+        params.append(STATUS_IDS.get(filtro_status))
+    if data_inicio:
+        where += f" AND c.data_entrada >= {_sql_segundos('?')}"
+        params.append(_ler_dia(data_inicio).strftime('%Y-%m-%d'))
+    if data_fim:
+        where += f" AND c.data_entrada < {_sql_segundos('?')}"
+        params.append((_ler_dia(data_fim) + timedelta(days=1)).strftime('%Y-%m-%d'))
+    if remessa_id is not None:
+        where += ' AND c.remessa_id = ?'
+        params.append(int(remessa_id))
+    return where, params
+
+def _tabelas_consulta(filtro_status, incluir_arquivo):
+    # O arquivo só tem chips retirados: filtrando por disponíveis, não há o que ler nele
+    if incluir_arquivo and filtro_status != 'Disponível':
+        return (TABELAS_PRINCIPAL[0], TABELAS_ARQUIVO[0])
+    return (TABELAS_PRINCIPAL[0],)
+
+def montar_consulta_chips(filtro_operadora=None, filtro_status=None, incluir_arquivo=False, **filtros):
+    where, params = _filtros_chips(filtro_operadora, filtro_status, **filtros)
+    tabelas = _tabelas_consulta(filtro_status, incluir_arquivo)
+    if len(tabelas) == 1:
+        return (f'SELECT {COLUNAS_CHIPS_DECODIFICADAS} FROM chips_dados c{NOMES_CHIPS}' + where
+                + ' ORDER BY c.data_entrada DESC, c.id DESC', params)
+    # Cada lado vem ordenado pelo seu índice e a união é intercalada (MERGE), sem ordenar tudo de novo
+    uniao = ' UNION ALL '.join(f'SELECT {COLUNAS_CHIPS_DECODIFICADAS}, c.id AS id, c.data_entrada AS entrada '
+                               f'FROM {tabela} c{NOMES_CHIPS}{where}' for tabela in tabelas)
+    return (f'SELECT {COLUNAS_CHIPS} FROM ({uniao} ORDER BY entrada DESC, id DESC)',
+            params * len(tabelas))
+
+def montar_consulta_pagina(filtro_operadora=None, filtro_status=None, cursor=None, mesma_data=False,
+                           limite=TAMANHO_PAGINA, incluir_arquivo=False, **filtros):
+    # cursor = (data_entrada em segundos, id) do último chip já exibido. O trecho com a mesma data_entrada é
+    # buscado à parte (data_entrada = ? AND id < ?) porque lotes inteiros compartilham o mesmo timestamp
+    # e a comparação por row value só usaria o índice até data_entrada
+    where, params = _filtros_chips(filtro_operadora, filtro_status, **filtros)
+    if cursor is not None:
+        if mesma_data:
+            where += ' AND c.data_entrada = ? AND c.id < ?'
+            params += [cursor[0], cursor[1]]
+        else:
+            where += ' AND c.data_entrada < ?'
+            params.append(cursor[0])
+    colunas = f'{COLUNAS_CHIPS_DECODIFICADAS}, c.id AS id, c.data_entrada AS entrada'
+    tabelas = _tabelas_consulta(filtro_status, incluir_arquivo)
+    if len(tabelas) == 1:
+        return (f'SELECT {colunas} FROM chips_dados c{NOMES_CHIPS}' + where + ' ORDER BY c.data_entrada DESC, c.id DESC LIMIT ?',
+                params + [limite])
+    # Intercalação (MERGE) dos dois índices, que para ao completar a página
+    uniao = ' UNION ALL '.join(f'SELECT {colunas} FROM {tabela} c{NOMES_CHIPS}{where}' for tabela in tabelas)
+    return uniao + ' ORDER BY entrada DESC, id DESC LIMIT ?', params * len(tabelas) + [limite]
+
+def montar_contagem_chips(filtro_operadora=None, filtro_status=None, incluir_arquivo=False, **filtros):
+    where, params = _filtros_chips(filtro_operadora, filtro_status, **filtros)
+    tabelas = _tabelas_consulta(filtro_status, incluir_arquivo)
+    if len(tabelas) == 1:
+        return 'SELECT COUNT(*) FROM chips_dados c' + where, params
+    return 'SELECT ' + ' + '.join(f'(SELECT COUNT(*) FROM {tabela} c{where})' for tabela in tabelas), \
+        params * len(tabelas)
+
+def montar_resumo_movimentos(granularidade, tipo, inicio, fim, agrupar_por=None, operadora=None,
+                             responsavel=None):
+    # Lê só a tabela de resumo, nunca o livro: [(período, [chave do agrupamento,] quantidade)].
+    # inicio/fim são 'AAAA-MM-DD' (inclusive); no resumo mensal valem os meses que os contêm
+    if agrupar_por not in (None,) + AGRUPAMENTOS_MOVIMENTOS:
+        raise ValueError(f"Agrupamento inválido: {agrupar_por}")
+    tabela, tamanho = RESUMOS_MOVIMENTOS[granularidade]
+    colunas = 'periodo' + (f', {agrupar_por}' if agrupar_por else '')
+    condicoes, params = ['tipo = ?', 'periodo >= ?', 'periodo <= ?'], [tipo, inicio[:tamanho], fim[:tamanho]]
+    if operadora:
+        condicoes.append('operadora = ?')
+        params.append(operadora)
+    if responsavel is not None:
+        condicoes.append('responsavel = ?')
+        params.append(responsavel)
+    query = (f'SELECT {colunas}, SUM(quantidade) FROM {tabela} WHERE ' + ' AND '.join(condicoes)
+             + f' GROUP BY {colunas} ORDER BY {colunas}')
+    return query, params
+
+def consultas_monitoradas(incluir_arquivo=False):
+    # (nome, sql, parâmetros) de cada formato de consulta emitido pelo Database; com incluir_arquivo, também as
+    # que leem o banco de arquivo (que precisa estar anexado)
+    consultas = [
+        ('gerar_numero_remessa', SQL_SEQUENCIA_REMESSA, ('20240101',)),
+        ('listar_remessas', SQL_LISTAR_REMESSAS, ()),
+        ('estatisticas', SQL_ESTATISTICAS, ()),
+        ('estatisticas_por_operadora', SQL_CONTADORES_DIMENSAO, ('operadora',)),
+        ('contar_chips', SQL_CONTADOR, ('operadora', OPERADORAS[0])),
+        ('serie_movimentos_diarios', SQL_SERIE_DIARIA, ('2024-01-01',)),
+        ('adicionar_chips_lote', SQL_CHIPS_JA_CADASTRADOS, ()),
+        ('retirar_chips_lote', SQL_DIAGNOSTICO_RETIRADA, ()),
+        ('retirar_chips_lote', SQL_RETIRAR_LOTE, ('2024-01-01 00:00:00', '')),
+        ('conciliar', SQL_CONCILIAR.format(tabela=TABELAS_PRINCIPAL[0]), ()),
+        ('buscar_iccid', SQL_BUSCA_PREFIXO.format(tabela=TABELAS_PRINCIPAL[0]),
+         faixa_prefixo_iccid('8955') + (LIMITE_BUSCA_ICCID,)),
+        ('buscar_iccid', SQL_BUSCA_PREFIXO.format(tabela=TABELAS_PRINCIPAL[0]), ('8955', '8955:', LIMITE_BUSCA_ICCID)),
+        ('buscar_iccid', SQL_BUSCA_TRECHO, ('%123456', LIMITE_BUSCA_ICCID)),
+        ('historico_chip', SQL_HISTORICO_CHIP, ('89550000000000000001',)),
+    ]
+    for granularidade in RESUMOS_MOVIMENTOS:
+        for agrupar_por in (None,) + AGRUPAMENTOS_MOVIMENTOS:
+            for filtros in ({}, {'operadora': OPERADORAS[0]}, {'responsavel': ''}):
+                query, params = montar_resumo_movimentos(granularidade, MOVIMENTO_RETIRADA, '2024-01-01',
+                                                         '2024-03-31', agrupar_por, **filtros)
+                consultas.append(('resumo_movimentos', query, params))
+    for operadora in (None, OPERADORAS[0]):
+        for status in (None, 'Disponível'):
+            query, params = montar_consulta_chips(operadora, status)
+            consultas.append(('listar_chips', query, params))
+            for cursor, mesma_data in ((None, False), ((1704067200, 1), True), ((1704067200, 1), False)):
+                query, params = montar_consulta_pagina(operadora, status, cursor, mesma_data)
+                consultas.append(('listar_chips_pagina', query, params))
+            for filtros in ({'data_inicio': '2024-01-01', 'data_fim': '2024-01-31'}, {'remessa_id': 1}):
+                query, params = montar_consulta_chips(operadora, status, **filtros)
+                consultas.append(('iterar_chips', query, params))
+                query, params = montar_contagem_chips(operadora, status, **filtros)
+                consultas.append(('contar_chips', query, params))
+    consultas.append(('arquivar_retirados', SQL_CANDIDATOS_ARQUIVAMENTO, ('2024-01-01', TAMANHO_LOTE_ARQUIVAMENTO)))
+    consultas.append(('excluir_remessa', SQL_LOTE_CHIPS_REMESSA.format(tabela=TABELAS_PRINCIPAL[0]),
+                      (1, TAMANHO_LOTE_EXCLUSAO)))
+    if not incluir_arquivo:
+        return consultas
+    consultas += [
+        ('excluir_remessa', SQL_LOTE_CHIPS_REMESSA.format(tabela=TABELAS_ARQUIVO[0]), (1, TAMANHO_LOTE_EXCLUSAO)),
+        ('adicionar_chips_lote', SQL_JA_ARQUIVADOS, ()),
+        ('retirar_chips_lote', SQL_RETIRADA_ARQUIVADOS, ()),
+        ('buscar_iccid', SQL_BUSCA_PREFIXO.format(tabela=TABELAS_ARQUIVO[0]),
+         faixa_prefixo_iccid('8955') + (LIMITE_BUSCA_ICCID,)),
+        ('buscar_iccid', SQL_BUSCA_TRECHO_ARQUIVO, ('%123456', LIMITE_BUSCA_ICCID)),
+        ('conciliar', SQL_CONCILIAR.format(tabela=TABELAS_ARQUIVO[0]), ()),
+    ]
+    for operadora in (None, OPERADORAS[0]):
+        for status in (None, 'Retirado'):
+            query, params = montar_consulta_chips(operadora, status, incluir_arquivo=True)
+            consultas.append(('listar_chips', query, params))
+            for cursor, mesma_data in ((None, False), ((1704067200, 1), True)):
+                query, params = montar_consulta_pagina(operadora, status, cursor, mesma_data, incluir_arquivo=True)
+                consultas.append(('listar_chips_pagina', query, params))
+            for filtros in ({'data_inicio': '2024-01-01', 'data_fim': '2024-01-31'}, {'remessa_id': 1}):
+                query, params = montar_consulta_chips(operadora, status, incluir_arquivo=True, **filtros)
+                consultas.append(('iterar_chips', query, params))
+                query, params = montar_contagem_chips(operadora, status, incluir_arquivo=True, **filtros)
+                consultas.append(('contar_chips', query, params))
+    return consultas
+
+def verificar_planos_consulta(db):
+    # Lista os passos de plano que varrem chips/remessas/movimentos sem índice ou ordenam em B-tree temporária
+    problemas = []
+    conn = db.get_connection()
+    conn.execute(SQL_CRIAR_LOTE_CHIPS)
+    conn.execute(SQL_CRIAR_LOTE_RETIRADA)
+    conn.execute(SQL_CRIAR_LOTE_IDS)
+    for nome, sql, params in consultas_monitoradas(db.arquivo_disponivel):
+        for linha in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            detalhe = linha[-1]
+            varredura = (re.match(r'SCAN (TABLE )?(chips|chips_dados|chips_arquivados|remessas|remessas_dados|movimentos)\b', detalhe)
+                         and ' USING ' not in detalhe)
+            if varredura or 'USE TEMP B-TREE' in detalhe:
+                problemas.append((nome, sql.strip(), detalhe))
+    return problemas
+
+# Os triggers de chips (e de movimentos) ficam desligados enquanto controle_contadores.suspenso = 1, dentro da
+# transação de uma operação em lote (ver Database._gatilhos_suspensos)
+GATILHO_ATIVO = 'WHEN (SELECT suspenso FROM controle_contadores) = 0'
+
+def _criar_gatilho(cursor, nome, evento, tabela, corpo, condicao=GATILHO_ATIVO):
+    # evento com o momento: 'AFTER INSERT', 'BEFORE DELETE', 'INSTEAD OF UPDATE', 'AFTER UPDATE OF status'...
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {nome} {evento} ON {tabela} {condicao}
+        BEGIN
+            {corpo}
+        END
+    ''')
+
+def _criar_gatilhos_contadores_chips(cursor, dimensoes, colunas_update, tabela='chips', formato=FORMATO_TEXTO):
+    status = formato['status']
+    for evento, linha, sinal in (('INSERT', 'NEW', '+'), ('DELETE', 'OLD', '-')):
+        _criar_gatilho(cursor, f'trg_contadores_chips_{evento.lower()}', f'AFTER {evento}', tabela,
+                       _sql_ajustar_contadores(linha, sinal, dimensoes, status))
+    _criar_gatilho(cursor, 'trg_contadores_chips_update', f'AFTER UPDATE OF {colunas_update}', tabela,
+                   _sql_ajustar_contadores('OLD', '-', dimensoes, status)
+                   + _sql_ajustar_contadores('NEW', '+', dimensoes, status))
+
+def _sql_ajustar_contadores(linha, sinal, dimensoes, status=STATUS_TEXTO):
+    chaves = [(dimensao, expressao.format(l=linha)) for dimensao, expressao in dimensoes]
+    valores = ', '.join(f"('{dimensao}', {chave})" for dimensao, chave in chaves)
+    filtro = '\n           OR '.join(f"(dimensao = '{dimensao}' AND chave = {chave})" for dimensao, chave in chaves)
+    return f'''
+        INSERT OR IGNORE INTO contadores (dimensao, chave) VALUES {valores};
+        UPDATE contadores SET total = total {sinal} 1,
+            disponiveis = disponiveis {sinal} ({linha}.status = {status[0]}),
+            retirados = retirados {sinal} ({linha}.status = {status[1]})
+        WHERE {filtro};'''
+
+def _criar_gatilhos_contadores_remessas(cursor, tabela):
+    # Sem GATILHO_ATIVO: nenhuma operação em lote cria ou apaga remessas com os triggers suspensos
+    for evento, sinal in (('INSERT', '+'), ('DELETE', '-')):
+        _criar_gatilho(cursor, f'trg_contadores_remessas_{evento.lower()}', f'AFTER {evento}', tabela, f'''
+                INSERT OR IGNORE INTO contadores (dimensao, chave) VALUES ('remessas', '');
+                UPDATE contadores SET total = total {sinal} 1 WHERE dimensao = 'remessas' AND chave = '';''', '')
+
+def _criar_gatilhos_busca(cursor, tabela, formato=FORMATO_TEXTO):
+    iccid = formato['iccid'].format
+    indexar = f"INSERT INTO chips_busca (rowid, iccid) VALUES (NEW.id, {iccid('NEW.iccid')});"
+    desindexar = f"INSERT INTO chips_busca (chips_busca, rowid, iccid) VALUES ('delete', OLD.id, {iccid('OLD.iccid')});"
+    for nome, evento, corpo in (('insert', 'INSERT', indexar), ('delete', 'DELETE', desindexar),
+                                ('update', 'UPDATE OF iccid', desindexar + indexar)):
+        _criar_gatilho(cursor, f'trg_busca_chips_{nome}', f'AFTER {evento}', tabela, corpo)
+
+def _criar_gatilhos_movimentos_chips(cursor, tabela, formato=FORMATO_TEXTO):
+    iccid, operadora, data, pessoa = (formato[coluna].format for coluna in ('iccid', 'operadora', 'data', 'pessoa'))
+    retirado = formato['status'][1]
+    registrar = 'INSERT INTO movimentos (data, tipo, iccid, operadora, remessa_id, responsavel) VALUES'
+    agora = "datetime('now', 'localtime')"
+    _criar_gatilho(cursor, 'trg_movimentos_chips_insert', 'AFTER INSERT', tabela, f'''
+            {registrar} ({data('NEW.data_entrada')}, '{MOVIMENTO_ENTRADA}', {iccid('NEW.iccid')},
+                         {operadora('NEW.operadora')}, NEW.remessa_id, '');''')
+    _criar_gatilho(cursor, 'trg_movimentos_chips_update', 'AFTER UPDATE OF status', tabela, f'''
+            {registrar} (
+                CASE WHEN NEW.status = {retirado} THEN COALESCE({data('NEW.data_saida')}, {agora}) ELSE {agora} END,
+                CASE WHEN NEW.status = {retirado} THEN '{MOVIMENTO_RETIRADA}' ELSE '{MOVIMENTO_DEVOLUCAO}' END,
+                {iccid('NEW.iccid')}, {operadora('NEW.operadora')}, NEW.remessa_id,
+                COALESCE({pessoa(f'CASE WHEN NEW.status = {retirado} THEN NEW.retirado_por ELSE OLD.retirado_por END')}, ''));''',
+                   f'{GATILHO_ATIVO} AND OLD.status IS NOT NEW.status AND {retirado} IN (OLD.status, NEW.status)')
+    _criar_gatilho(cursor, 'trg_movimentos_chips_delete', 'AFTER DELETE', tabela, f'''
+            {registrar} ({agora}, '{MOVIMENTO_EXCLUSAO}', {iccid('OLD.iccid')},
+                         {operadora('OLD.operadora')}, OLD.remessa_id, '');''')
+
+# Migrações de esquema: a posição na lista (a partir de 1) é a versão gravada em PRAGMA user_version.
+# Nunca altere uma migração já publicada; acrescente uma nova ao final.
+def _migracao_tabelas_iniciais(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chips (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            iccid TEXT UNIQUE NOT NULL,
+            operadora TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'Disponível',
+            data_entrada TEXT NOT NULL,
+            data_saida TEXT,
+            retirado_por TEXT,
+            observacoes TEXT,
+            remessa_id INTEGER,
+            FOREIGN KEY (remessa_id) REFERENCES remessas(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS remessas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            numero_remessa TEXT UNIQUE NOT NULL,
+            data_remessa TEXT NOT NULL,
+            operadora TEXT,
+            quantidade INTEGER,
+            observacoes TEXT
+        )
+    ''')
+
+def _migracao_indices_consultas(cursor):
+    # Um índice por combinação de filtros da consulta, todos terminando em data_entrada para servir o ORDER BY;
+    # (status, data_entrada) também cobre as contagens por status
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_entrada ON chips (data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_status_entrada ON chips (status, data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_operadora_entrada ON chips (operadora, data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_operadora_status_entrada ON chips (operadora, status, data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_remessa ON chips (remessa_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_remessas_data ON remessas (data_remessa)')
+
+def _migracao_indice_remessa_entrada(cursor):
+    # Filtro por remessa na consulta/exportação: (remessa_id, data_entrada) serve também o ORDER BY
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_remessa_entrada ON chips (remessa_id, data_entrada)')
+    cursor.execute('DROP INDEX IF EXISTS idx_chips_remessa')
+
+def _migracao_busca_iccid(cursor):
+    # Índice FTS5 de trigramas sobre o ICCID para buscar pelo final ou por um trecho do número. Conteúdo externo
+    # (o texto fica só em chips) e detail='none': o LIKE confere cada candidato, então posições não são necessárias
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS chips_busca
+        USING fts5(iccid, content='chips', content_rowid='id', tokenize='trigram', detail='none')
+    ''')
+    _criar_gatilhos_busca(cursor, 'chips')
+    cursor.execute("INSERT INTO chips_busca (chips_busca) VALUES ('rebuild')")
+
+def _migracao_movimentos(cursor):
+    # Livro de movimentos: uma linha por entrada, retirada, devolução ou exclusão de chip, gravada na mesma
+    # transação da alteração (triggers de chips; as operações em lote gravam com INSERT ... SELECT).
+    # Nunca é alterado nem apagado; movimentos_dia e movimentos_mes são mantidos a partir dele
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS movimentos (
+            id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            iccid TEXT NOT NULL,
+            operadora TEXT NOT NULL,
+            remessa_id INTEGER,
+            responsavel TEXT NOT NULL DEFAULT ''
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_movimentos_iccid ON movimentos (iccid)')
+    for evento in ('UPDATE', 'DELETE'):
+        _criar_gatilho(cursor, f'trg_movimentos_{evento.lower()}', f'BEFORE {evento}', 'movimentos',
+                       "SELECT RAISE(ABORT, 'movimentos aceita apenas inclusões');", '')
+    # A chave (tipo, periodo, responsavel, operadora) serve os agrupamentos por pessoa; o índice, os por operadora
+    for tabela, _ in RESUMOS_MOVIMENTOS.values():
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {tabela} (
+                tipo TEXT NOT NULL,
+                periodo TEXT NOT NULL,
+                responsavel TEXT NOT NULL,
+                operadora TEXT NOT NULL,
+                quantidade INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (tipo, periodo, responsavel, operadora)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{tabela}_operadora ON {tabela} (tipo, periodo, operadora)')
+
+    # O histórico anterior ao livro é reconstruído do estado atual (a entrada de cada chip e, se retirado, a
+    # retirada) antes de criar os triggers, para que os resumos não sejam somados duas vezes
+    cursor.execute(f'''
+        INSERT INTO movimentos (data, tipo, iccid, operadora, remessa_id, responsavel)
+        SELECT * FROM (
+            SELECT data_entrada, '{MOVIMENTO_ENTRADA}', iccid, operadora, remessa_id, '' FROM chips
+            UNION ALL
+            SELECT COALESCE(data_saida, data_entrada), '{MOVIMENTO_RETIRADA}', iccid, operadora, remessa_id,
+                   COALESCE(retirado_por, '')
+            FROM chips WHERE status = 'Retirado'
+        ) ORDER BY 1
+    ''')
+    for granularidade in RESUMOS_MOVIMENTOS:
+        cursor.execute(_sql_resumir_movimentos(granularidade), (0,))
+
+    _criar_gatilhos_movimentos_chips(cursor, 'chips')
+    resumir = ''.join(f'''
+            INSERT INTO {tabela} (tipo, periodo, responsavel, operadora, quantidade)
+            VALUES (NEW.tipo, substr(NEW.data, 1, {tamanho}), NEW.responsavel, NEW.operadora, 1)
+            ON CONFLICT (tipo, periodo, responsavel, operadora) DO UPDATE SET quantidade = quantidade + 1;'''
+                      for tabela, tamanho in RESUMOS_MOVIMENTOS.values())
+    _criar_gatilho(cursor, 'trg_movimentos_resumos', 'AFTER INSERT', 'movimentos', resumir)
+
+def _migracao_sequencia_remessas(cursor):
+    # Próximo número de remessa por dia em O(1), sem ler o maior número já usado; começa do que já existe
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sequencias_remessa (
+            dia TEXT PRIMARY KEY,
+            ultimo INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO sequencias_remessa (dia, ultimo)
+        SELECT substr(numero_remessa, 5, 8), MAX(CAST(substr(numero_remessa, 14) AS INTEGER)) FROM remessas
+        WHERE numero_remessa GLOB 'REM-[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]-[0-9]*'
+        GROUP BY 1
+    ''')
+
+def _migracao_indice_arquivamento(cursor):
+    # Candidatos ao arquivamento (retirados antes de uma data) sem percorrer todos os retirados
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chips_retirados_saida ON chips (data_saida) WHERE status = 'Retirado'")
+
+def _criar_esquema_arquivo(cursor):
+    # Banco de arquivo (anexado como "arquivo"): os chips arquivados com o mesmo id e as mesmas colunas compactas de
+    # chips_dados, índices para as consultas que o incluem, o índice de trigramas da busca e contadores próprios
+    # (os de chips contam só o que está lá). Um arquivo anterior a VERSAO_ARQUIVO (colunas em texto) é convertido
+    antigo = (cursor.execute('PRAGMA arquivo.user_version').fetchone()[0] < VERSAO_ARQUIVO and cursor.execute(
+        "SELECT 1 FROM arquivo.sqlite_master WHERE name = 'chips_arquivados'").fetchone())
+    if antigo:
+        cursor.execute('DROP TABLE arquivo.arquivados_busca')
+        cursor.execute('ALTER TABLE arquivo.chips_arquivados RENAME TO chips_arquivados_texto')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS arquivo.chips_arquivados (
+            id INTEGER PRIMARY KEY,
+            iccid UNIQUE NOT NULL,
+            operadora INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            data_entrada INTEGER NOT NULL,
+            data_saida INTEGER,
+            retirado_por INTEGER,
+            observacoes TEXT,
+            remessa_id INTEGER,
+            data_arquivamento INTEGER NOT NULL
+        )
+    ''')
+    if antigo:
+        cursor.execute('INSERT OR IGNORE INTO operadoras (nome) SELECT DISTINCT operadora FROM arquivo.chips_arquivados_texto')
+        cursor.execute('INSERT OR IGNORE INTO pessoas (nome) SELECT DISTINCT retirado_por FROM arquivo.chips_arquivados_texto '
+                       'WHERE retirado_por IS NOT NULL')
+        cursor.execute(f'''
+            INSERT INTO arquivo.chips_arquivados (id, {COLUNAS_CHIPS}, observacoes, remessa_id, data_arquivamento)
+            SELECT t.id, {_sql_codificar_chips('t')}, t.observacoes, t.remessa_id, {_sql_segundos('t.data_arquivamento')}
+            FROM arquivo.chips_arquivados_texto t
+        ''')
+        cursor.execute('DROP TABLE arquivo.chips_arquivados_texto')
+    cursor.execute('CREATE INDEX IF NOT EXISTS arquivo.idx_arquivados_entrada ON chips_arquivados (data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS arquivo.idx_arquivados_operadora_entrada '
+                   'ON chips_arquivados (operadora, data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS arquivo.idx_arquivados_remessa_entrada '
+                   'ON chips_arquivados (remessa_id, data_entrada)')
+    # O conteúdo do índice de busca é o ICCID em texto: vem de uma view no próprio arquivo
+    cursor.execute(f'''
+        CREATE VIEW IF NOT EXISTS arquivo.arquivados_iccid AS
+        SELECT id, {_sql_iccid('iccid')} AS iccid FROM chips_arquivados
+    ''')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS arquivo.arquivados_busca
+        USING fts5(iccid, content='arquivados_iccid', content_rowid='id', tokenize='trigram', detail='none')
+    ''')
+    if antigo:
+        cursor.execute("INSERT INTO arquivo.arquivados_busca (arquivados_busca) VALUES ('rebuild')")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS arquivo.contadores_arquivo (
+            dimensao TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            disponiveis INTEGER NOT NULL DEFAULT 0,
+            retirados INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimensao, chave)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(f'PRAGMA arquivo.user_version = {VERSAO_ARQUIVO}')
+
+def _migracao_contadores(cursor):
+    # Totais por status, por operadora e por remessa mantidos por triggers, para que as estatísticas
+    # sejam consultas de uma linha. dimensao: 'geral' | 'operadora' | 'remessa' (chave = id) | 'remessas'
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contadores (
+            dimensao TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            disponiveis INTEGER NOT NULL DEFAULT 0,
+            retirados INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimensao, chave)
+        ) WITHOUT ROWID
+    ''')
+    # Operações em lote ligam "suspenso" dentro da própria transação e ajustam os totais de uma vez
+    cursor.execute('CREATE TABLE IF NOT EXISTS controle_contadores (suspenso INTEGER NOT NULL)')
+    cursor.execute('INSERT INTO controle_contadores (suspenso) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM controle_contadores)')
+    _criar_gatilhos_contadores_chips(cursor, _DIMENSOES_CHIPS_V3, 'status, operadora, remessa_id')
+    _criar_gatilhos_contadores_remessas(cursor, 'remessas')
+    cursor.execute('DELETE FROM contadores')
+    cursor.execute('INSERT INTO contadores (dimensao, chave, total, disponiveis, retirados) '
+                   + _sql_recalcular_contadores(_DIMENSOES_CHIPS_V3))
+
+def _migracao_contadores_diarios(cursor):
+    # Entradas e saídas por dia (chave 'AAAA-MM-DD') para o gráfico de evolução da aba Estatísticas
+    for evento in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_contadores_chips_{evento}')
+    _criar_gatilhos_contadores_chips(cursor, DIMENSOES_CHIPS,
+                                     'status, operadora, remessa_id, data_entrada, data_saida')
+    cursor.execute('DELETE FROM contadores')
+    cursor.execute('INSERT INTO contadores (dimensao, chave, total, disponiveis, retirados) '
+                   + _sql_recalcular_contadores(DIMENSOES_CHIPS))
+
+def _criar_tabelas_compactas(cursor):
+    # Tabelas de nomes, chips_dados e remessas_dados com seus índices, a fronteira da cópia em lotes
+    # (compactacao) e os triggers que repetem em chips_dados o que mudar em chips enquanto a cópia não termina
+    for tabela in ('operadoras', 'status', 'pessoas'):
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {tabela} (id INTEGER PRIMARY KEY, nome TEXT UNIQUE NOT NULL)')
+    cursor.executemany('INSERT OR IGNORE INTO status (id, nome) VALUES (?, ?)',
+                       [(id_status, nome) for nome, id_status in STATUS_IDS.items()])
+    # iccid sem tipo declarado: o inteiro de codificar_iccid ou, fora do padrão, o texto
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS chips_dados (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            iccid UNIQUE NOT NULL,
+            operadora INTEGER NOT NULL REFERENCES operadoras (id),
+            status INTEGER NOT NULL DEFAULT {STATUS_IDS['Disponível']} REFERENCES status (id),
+            data_entrada INTEGER NOT NULL,
+            data_saida INTEGER,
+            retirado_por INTEGER REFERENCES pessoas (id),
+            observacoes TEXT,
+            remessa_id INTEGER REFERENCES remessas_dados (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS remessas_dados (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            numero_remessa TEXT UNIQUE NOT NULL,
+            data_remessa INTEGER NOT NULL,
+            operadora INTEGER REFERENCES operadoras (id),
+            quantidade INTEGER,
+            observacoes TEXT
+        )
+    ''')
+    # Os mesmos índices de chips (migrações 2, 5 e 9)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_dados_entrada ON chips_dados (data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_dados_status_entrada ON chips_dados (status, data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_dados_operadora_entrada ON chips_dados (operadora, data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_dados_operadora_status_entrada '
+                   'ON chips_dados (operadora, status, data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_dados_remessa_entrada ON chips_dados (remessa_id, data_entrada)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chips_dados_retirados_saida ON chips_dados (data_saida) '
+                   f"WHERE status = {STATUS_IDS['Retirado']}")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_remessas_dados_data ON remessas_dados (data_remessa)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS compactacao (ultimo_id INTEGER NOT NULL)')
+    cursor.execute('INSERT INTO compactacao (ultimo_id) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM compactacao)')
+    # Sem o WHEN de controle_contadores: também as operações em lote (e as estações com a versão anterior)
+    # precisam chegar a chips_dados
+    espelhar = f'''
+        INSERT OR IGNORE INTO operadoras (nome) VALUES (NEW.operadora);
+        INSERT OR IGNORE INTO pessoas (nome) VALUES (NEW.retirado_por);
+        INSERT OR REPLACE INTO chips_dados (id, {COLUNAS_CHIPS}, observacoes, remessa_id)
+        VALUES (NEW.id, {_sql_codificar_chips('NEW')}, NEW.observacoes, NEW.remessa_id);'''
+    for nome, evento, corpo in (('insert', 'INSERT', espelhar), ('update', 'UPDATE', espelhar),
+                                ('delete', 'DELETE', 'DELETE FROM chips_dados WHERE id = OLD.id;')):
+        _criar_gatilho(cursor, f'trg_compactar_chips_{nome}', f'AFTER {evento}', 'chips', corpo, '')
+
+def _copiar_chips_compactos(cursor, depois_de, ate=None):
+    # Copia para chips_dados os chips com id em (depois_de, ate] (sem ate: todos os seguintes) ainda não copiados
+    faixa, params = ('id > ? AND id <= ?', (depois_de, ate)) if ate is not None else ('id > ?', (depois_de,))
+    cursor.execute(f'INSERT OR IGNORE INTO operadoras (nome) SELECT DISTINCT operadora FROM chips WHERE {faixa}', params)
+    cursor.execute('INSERT OR IGNORE INTO pessoas (nome) SELECT DISTINCT retirado_por FROM chips '
+                   f'WHERE {faixa} AND retirado_por IS NOT NULL', params)
+    cursor.execute(f'''
+        INSERT INTO chips_dados (id, {COLUNAS_CHIPS}, observacoes, remessa_id)
+        SELECT id, {_sql_codificar_chips('chips')}, observacoes, remessa_id FROM chips
+        WHERE {faixa} AND NOT EXISTS (SELECT 1 FROM chips_dados d WHERE d.id = chips.id)
+        ORDER BY id
+    ''', params)
+
+def _migracao_armazenamento_compacto(cursor):
+    # Troca chips e remessas por chips_dados e remessas_dados (ver codificar_iccid) e views com os nomes antigos.
+    # Num banco já em uso, Database._copiar_chips_compactos copia a maior parte dos chips em lotes antes desta
+    # transação; aqui entram os acima da fronteira e as remessas, e a troca em si
+    _criar_tabelas_compactas(cursor)
+    _copiar_chips_compactos(cursor, cursor.execute('SELECT ultimo_id FROM compactacao').fetchone()[0])
+    cursor.execute('INSERT OR IGNORE INTO operadoras (nome) SELECT DISTINCT operadora FROM remessas')
+    cursor.execute(f'''
+        INSERT INTO remessas_dados (id, numero_remessa, data_remessa, operadora, quantidade, observacoes)
+        SELECT id, numero_remessa, {_sql_segundos('data_remessa')}, {_sql_id('operadoras', 'operadora')}, quantidade,
+               observacoes
+        FROM remessas ORDER BY id
+    ''')
+    # DROP TABLE leva junto os índices, os triggers e a linha de sqlite_sequence (os ids não podem ser reusados:
+    # o arquivo guarda os dos chips arquivados)
+    sequencias = dict(cursor.execute("SELECT name, seq FROM sqlite_sequence WHERE name IN ('chips', 'remessas')"))
+    for tabela in ('chips', 'remessas', 'compactacao'):
+        cursor.execute(f'DROP TABLE {tabela}')
+    for antiga, nova in (('chips', 'chips_dados'), ('remessas', 'remessas_dados')):
+        cursor.execute('DELETE FROM sqlite_sequence WHERE name = ?', (nova,))
+        cursor.execute(f'INSERT INTO sqlite_sequence (name, seq) SELECT ?, max(?, COALESCE(MAX(id), 0)) FROM {nova}',
+                       (nova, sequencias.get(antiga, 0)))
+
+    # Views com as colunas de antes. Uma tabela só e subconsultas para os nomes: o SQLite achata a view dentro
+    # da consulta que a usa. O content='chips' de chips_busca passa a ler a view
+    cursor.execute(f'''
+        CREATE VIEW chips AS
+        SELECT c.id AS id, {_sql_decodificar_chips('c', _sql_nome('operadoras', 'c.operadora'),
+                                                   _sql_nome('pessoas', 'c.retirado_por'))},
+               c.observacoes AS observacoes, c.remessa_id AS remessa_id
+        FROM chips_dados c
+    ''')
+    cursor.execute(f'''
+        CREATE VIEW remessas AS
+        SELECT r.id AS id, r.numero_remessa AS numero_remessa, {_sql_data('r.data_remessa')} AS data_remessa,
+               {_sql_nome('operadoras', 'r.operadora')} AS operadora, r.quantidade AS quantidade,
+               r.observacoes AS observacoes
+        FROM remessas_dados r
+    ''')
+    gravar_operadora = 'INSERT OR IGNORE INTO operadoras (nome) VALUES (NEW.operadora);'
+    for view, tabela, nomes, colunas, valores in (
+            ('chips', 'chips_dados', gravar_operadora + ' INSERT OR IGNORE INTO pessoas (nome) VALUES (NEW.retirado_por);',
+             f'{COLUNAS_CHIPS}, observacoes, remessa_id',
+             f"{_sql_codificar_chips('NEW')}, NEW.observacoes, NEW.remessa_id"),
+            ('remessas', 'remessas_dados', gravar_operadora,
+             'numero_remessa, data_remessa, operadora, quantidade, observacoes',
+             f"NEW.numero_remessa, {_sql_segundos('NEW.data_remessa')}, {_sql_id('operadoras', 'NEW.operadora')}, "
+             'NEW.quantidade, NEW.observacoes')):
+        for evento, corpo in (
+                ('INSERT', f'{nomes} INSERT INTO {tabela} (id, {colunas}) VALUES (NEW.id, {valores});'),
+                ('UPDATE', f'{nomes} UPDATE {tabela} SET ({colunas}) = ({valores}) WHERE id = OLD.id;'),
+                ('DELETE', f'DELETE FROM {tabela} WHERE id = OLD.id;')):
+            _criar_gatilho(cursor, f'trg_{view}_{evento.lower()}', f'INSTEAD OF {evento}', view, corpo, '')
+
+    # Os triggers de chips e remessas (migrações 3, 4, 6 e 7), agora sobre as colunas compactas
+    _criar_gatilhos_contadores_chips(cursor, DIMENSOES_CHIPS_COMPACTOS,
+                                     'status, operadora, remessa_id, data_entrada, data_saida', 'chips_dados',
+                                     FORMATO_COMPACTO)
+    _criar_gatilhos_contadores_remessas(cursor, 'remessas_dados')
+    _criar_gatilhos_busca(cursor, 'chips_dados', FORMATO_COMPACTO)
+    _criar_gatilhos_movimentos_chips(cursor, 'chips_dados', FORMATO_COMPACTO)
+
+MIGRACOES = [
+    _migracao_tabelas_iniciais,
+    _migracao_indices_consultas,
+    _migracao_contadores,
+    _migracao_contadores_diarios,
+    _migracao_indice_remessa_entrada,
+    _migracao_busca_iccid,
+    _migracao_movimentos,
+    _migracao_sequencia_remessas,
+    _migracao_indice_arquivamento,
+    _migracao_armazenamento_compacto,
+]
+VERSAO_COMPACTA = MIGRACOES.index(_migracao_armazenamento_compacto) + 1
+# Migração online: chips copiados por transação antes da troca (Database._copiar_chips_compactos)
+TAMANHO_LOTE_COMPACTACAO = 20000
+PAUSA_LOTE_COMPACTACAO = 0.05
+# PRAGMA arquivo.user_version: 1 = chips_arquivados com as colunas compactas
+VERSAO_ARQUIVO = 1
+
+def caminho_arquivo(db_name):
+    # Banco de arquivo padrão: chips.db -> chips_arquivo.db (nenhum para bancos em memória)
+    if not db_name or db_name == ':memory:' or db_name.startswith('file:'):
+        return None
+    raiz, extensao = os.path.splitext(db_name)
+    return f"{raiz}_arquivo{extensao or '.db'}"
+
+# Modo de journal: WAL (leitores em paralelo com a gravação) só funciona com o banco num disco local, porque o
+# índice -shm é memória compartilhada entre os processos da mesma máquina. Numa pasta compartilhada, várias
+# estações com WAL corrompem o banco ou perdem o bloqueio; ali vale o journal de rollback (TRUNCATE), e o modo
+# serviço é o caminho para ter WAL com várias estações. None escolhe pelo local do arquivo
+MODOS_JOURNAL = ('wal', 'truncate', 'delete')
+SISTEMAS_ARQUIVOS_REDE = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'fuse.sshfs', 'afs', 'ceph', 'glusterfs'}
+
+def banco_em_rede(db_name):
+    # Caminhos UNC (\\servidor\pasta), unidades de rede do Windows e montagens NFS/SMB no Linux
+    if not db_name or db_name == ':memory:' or db_name.startswith('file:'):
+        return False
+    caminho = os.path.abspath(db_name)
+    if caminho.startswith(('\\\\', '//')):
+        return True
+    if os.name == 'nt':
+        import ctypes
+        return ctypes.windll.kernel32.GetDriveTypeW(os.path.splitdrive(caminho)[0] + '\\') == 4   # DRIVE_REMOTE
+    try:
+        with open('/proc/mounts', encoding='utf-8') as f:
+            montagens = [linha.split()[1:3] for linha in f]
+    except OSError:
+        return False
+    # A montagem mais específica que contém o arquivo (espaços vêm como \040 em /proc/mounts)
+    caminho = os.path.realpath(caminho)
+    contem = [(ponto, tipo) for ponto, tipo in ((ponto.replace('\\040', ' '), tipo) for ponto, tipo in montagens)
+              if caminho == ponto or caminho.startswith(ponto.rstrip('/') + '/')]
+    return max(contem, key=lambda montagem: len(montagem[0]), default=('', ''))[1] in SISTEMAS_ARQUIVOS_REDE
+
+def escolher_journal(db_name, journal=None):
+    if journal is None:
+        return 'truncate' if banco_em_rede(db_name) else 'wal'
+    journal = journal.lower()
+    if journal not in MODOS_JOURNAL:
+        raise ValueError(f"Modo de journal inválido: {journal}")
+    if journal == 'wal' and banco_em_rede(db_name):
+        raise ValueError(f"{db_name} está numa pasta de rede, onde o WAL não funciona; use --journal truncate "
+                         "ou o modo serviço")
+    return journal
+
+def banco_ocupado(erro):
+    # SQLITE_BUSY / SQLITE_LOCKED ("database is locked", "database table is locked")
+    return isinstance(erro, sqlite3.OperationalError) and ('locked' in str(erro) or 'busy' in str(erro))
+
 class Database:
-    def __init__(self, db_name='chips.db'):
+    def __init__(self, db_name='chips.db', cached_statements=256, instrumentacao=None, timeout=30, arquivo=None,
+                 journal=None):
+        # instrumentacao: instrumentacao.Instrumentacao para medir instruções e métodos (None: conexões comuns);
+        # timeout: segundos que o SQLite espera por um bloqueio antes de desistir;
+        # arquivo: banco dos chips arquivados (padrão: caminho_arquivo(db_name)), anexado quando existe;
+        # journal: um de MODOS_JOURNAL, ou None para WAL em disco local e TRUNCATE em pasta de rede
         self.db_name = db_name
+        self.journal = escolher_journal(db_name, journal)
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.arquivo = arquivo or caminho_arquivo(db_name)
+        self.arquivo_disponivel = bool(self.arquivo) and os.path.exists(self.arquivo)
+        self.instrumentacao = instrumentacao
+        self._local = threading.local()
+        self._conexoes = []
+        self._lock = threading.Lock()
+        if instrumentacao:
+            instrumentacao.instrumentar(self)
         self.init_database()
 
     def get_connection(self):
-        return sqlite3.connect(self.db_name)
-
-    def init_database(self):
+        # Conexão de longa duração da thread atual; não deve ser fechada por quem chama
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conectar = self.instrumentacao.conectar if self.instrumentacao else sqlite3.connect
+            conn = conectar(self.db_name, timeout=self.timeout, isolation_level=None, check_same_thread=False,
+                            cached_statements=self.cached_statements)
+            conn.execute(f'PRAGMA journal_mode={self.journal}')
+            # Sem WAL, o NORMAL pode corromper o banco numa queda de energia
+            conn.execute(f"PRAGMA synchronous={'NORMAL' if self.journal == 'wal' else 'FULL'}")
+            for pragma in PRAGMAS_CONEXAO:
+                conn.execute(pragma)
+            self._local.conn = conn
+            self._local.nivel = 0
+            self._local.anexado = False
+            with self._lock:
+                self._conexoes.append(conn)
+        if self.arquivo_disponivel and not self._local.anexado and not conn.in_transaction:
+            # Também numa conexão já aberta, quando o arquivo passou a existir depois dela
+            conn.execute('ATTACH DATABASE ? AS arquivo', (self.arquivo,))
+            conn.execute(f"PRAGMA arquivo.synchronous={'NORMAL' if self.journal == 'wal' else 'FULL'}")
+            self._local.anexado = True
+        return conn
+
+    def _com_arquivo(self, incluir_arquivo=True):
+        # O arquivo entra numa operação se pedido e se estiver anexado à conexão desta thread
+        # (um arquivo criado por outro processo depois da abertura é percebido aqui)
+        if incluir_arquivo and not self.arquivo_disponivel and self.arquivo:
+            self.arquivo_disponivel = os.path.exists(self.arquivo)
+        if not (incluir_arquivo and self.arquivo_disponivel):
+            return False
+        self.get_connection()
+        return self._local.anexado
+
+    def _preparar_arquivo(self):
+        # Cria (na primeira vez) e anexa o banco de arquivo
+        if not self.arquivo:
+            raise ValueError("Banco em memória não tem arquivo")
+        self.arquivo_disponivel = True
         conn = self.get_connection()
+        if not self._local.anexado:
+            raise RuntimeError("O arquivo não pode ser anexado dentro de uma transação")
+        conn.execute(f'PRAGMA arquivo.journal_mode={self.journal}')
+        with self.transacao(imediata=True) as cursor:
+            _criar_esquema_arquivo(cursor)
+
+    @contextmanager
+    def transacao(self, imediata=False):
+        # Transações aninhadas viram SAVEPOINTs dentro da transação externa
+        conn = self.get_connection()
+        nivel = self._local.nivel
+        if nivel == 0:
+            if imediata:
+                self._iniciar_imediata(conn)
+            else:
+                conn.execute('BEGIN')
+        else:
+            conn.execute(f'SAVEPOINT nivel_{nivel}')
+        self._local.nivel = nivel + 1
         cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chips (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                iccid TEXT UNIQUE NOT NULL,
-                operadora TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'Disponível',
-                data_entrada TEXT NOT NULL,
-                data_saida TEXT,
-                retirado_por TEXT,
-                observacoes TEXT,
-                remessa_id INTEGER,
-                FOREIGN KEY (remessa_id) REFERENCES remessas(id)
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS remessas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                numero_remessa TEXT UNIQUE NOT NULL,
-                data_remessa TEXT NOT NULL,
-                operadora TEXT,
-                quantidade INTEGER,
-                observacoes TEXT
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        try:
+            yield cursor
+        except BaseException:
+            self._local.nivel = nivel
+            if conn.in_transaction:
+                if nivel == 0:
+                    conn.execute('ROLLBACK')
+                else:
+                    conn.execute(f'ROLLBACK TO nivel_{nivel}')
+                    conn.execute(f'RELEASE nivel_{nivel}')
+            raise
+        else:
+            self._local.nivel = nivel
+            try:
+                conn.execute('COMMIT' if nivel == 0 else f'RELEASE nivel_{nivel}')
+            except sqlite3.Error:
+                if nivel == 0 and conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+        finally:
+            cursor.close()
+
+    def _iniciar_imediata(self, conn):
+        # BEGIN IMMEDIATE reserva a escrita logo no início: uma transação que lê e depois grava não pode falhar
+        # no meio porque outra conexão gravou antes (o que um BEGIN comum permite)
+        espera = ESPERA_INICIAL_BLOQUEIO
+        for tentativa in range(TENTATIVAS_BLOQUEIO):
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                return
+            except sqlite3.OperationalError as e:
+                if tentativa == TENTATIVAS_BLOQUEIO - 1 or not banco_ocupado(e):
+                    raise
+            time.sleep(espera * random.uniform(0.5, 1.5))
+            espera = min(espera * 2, ESPERA_MAXIMA_BLOQUEIO)
+
+    def executar(self, sql, params=()):
+        # Leitura avulsa na conexão da thread (autocommit)
+        return self.get_connection().execute(sql, params)
+
+    def fechar(self):
+        with self._lock:
+            conexoes, self._conexoes = self._conexoes, []
+        for conn in conexoes:
+            conn.close()
+        self._local = threading.local()
 
-    def limpar_iccid(self, iccid):
-        return ''.join(filter(str.isdigit, iccid))
+    def init_database(self):
+        # Aplica as migrações pendentes a partir de PRAGMA user_version, em uma única transação
+        # (e converte um arquivo anexado de uma versão anterior)
+        versao = self.versao_esquema()
+        if versao < len(MIGRACOES):
+            if 0 < versao < VERSAO_COMPACTA:
+                self._copiar_chips_compactos()
+            with self.transacao(imediata=True) as cursor:
+                versao = cursor.execute('PRAGMA user_version').fetchone()[0]
+                for numero in range(versao + 1, len(MIGRACOES) + 1):
+                    MIGRACOES[numero - 1](cursor)
+                    cursor.execute(f'PRAGMA user_version = {numero}')
+        if self._com_arquivo() and self.executar('PRAGMA arquivo.user_version').fetchone()[0] < VERSAO_ARQUIVO:
+            self._preparar_arquivo()
+
+    def _copiar_chips_compactos(self, tamanho_lote=TAMANHO_LOTE_COMPACTACAO, pausa=PAUSA_LOTE_COMPACTACAO):
+        # Antes da migração 10 num banco em uso: copia chips para chips_dados em lotes por id, cada um numa transação
+        # curta, enquanto os triggers de _criar_tabelas_compactas repetem lá o que as outras conexões (inclusive de
+        # estações com a versão anterior) alterarem. A fronteira fica em compactacao: uma cópia interrompida continua
+        # de onde parou, e vários processos abrindo o banco ao mesmo tempo dividem o trabalho
+        while True:
+            with self.transacao(imediata=True) as cursor:
+                if cursor.execute('PRAGMA user_version').fetchone()[0] >= VERSAO_COMPACTA:
+                    return
+                _criar_tabelas_compactas(cursor)
+                ultimo_id = cursor.execute('SELECT ultimo_id FROM compactacao').fetchone()[0]
+                ate = cursor.execute('SELECT MAX(id) FROM (SELECT id FROM chips WHERE id > ? ORDER BY id LIMIT ?)',
+                                     (ultimo_id, tamanho_lote)).fetchone()[0]
+                if ate is None:
+                    return
+                _copiar_chips_compactos(cursor, ultimo_id, ate)
+                cursor.execute('UPDATE compactacao SET ultimo_id = ?', (ate,))
+            time.sleep(pausa)
+
+    def versao_esquema(self):
+        return self.executar('PRAGMA user_version').fetchone()[0]
 
     def adicionar_chip(self, iccid, operadora, remessa_id=None, observacoes=''):
-        iccid = self.limpar_iccid(iccid)
-        if not iccid.isdigit():
+        iccid, motivo = validar_iccid(iccid)
+        if motivo:
+            return False
+        if self._com_arquivo() and self.executar('SELECT 1 FROM arquivo.chips_arquivados WHERE iccid = ?',
+                                                 (codificar_iccid(iccid),)).fetchone():
             return False
-        conn = self.get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute('''
-                INSERT INTO chips (iccid, operadora, data_entrada, remessa_id, observacoes)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (iccid, operadora, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), remessa_id, observacoes))
-            conn.commit()
+            with self.transacao() as cursor:
+                cursor.execute('INSERT OR IGNORE INTO operadoras (nome) VALUES (?)', (operadora,))
+                cursor.execute(f'''
+                    INSERT INTO chips_dados (iccid, operadora, data_entrada, remessa_id, observacoes)
+                    VALUES (?, {_sql_id('operadoras', '?')}, {_sql_segundos('?')}, ?, ?)
+                ''', (codificar_iccid(iccid), operadora, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), remessa_id,
+                      observacoes))
             return True
         except sqlite3.IntegrityError:
             return False
-        finally:
-            conn.close()
 
-    def adicionar_chips_lote(self, chips, remessa_id=None):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        sucesso, falhas = 0, []
-        for iccid, operadora in chips:
-            iccid = self.limpar_iccid(iccid)
-            if not iccid.isdigit():
-                falhas.append(iccid)
-                continue
-            try:
-                cursor.execute('''
-                    INSERT INTO chips (iccid, operadora, data_entrada, remessa_id)
-                    VALUES (?, ?, ?, ?)
-                ''', (iccid, operadora, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), remessa_id))
-                sucesso += 1
-            except sqlite3.IntegrityError:
-                falhas.append(iccid)
-        conn.commit()
-        conn.close()
+    def adicionar_chips_lote(self, chips, remessa_id=None, tamanho_lote=TAMANHO_LOTE_PADRAO, progresso=None,
+                             data_entrada=None):
+        # Normaliza, valida (tamanho, prefixo, Luhn) e remove duplicatas em memória, bloco a bloco;
+        # cada bloco é gravado em uma transação própria.
+        # chips pode ser qualquer iterável (inclusive um gerador lendo um arquivo); data_entrada padrão: agora.
+        # Dentro de uma transação externa (cadastrar_remessa), os blocos não são confirmados um a um: o índice de
+        # busca e o livro de movimentos ficam para uma passada só, no fim
+        sucesso, falhas, processados = 0, [], 0
+        data_entrada = data_entrada or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        vistos = set()
+        entradas = Counter() if self._local.nivel else None
+        ultimo_id = None
+        for bloco in em_blocos(chips, tamanho_lote):
+            iccids, motivos = validar_iccids([iccid for iccid, _ in bloco], vistos)
+            if motivos:
+                falhas.extend(FalhaChip(iccids[indice] or bloco[indice][0], motivo)
+                              for indice, motivo in sorted(motivos.items()))
+                novos = [(iccid, bloco[indice][1]) for indice, iccid in enumerate(iccids) if indice not in motivos]
+            else:
+                novos = [(iccid, operadora) for iccid, (_, operadora) in zip(iccids, bloco)]
+            if novos:
+                if entradas is not None and ultimo_id is None:
+                    ultimo_id = self.executar('SELECT COALESCE(MAX(id), 0) FROM chips_dados').fetchone()[0]
+                sucesso += self._gravar_bloco_chips(novos, remessa_id, data_entrada, falhas, entradas)
+            processados += len(bloco)
+            if progresso:
+                progresso(processados)
+        if entradas:
+            with self.transacao() as cursor, self._gatilhos_suspensos(cursor):
+                self._registrar_entradas(cursor, ultimo_id, data_entrada, entradas)
         return sucesso, falhas
 
+    def _gravar_bloco_chips(self, novos, remessa_id, data_entrada, falhas, entradas=None):
+        # Staging em tabela temporária: um JOIN acha os já cadastrados e um INSERT OR IGNORE ... SELECT grava o resto.
+        # Com `entradas` (Counter por operadora), só acumula os inseridos: quem chama faz _registrar_entradas depois
+        with self.transacao(imediata=True) as cursor:
+            cursor.execute(SQL_CRIAR_LOTE_CHIPS)
+            cursor.execute('DELETE FROM temp.lote_chips')
+            cursor.executemany('INSERT INTO temp.lote_chips (iccid, operadora) VALUES (?, ?)', novos)
+            cursor.execute(SQL_CHIPS_JA_CADASTRADOS)
+            existentes = [FalhaChip(iccid, MOTIVO_JA_CADASTRADO) for iccid, in cursor.fetchall()]
+            if self._com_arquivo():
+                # O UNIQUE de chips não enxerga o arquivo: os já arquivados saem do lote antes do INSERT
+                arquivados = [iccid for iccid, in cursor.execute(SQL_JA_ARQUIVADOS).fetchall()]
+                cursor.executemany('DELETE FROM temp.lote_chips WHERE iccid = ?', ((iccid,) for iccid in arquivados))
+                existentes += [FalhaChip(iccid, MOTIVO_JA_ARQUIVADO) for iccid in arquivados]
+            ultimo_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM chips_dados').fetchone()[0]
+            cursor.execute('INSERT OR IGNORE INTO operadoras (nome) SELECT DISTINCT operadora FROM temp.lote_chips')
+            with self._gatilhos_suspensos(cursor):
+                cursor.execute(SQL_GRAVAR_LOTE_CHIPS, (data_entrada, remessa_id))
+                inseridos = cursor.rowcount
+                deltas, quantidades = {}, Counter()
+                cursor.execute('SELECT o.nome, COUNT(*) FROM chips_dados c JOIN operadoras o ON o.id = c.operadora '
+                               'WHERE c.id > ? GROUP BY c.operadora', (ultimo_id,))
+                for operadora, quantidade in cursor.fetchall():
+                    _acumular_chips(deltas, 1, quantidade, operadora, 'Disponível', remessa_id, data_entrada, None)
+                    quantidades[operadora] += quantidade
+                self._somar_contadores(cursor, deltas)
+                if entradas is None:
+                    self._registrar_entradas(cursor, ultimo_id, data_entrada, quantidades)
+                else:
+                    entradas.update(quantidades)
+            cursor.execute('DELETE FROM temp.lote_chips')
+        falhas.extend(existentes)
+        return inseridos
+
+    def _registrar_entradas(self, cursor, ultimo_id, data_entrada, quantidades):
+        # Índice de busca e livro dos chips com id > ultimo_id, todos com a mesma data de entrada; os resumos
+        # recebem os totais por operadora já contados, em vez de um GROUP BY sobre as linhas novas do livro
+        cursor.execute(SQL_INDEXAR_BUSCA_NOVOS, (ultimo_id,))
+        cursor.execute(SQL_MOVIMENTOS_ENTRADA_NOVOS, (ultimo_id,))
+        for granularidade in RESUMOS_MOVIMENTOS:
+            cursor.executemany(_sql_somar_resumo(granularidade),
+                               [(MOVIMENTO_ENTRADA, data_entrada, '', operadora, quantidade)
+                                for operadora, quantidade in quantidades.items()])
+
     def gerar_numero_remessa(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        data_atual = datetime.now().strftime('%Y%m%d')
-        prefixo = f"REM-{data_atual}"
-        cursor.execute('''
-            SELECT numero_remessa FROM remessas
-            WHERE numero_remessa LIKE ?
-            ORDER BY numero_remessa DESC LIMIT 1
-        ''', (f"{prefixo}-%",))
-        resultado = cursor.fetchone()
-        conn.close()
-        proximo_num = int(resultado[0].split('-')[-1]) + 1 if resultado else 1
-        return f"{prefixo}-{proximo_num:04d}"
+        # Próximo número do dia, só para exibição: quem reserva o número de fato é criar_remessa
+        dia = datetime.now().strftime('%Y%m%d')
+        resultado = self.executar(SQL_SEQUENCIA_REMESSA, (dia,)).fetchone()
+        return f"REM-{dia}-{(resultado[0] if resultado else 0) + 1:04d}"
+
+    def _alocar_numero_remessa(self, cursor):
+        # Incrementa a sequência do dia dentro da transação de escrita corrente
+        dia = datetime.now().strftime('%Y%m%d')
+        cursor.execute(SQL_ALOCAR_NUMERO_REMESSA, (dia,))
+        ultimo = cursor.execute(SQL_SEQUENCIA_REMESSA, (dia,)).fetchone()[0]
+        return f"REM-{dia}-{ultimo:04d}"
 
     def criar_remessa(self, operadora, quantidade, observacoes=''):
-        numero_remessa = self.gerar_numero_remessa()
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO remessas (numero_remessa, data_remessa, operadora, quantidade, observacoes)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (numero_remessa, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), operadora, quantidade, observacoes))
-        remessa_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.transacao(imediata=True) as cursor:
+            numero_remessa = self._alocar_numero_remessa(cursor)
+            cursor.execute('INSERT OR IGNORE INTO operadoras (nome) VALUES (?)', (operadora,))
+            cursor.execute(f'''
+                INSERT INTO remessas_dados (numero_remessa, data_remessa, operadora, quantidade, observacoes)
+                VALUES (?, {_sql_segundos('?')}, {_sql_id('operadoras', '?')}, ?, ?)
+            ''', (numero_remessa, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), operadora, quantidade, observacoes))
+            remessa_id = cursor.lastrowid
         return remessa_id, numero_remessa
 
-    def listar_chips(self, filtro_operadora=None, filtro_status=None):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        query = 'SELECT iccid, operadora, status, data_entrada, data_saida, retirado_por FROM chips WHERE 1=1'
-        params = []
-        if filtro_operadora:
-            query += ' AND operadora=?'
-            params.append(filtro_operadora)
-        if filtro_status:
-            query += ' AND status=?'
-            params.append(filtro_status)
-        query += ' ORDER BY data_entrada DESC'
-        cursor.execute(query, params)
-        resultados = cursor.fetchall()
-        conn.close()
-        return resultados
+    def retirar_chips_lote(self, iccids, retirado_por, data_saida=None, tamanho_lote=TAMANHO_LOTE_RETIRADA,
+                           progresso=None):
+        # ICCIDs vão para uma tabela temporária, lote a lote; o diagnóstico e o UPDATE usam JOINs, e todos os lotes
+        # ficam na mesma transação, com um único timestamp para toda a retirada (padrão: agora): um erro ou
+        # cancelamento (pelo progresso) desfaz tudo
+        data_saida = data_saida or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        resultado = {'retirados': [], 'ja_retirados': [], 'desconhecidos': []}
+        iccids = list(dict.fromkeys(iccid for iccid in normalizar_iccids(list(iccids)) if iccid))
+        processados = 0
+        with self.transacao(imediata=True) as cursor:
+            cursor.execute(SQL_CRIAR_LOTE_RETIRADA)
+            cursor.execute('INSERT OR IGNORE INTO pessoas (nome) VALUES (?)', (retirado_por,))
+            for bloco in em_blocos(iccids, tamanho_lote):
+                cursor.execute('DELETE FROM temp.lote_retirada')
+                cursor.executemany('INSERT INTO temp.lote_retirada (iccid) VALUES (?)', ((iccid,) for iccid in bloco))
+                self._retirar_bloco(cursor, resultado, retirado_por, data_saida)
+                processados += len(bloco)
+                if progresso:
+                    progresso(processados)
+            cursor.execute('DELETE FROM temp.lote_retirada')
+        return resultado
+
+    def _retirar_bloco(self, cursor, resultado, retirado_por, data_saida):
+        cursor.execute(SQL_DIAGNOSTICO_RETIRADA)
+        grupos = Counter()
+        desconhecidos = []
+        for iccid, status, por, quando, operadora, remessa_id, data_entrada in cursor.fetchall():
+            if status is None:
+                desconhecidos.append(iccid)
+            elif status == 'Disponível':
+                resultado['retirados'].append(iccid)
+                grupos[operadora, remessa_id, data_entrada[:10], quando] += 1
+            else:
+                resultado['ja_retirados'].append((iccid, por, quando))
+        if desconhecidos and self._com_arquivo():
+            arquivados = {linha[0]: tuple(linha) for linha in cursor.execute(SQL_RETIRADA_ARQUIVADOS)}
+            resultado['ja_retirados'] += [arquivados[iccid] for iccid in desconhecidos if iccid in arquivados]
+            desconhecidos = [iccid for iccid in desconhecidos if iccid not in arquivados]
+        resultado['desconhecidos'] += desconhecidos
+        deltas = {}
+        for (operadora, remessa_id, data_entrada, saida_anterior), quantidade in grupos.items():
+            _acumular_chips(deltas, -1, quantidade, operadora, 'Disponível', remessa_id, data_entrada, saida_anterior)
+            _acumular_chips(deltas, 1, quantidade, operadora, 'Retirado', remessa_id, data_entrada, data_saida)
+        with self._gatilhos_suspensos(cursor):
+            self._registrar_movimentos(cursor, SQL_MOVIMENTOS_RETIRADA_LOTE, (data_saida, retirado_por or ''))
+            cursor.execute(SQL_RETIRAR_LOTE, (data_saida, retirado_por))
+            self._somar_contadores(cursor, deltas)
+
+    def cadastrar_remessa(self, linhas, operadora, observacoes='', tamanho_lote=TAMANHO_LOTE_PADRAO, progresso=None):
+        # Remessa e chips em uma única transação IMMEDIATE: um erro, cancelamento ou queda no meio desfaz tudo
+        # (inclusive o número alocado), e a quantidade gravada é a de chips de fato inseridos. Se nenhum chip
+        # entrar (todos já cadastrados ou inválidos), o ValueError com o resumo dos recusados também desfaz a remessa.
+        # Retorna (remessa_id, numero_remessa, cadastrados, recusados)
+        falhas_operadora = []
+        chips = preparar_chips(linhas, operadora, falhas_operadora)
+        primeiro = next(chips, None)
+        if primeiro is None:
+            raise ValueError("Nenhum chip válido encontrado!")
+        with self.transacao(imediata=True):
+            remessa_id, numero_remessa = self.criar_remessa(operadora, 0, observacoes)
+            sucesso, falhas = self.adicionar_chips_lote(chain([primeiro], chips), remessa_id,
+                                                        tamanho_lote=tamanho_lote, progresso=progresso)
+            if not sucesso:
+                raise ValueError("Nenhum chip cadastrado; a remessa não foi criada.\n\n"
+                                 + resumir_falhas(falhas + falhas_operadora))
+            self.definir_quantidade_remessa(remessa_id, sucesso)
+        return remessa_id, numero_remessa, sucesso, falhas + falhas_operadora
+
+    def definir_quantidade_remessa(self, remessa_id, quantidade):
+        with self.transacao() as cursor:
+            cursor.execute('UPDATE remessas_dados SET quantidade=? WHERE id=?', (quantidade, remessa_id))
+
+    def listar_chips(self, filtro_operadora=None, filtro_status=None, **filtros):
+        # filtros: data_inicio, data_fim, remessa_id e incluir_arquivo (também os chips arquivados)
+        query, params = montar_consulta_chips(filtro_operadora, filtro_status, **self._filtros_arquivo(filtros))
+        return self.executar(query, params).fetchall()
+
+    def iterar(self, sql, params=(), tamanho_bloco=TAMANHO_BLOCO_EXPORTACAO):
+        # Lê o resultado em blocos com fetchmany (memória constante)
+        cursor = self.get_connection().execute(sql, params)
+        try:
+            while True:
+                linhas = cursor.fetchmany(tamanho_bloco)
+                if not linhas:
+                    return
+                yield from linhas
+        finally:
+            cursor.close()
+
+    def iterar_chips(self, filtro_operadora=None, filtro_status=None, **filtros):
+        # Mesma consulta (e filtros) de listar_chips, sem carregar tudo em memória
+        query, params = montar_consulta_chips(filtro_operadora, filtro_status, **self._filtros_arquivo(filtros))
+        return self.iterar(query, params)
+
+    def exportar_chips(self, destino, formato=None, progresso=None, **filtros):
+        # Filtros como em listar_chips (filtro_operadora, filtro_status, data_inicio, data_fim, remessa_id)
+        return escrever_tabela(destino, CABECALHO_CHIPS, self.iterar_chips(**filtros), formato, progresso, 'Chips')
+
+    def exportar_remessas(self, destino, formato=None, progresso=None):
+        return escrever_tabela(destino, CABECALHO_REMESSAS, self.iterar(SQL_LISTAR_REMESSAS), formato, progresso,
+                               'Remessas')
+
+    def conciliar(self, linhas, filtro_operadora=None, tamanho_lote=TAMANHO_LOTE_PADRAO, incluir_arquivo=False):
+        # Confere um inventário externo [(iccid, operadora)] com o banco e gera (categoria, iccid, detalhe) para cada
+        # divergência, em ordem de ICCID; chips disponíveis no banco que faltam no arquivo também são listados
+        # (com filtro_operadora, só os dessa operadora). O inventário passa por ordenar_inventario e é intercalado
+        # com a leitura ordenada dos chips: a memória fica em torno de tamanho_lote linhas, qualquer que seja o
+        # tamanho do arquivo. Com incluir_arquivo, os arquivados contam como cadastrados (e retirados)
+        tabelas = (TABELAS_PRINCIPAL[0], TABELAS_ARQUIVO[0]) if self._com_arquivo(incluir_arquivo) \
+            else (TABELAS_PRINCIPAL[0],)
+        chips = heapq.merge(*(((_chave_iccid(codigo),) + tuple(linha) for codigo, *linha in
+                               self.iterar(SQL_CONCILIAR.format(tabela=tabela))) for tabela in tabelas))
+        chip, anterior = next(chips, None), None
+        # A chave (2,) vem depois de todas as outras: no fim do inventário, esgota os chips restantes
+        for chave, iccid, operadora in chain(ordenar_inventario(linhas, tamanho_lote), [((2,), None, '')]):
+            if chave == anterior:
+                yield CONCILIACAO_DUPLICADO, iccid, ''
+                continue
+            anterior = chave
+            while chip is not None and chip[0] < chave:
+                if chip[3] == 'Disponível' and filtro_operadora in (None, chip[2]):
+                    yield CONCILIACAO_AUSENTE_ARQUIVO, chip[1], chip[2]
+                chip = next(chips, None)
+            if iccid is None:
+                return
+            if chip is None or chip[0] != chave:
+                yield CONCILIACAO_NAO_CADASTRADO, iccid, ''
+                continue
+            _, _, operadora_banco, status, por, quando = chip
+            if operadora and operadora != operadora_banco:
+                yield CONCILIACAO_OPERADORA_DIVERGENTE, iccid, f"arquivo: {operadora}, banco: {operadora_banco}"
+            if status == 'Retirado':
+                yield CONCILIACAO_RETIRADO, iccid, f"{por or '?'} em {quando or '?'}"
+            chip = next(chips, None)
+
+    def buscar_iccid(self, trecho, modo=BUSCA_CONTEM, limite=LIMITE_BUSCA_ICCID, incluir_arquivo=False):
+        # Busca por parte do ICCID (modo: BUSCA_INICIO, BUSCA_FINAL ou BUSCA_CONTEM). Final e trecho precisam de
+        # MIN_DIGITOS_BUSCA dígitos para usar o índice de trigramas; com menos, nada é retornado.
+        # Com incluir_arquivo, os arquivados completam o resultado até o limite
+        digitos = normalizar_iccid(trecho)
+        if modo == BUSCA_INICIO:
+            if not digitos:
+                return []
+            faixas = [faixa for faixa in (faixa_prefixo_iccid(digitos), (digitos, digitos + ':')) if faixa]
+            consultas = [(tabela == TABELAS_ARQUIVO[0], SQL_BUSCA_PREFIXO.format(tabela=tabela), faixa)
+                         for tabela in (TABELAS_PRINCIPAL[0], TABELAS_ARQUIVO[0]) for faixa in faixas]
+        elif len(digitos) < MIN_DIGITOS_BUSCA:
+            return []
+        else:
+            params = ('%' + digitos + ('%' if modo == BUSCA_CONTEM else ''),)
+            consultas = [(False, SQL_BUSCA_TRECHO, params), (True, SQL_BUSCA_TRECHO_ARQUIVO, params)]
+        chips = []
+        for do_arquivo, sql, params in consultas:
+            if len(chips) >= limite:
+                break
+            if not do_arquivo or self._com_arquivo(incluir_arquivo):
+                chips += self.executar(sql, params + (limite - len(chips),)).fetchall()
+        return chips
+
+    def listar_chips_pagina(self, filtro_operadora=None, filtro_status=None, cursor=None, limite=TAMANHO_PAGINA,
+                            **filtros):
+        # Paginação por chave (data_entrada, id), sem OFFSET: o custo de uma página não depende da profundidade.
+        # Retorna (linhas, cursor da próxima página ou None se esta foi a última)
+        linhas = []
+        filtros = self._filtros_arquivo(filtros)
+        if cursor is not None:
+            query, params = montar_consulta_pagina(filtro_operadora, filtro_status, cursor, True, limite, **filtros)
+            linhas = self.executar(query, params).fetchall()
+        if len(linhas) < limite:
+            query, params = montar_consulta_pagina(filtro_operadora, filtro_status, cursor, False,
+                                                   limite - len(linhas), **filtros)
+            linhas += self.executar(query, params).fetchall()
+        proximo = (linhas[-1][7], linhas[-1][6]) if len(linhas) == limite else None
+        return [linha[:6] for linha in linhas], proximo
+
+    def contar_chips(self, filtro_operadora=None, filtro_status=None, data_inicio=None, data_fim=None, remessa_id=None,
+                     incluir_arquivo=False):
+        # Os contadores respondem a operadora x status, ou remessa x status, sem tocar em chips;
+        # com período (ou remessa e operadora juntas) a contagem vai para os índices
+        incluir_arquivo = self._com_arquivo(incluir_arquivo)
+        coluna = {None: 0, 'Disponível': 1, 'Retirado': 2}.get(filtro_status)
+        if coluna is None or data_inicio or data_fim or (remessa_id is not None and filtro_operadora):
+            query, params = montar_contagem_chips(filtro_operadora, filtro_status, incluir_arquivo,
+                                                  data_inicio=data_inicio, data_fim=data_fim, remessa_id=remessa_id)
+            return self.executar(query, params).fetchone()[0]
+        if remessa_id is not None:
+            chave = ('remessa', str(int(remessa_id)))
+        else:
+            chave = ('operadora', filtro_operadora) if filtro_operadora else ('geral', '')
+        total = 0
+        for consulta in (SQL_CONTADOR, SQL_CONTADOR_ARQUIVO) if incluir_arquivo else (SQL_CONTADOR,):
+            linha = self.executar(consulta, chave).fetchone()
+            total += linha[coluna] if linha else 0
+        return total
+
+    def _filtros_arquivo(self, filtros):
+        if filtros.get('incluir_arquivo'):
+            filtros['incluir_arquivo'] = self._com_arquivo()
+        return filtros
 
     def listar_remessas(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, numero_remessa, data_remessa, operadora, quantidade, observacoes FROM remessas ORDER BY data_remessa DESC')
-        resultados = cursor.fetchall()
-        conn.close()
-        return resultados
-
-    def estatisticas(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM chips')
-        total = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM chips WHERE status='Disponível'")
-        disponiveis = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM chips WHERE status='Retirado'")
-        retirados = cursor.fetchone()[0]
-        cursor.execute('SELECT COUNT(*) FROM remessas')
-        total_remessas = cursor.fetchone()[0]
-        conn.close()
+        return self.executar(SQL_LISTAR_REMESSAS).fetchall()
+
+    def excluir_remessa(self, remessa_id, excluir_chips=False, tamanho_lote=TAMANHO_LOTE_EXCLUSAO, progresso=None):
+        # Os chips (de chips e do arquivo) saem em lotes de `tamanho_lote`, cada um numa transação curta, para não
+        # segurar a escrita das outras conexões numa remessa grande; a remessa é apagada por último, então uma
+        # exclusão interrompida pode ser repetida. Retorna quantos chips foram excluídos
+        remessa_id = int(remessa_id)
+        excluidos = 0
+        if excluir_chips:
+            conn = self.get_connection()
+            conn.execute(SQL_CRIAR_LOTE_IDS)
+            try:
+                for tabelas in (TABELAS_PRINCIPAL, TABELAS_ARQUIVO) if self._com_arquivo() else (TABELAS_PRINCIPAL,):
+                    while True:
+                        with self.transacao(imediata=True) as cursor:
+                            cursor.execute('DELETE FROM temp.lote_ids')
+                            cursor.execute(SQL_LOTE_CHIPS_REMESSA.format(tabela=tabelas[0]), (remessa_id, tamanho_lote))
+                            removidos = self._remover_lote(cursor, tabelas, MOVIMENTO_EXCLUSAO)
+                        excluidos += removidos
+                        if progresso:
+                            progresso(excluidos)
+                        if removidos < tamanho_lote:
+                            break
+            finally:
+                conn.execute('DELETE FROM temp.lote_ids')
+        with self.transacao(imediata=True) as cursor:
+            cursor.execute('DELETE FROM remessas_dados WHERE id=?', (remessa_id,))
+        return excluidos
+
+    def estatisticas(self, incluir_arquivo=False):
+        linhas = {dimensao: (total, disponiveis, retirados)
+                  for dimensao, total, disponiveis, retirados in self.executar(SQL_ESTATISTICAS)}
+        total, disponiveis, retirados = linhas.get('geral', (0, 0, 0))
+        total_remessas = linhas.get('remessas', (0, 0, 0))[0]
+        if self._com_arquivo(incluir_arquivo):
+            linha = self.executar(SQL_CONTADOR_ARQUIVO, ('geral', '')).fetchone() or (0, 0, 0)
+            total, disponiveis, retirados = total + linha[0], disponiveis + linha[1], retirados + linha[2]
         return {'total': total, 'disponiveis': disponiveis, 'retirados': retirados, 'total_remessas': total_remessas}
 
-class MonitoramentoApp:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("📱 Sistema de Monitoramento de Chips")
-        self.root.geometry("1300x750")
-        self.root.configure(bg=COR_FUNDO)
-        self.db = Database()
-        self.setup_styles()
-        self.create_header()
-        self.notebook = ttk.Notebook(self.root)
-        self.notebook.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
-        self.criar_aba_cadastro_individual()
-        self.criar_aba_cadastro_lote()
-        self.criar_aba_retirada()
-        self.criar_aba_consulta()
-        self.criar_aba_remessas()
-        self.criar_aba_estatisticas()
-
-    def setup_styles(self):
-        style = ttk.Style()
-        style.theme_use('clam')
-        style.configure('TNotebook.Tab', padding=[20, 10], font=('Segoe UI', 10, 'bold'))
-        style.map('TNotebook.Tab', background=[('selected', COR_PRIMARIA)], foreground=[('selected', 'white')])
-
-    def create_header(self):
-        header = tk.Frame(self.root, bg=COR_PRIMARIA, height=70)
-        header.pack(fill=tk.X)
-        header.pack_propagate(False)
-        tk.Label(header, text="📱 Monitoramento de Chips", font=('Segoe UI', 20, 'bold'),
-                 bg=COR_PRIMARIA, fg='white').pack(side=tk.LEFT, padx=30)
-
-    # -------------------------
-    # ABA CADASTRO INDIVIDUAL
-    # -------------------------
-    def criar_aba_cadastro_individual(self):
-        frame = tk.Frame(self.notebook, bg=COR_FUNDO)
-        self.notebook.add(frame, text="➕ Cadastro Individual")
-
-        card = CardFrame(frame)
-        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
-        inner = card.inner_frame
-
-        tk.Label(inner, text="ICCID:", font=('Segoe UI', 12, 'bold'), bg=COR_CARD).pack(pady=10)
-        self.iccid_entry = ttk.Entry(inner, width=40)
-        self.iccid_entry.pack(pady=5)
-
-        tk.Label(inner, text="Operadora:", font=('Segoe UI', 12, 'bold'), bg=COR_CARD).pack(pady=10)
-        self.operadora_combo = ttk.Combobox(inner, values=OPERADORAS, width=37, state='readonly')
-        self.operadora_combo.pack(pady=5)
-
-        ModernButton(inner, "✓ Cadastrar Chip", self.cadastrar_chip_individual,
-                     width=180, height=45, bg_color=COR_SUCESSO, hover_color='#059669').pack(pady=20)
-
-    def cadastrar_chip_individual(self):
-        iccid = self.iccid_entry.get().strip()
-        operadora = self.operadora_combo.get().strip()
-        if not iccid or not operadora:
-            messagebox.showerror("Erro", "Preencha todos os campos!")
-            return
-        if self.db.adicionar_chip(iccid, operadora):
-            messagebox.showinfo("Sucesso", f"Chip {iccid} cadastrado!")
-            self.iccid_entry.delete(0, tk.END)
-            self.operadora_combo.set('')
+    def estatisticas_por_operadora(self, incluir_arquivo=False):
+        # [(operadora, total, disponíveis, retirados)]
+        linhas = self.executar(SQL_CONTADORES_DIMENSAO, ('operadora',)).fetchall()
+        if not self._com_arquivo(incluir_arquivo):
+            return linhas
+        somas = {operadora: list(valores) for operadora, *valores in linhas}
+        for operadora, *valores in self.executar(SQL_CONTADORES_DIMENSAO_ARQUIVO, ('operadora',)):
+            somas[operadora] = [a + b for a, b in zip(somas.get(operadora, (0, 0, 0)), valores)]
+        return [(operadora, *valores) for operadora, valores in sorted(somas.items())]
+
+    def serie_movimentos_diarios(self, dias=30):
+        # [(dia, entradas, saídas)] dos últimos `dias` dias, lida dos contadores diários
+        inicio = (datetime.now() - timedelta(days=dias - 1)).strftime('%Y-%m-%d')
+        serie = {}
+        for dimensao, dia, total in self.executar(SQL_SERIE_DIARIA, (inicio,)):
+            if dia:
+                serie.setdefault(dia, [0, 0])[dimensao == 'saida_dia'] += total
+        return [(dia, entradas, saidas) for dia, (entradas, saidas) in sorted(serie.items())]
+
+    def estatisticas_por_remessa(self):
+        # [(remessa_id como texto, '' para chips avulsos, total, disponíveis, retirados)]
+        return self.executar(SQL_CONTADORES_DIMENSAO, ('remessa',)).fetchall()
+
+    def historico_chip(self, iccid):
+        # [(data, tipo, operadora, remessa_id, responsável)] do chip, em ordem de gravação
+        return self.executar(SQL_HISTORICO_CHIP, (normalizar_iccid(iccid),)).fetchall()
+
+    def resumo_movimentos(self, tipo, inicio, fim, granularidade='dia', agrupar_por=None, operadora=None,
+                          responsavel=None):
+        # Série por dia ou por mês ('mes') entre inicio e fim ('AAAA-MM-DD', inclusive), lida dos resumos.
+        # agrupar_por: None, 'responsavel' ou 'operadora' -> [(período, [chave,] quantidade)]
+        _ler_dia(inicio), _ler_dia(fim)
+        query, params = montar_resumo_movimentos(granularidade, tipo, inicio, fim, agrupar_por, operadora,
+                                                 responsavel)
+        return self.executar(query, params).fetchall()
+
+    def totais_movimentos(self, tipo, inicio, fim, agrupar_por=None, operadora=None, responsavel=None):
+        # Total do período inteiro ({chave do agrupamento ou '': quantidade}): os meses completos vêm do resumo
+        # mensal e só as pontas do intervalo do diário, então um trimestre lê umas poucas dezenas de linhas
+        primeiro, ultimo = _ler_dia(inicio), _ler_dia(fim)
+        inicio_meses = primeiro if primeiro.day == 1 else (primeiro.replace(day=28) + timedelta(days=4)).replace(day=1)
+        fim_meses = (ultimo + timedelta(days=1)).replace(day=1)     # exclusivo
+        if inicio_meses < fim_meses:
+            faixas = [('mes', inicio_meses, fim_meses - timedelta(days=1))]
+            if primeiro < inicio_meses:
+                faixas.append(('dia', primeiro, inicio_meses - timedelta(days=1)))
+            if fim_meses <= ultimo:
+                faixas.append(('dia', fim_meses, ultimo))
         else:
-            messagebox.showerror("Erro", "ICCID inválido ou já cadastrado!")
-
-    # -------------------------
-    # ABA CADASTRO EM LOTE
-    # -------------------------
-    def criar_aba_cadastro_lote(self):
-        frame = tk.Frame(self.notebook, bg=COR_FUNDO)
-        self.notebook.add(frame, text="📦 Cadastro em Lote")
-
-        card = CardFrame(frame)
-        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
-        inner = card.inner_frame
-
-        tk.Label(inner, text="Operadora da Remessa:", font=('Segoe UI', 12, 'bold'), bg=COR_CARD).pack(pady=10)
-        self.operadora_remessa = ttk.Combobox(inner, values=OPERADORAS, width=37, state='readonly')
-        self.operadora_remessa.pack(pady=5)
-
-        ModernButton(inner, "📁 Importar CSV/XLSX", self.importar_arquivo,
-                     width=180, height=45, bg_color=COR_ACCENT, hover_color='#0891b2').pack(pady=10)
-
-        self.chips_text = scrolledtext.ScrolledText(inner, width=80, height=15)
-        self.chips_text.pack(pady=10)
-
-        ModernButton(inner, "✓ Cadastrar Lote", self.cadastrar_lote,
-                     width=180, height=45, bg_color=COR_SUCESSO, hover_color='#059669').pack(pady=10)
-
-    def importar_arquivo(self):
-        arquivo = filedialog.askopenfilename(filetypes=[("CSV/XLSX", "*.csv *.xlsx")])
-        if not arquivo:
-            return
-        linhas = []
-        try:
-            if arquivo.endswith('.xlsx') and XLSX_AVAILABLE:
-                wb = openpyxl.load_workbook(arquivo)
-                ws = wb.active
-                for row in ws.iter_rows(values_only=True):
-                    if row and row[0]:
-                        iccid = ''.join(filter(str.isdigit, str(row[0])))
-                        operadora = str(row[1]).strip() if len(row) > 1 and row[1] else ''
-                        linhas.append(f"{iccid},{operadora}")
-            else:
-                with open(arquivo, 'r', encoding='utf-8') as f:
-                    reader = csv.reader(f, delimiter=';')
-                    for row in reader:
-                        if row and row[0]:
-                            iccid = ''.join(filter(str.isdigit, row[0]))
-                            operadora = row[1].strip() if len(row) > 1 else ''
-                            linhas.append(f"{iccid},{operadora}")
-            self.chips_text.insert('1.0', '\n'.join(linhas))
-            messagebox.showinfo("Sucesso", f"{len(linhas)} linhas importadas!")
-        except Exception as e:
-            messagebox.showerror("Erro", str(e))
-
-    def cadastrar_lote(self):
-        operadora = self.operadora_remessa.get().strip()
-        linhas = self.chips_text.get('1.0', tk.END).strip().split('\n')
-        chips = []
-        for linha in linhas:
-            partes = [p.strip() for p in linha.split(',')]
-            if partes and partes[0]:
-                iccid = ''.join(filter(str.isdigit, partes[0]))
-                op = partes[1] if len(partes) > 1 and partes[1] else operadora
-                if op in OPERADORAS:
-                    chips.append((iccid, op))
-        if not chips:
-            messagebox.showerror("Erro", "Nenhum chip válido encontrado!")
-            return
-        remessa_id, numero_remessa = self.db.criar_remessa(operadora, len(chips))
-        sucesso, falhas = self.db.adicionar_chips_lote(chips, remessa_id)
-        messagebox.showinfo("Resultado", f"Remessa {numero_remessa} criada!\n{sucesso} chips cadastrados.\nFalhas: {len(falhas)}")
-        self.chips_text.delete('1.0', tk.END)
-
-    # -------------------------
-    # ABA RETIRADA EM LOTE
-    # -------------------------
-    def criar_aba_retirada(self):
-        frame = tk.Frame(self.notebook, bg=COR_FUNDO)
-        self.notebook.add(frame, text="📤 Retirada de Chips")
-
-        card = CardFrame(frame)
-        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
-        inner = card.inner_frame
-
-        tk.Label(inner, text="Digite os ICCIDs (um por linha):", font=('Segoe UI', 12, 'bold'), bg=COR_CARD).pack(pady=10)
-        self.retirada_text = scrolledtext.ScrolledText(inner, width=60, height=10)
-        self.retirada_text.pack(pady=10)
-
-        tk.Label(inner, text="Retirado por:", font=('Segoe UI', 12, 'bold'), bg=COR_CARD).pack(pady=10)
-        self.retirado_por_entry = ttk.Entry(inner, width=40)
-        self.retirado_por_entry.pack(pady=5)
-
-        ModernButton(inner, "✓ Confirmar Retirada em Lote", self.retirar_chips_lote,
-                     width=250, height=50, bg_color=COR_ERRO, hover_color='#dc2626').pack(pady=20)
-
-    def retirar_chips_lote(self):
-        iccids = [linha.strip() for linha in self.retirada_text.get('1.0', tk.END).split('\n') if linha.strip()]
-        retirado_por = self.retirado_por_entry.get().strip()
-
-        if not iccids or not retirado_por:
-            messagebox.showerror("Erro", "Preencha todos os campos!")
-            return
-
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        sucesso, falhas = 0, []
-        for iccid in iccids:
-            iccid_limpo = ''.join(filter(str.isdigit, iccid))
-            cursor.execute('''
-                UPDATE chips SET status='Retirado', data_saida=?, retirado_por=?
-                WHERE iccid=? AND status='Disponível'
-            ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), retirado_por, iccid_limpo))
-            if cursor.rowcount > 0:
-                sucesso += 1
-            else:
-                falhas.append(iccid)
-        conn.commit()
-        conn.close()
-
-        mensagem = f"✓ {sucesso} chips retirados com sucesso!"
-        if falhas:
-            mensagem += f"\n⚠ {len(falhas)} não encontrados ou já retirados."
-        messagebox.showinfo("Resultado", mensagem)
-
-        self.retirada_text.delete('1.0', tk.END)
-        self.retirado_por_entry.delete(0, tk.END)
-
-    # -------------------------
-    # ABA CONSULTA DE CHIPS
-    # -------------------------
-    def criar_aba_consulta(self):
-        frame = tk.Frame(self.notebook, bg=COR_FUNDO)
-        self.notebook.add(frame, text="🔍 Consulta de Chips")
-        
-
-        card = CardFrame(frame)
-        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
-        inner = card.inner_frame
-
-        filtro_frame = tk.Frame(inner, bg=COR_CARD)
-        filtro_frame.pack(pady=10)
-
-        tk.Label(filtro_frame, text="Operadora:", bg=COR_CARD).pack(side=tk.LEFT, padx=5)
-        self.filtro_operadora = ttk.Combobox(filtro_frame, values=[''] + OPERADORAS, width=20)
-        self.filtro_operadora.pack(side=tk.LEFT, padx=5)
-
-        tk.Label(filtro_frame, text="Status:", bg=COR_CARD).pack(side=tk.LEFT, padx=5)
-        self.filtro_status = ttk.Combobox(filtro_frame, values=['', 'Disponível', 'Retirado'], width=18)
-        self.filtro_status.pack(side=tk.LEFT, padx=5)
-
-        ModernButton(filtro_frame, "🔍 Buscar", self.atualizar_consulta,
-                     width=120, height=35, bg_color=COR_PRIMARIA, hover_color=COR_SECUNDARIA).pack(side=tk.LEFT, padx=10)
-
-        self.tree = ttk.Treeview(inner, columns=('ICCID', 'Operadora', 'Status', 'Entrada', 'Saída', 'Retirado Por'),
-                                 show='headings', height=20)
-        for col in ('ICCID', 'Operadora', 'Status', 'Entrada', 'Saída', 'Retirado Por'):
-            self.tree.heading(col, text=col)
-            self.tree.column(col, width=180)
-        self.tree.pack(fill=tk.BOTH, expand=True, pady=10)
-
-    def atualizar_consulta(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        filtro_op = self.filtro_operadora.get() or None
-        filtro_st = self.filtro_status.get() or None
-        chips = self.db.listar_chips(filtro_op, filtro_st)
-        for iccid, operadora, status, entrada, saida, retirado_por in chips:
-            self.tree.insert('', tk.END, values=(iccid, operadora, status, entrada, saida or '', retirado_por or ''))
-
-    # -------------------------
-    # ABA REMESSAS COM EXCLUSÃO
-    # -------------------------
-    def criar_aba_remessas(self):
-        frame = tk.Frame(self.notebook, bg=COR_FUNDO)
-        self.notebook.add(frame, text="📋 Remessas")
-        card = CardFrame(frame)
-        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
-        inner = card.inner_frame
-
-        tk.Label(inner, text="📋 Histórico de Remessas", font=('Segoe UI', 16, 'bold'), bg=COR_CARD).pack(pady=10)
-
-        self.remessas_tree = ttk.Treeview(inner, columns=('ID', 'Número', 'Data', 'Operadora', 'Qtd', 'Obs'),
-                                          show='headings', height=20)
-        for col in ('ID', 'Número', 'Data', 'Operadora', 'Qtd', 'Obs'):
-            self.remessas_tree.heading(col, text=col)
-            self.remessas_tree.column(col, width=180)
-        self.remessas_tree.pack(fill=tk.BOTH, expand=True)
-
-        btn_frame = tk.Frame(inner, bg=COR_CARD)
-        btn_frame.pack(pady=10)
-
-        ModernButton(btn_frame, "🔄 Atualizar", self.atualizar_remessas,
-                     width=150, height=40, bg_color=COR_PRIMARIA, hover_color=COR_SECUNDARIA).pack(side=tk.LEFT, padx=5)
-
-        ModernButton(btn_frame, "🗑 Excluir Remessa", self.excluir_remessa,
-                     width=180, height=40, bg_color=COR_ERRO, hover_color='#dc2626').pack(side=tk.LEFT, padx=5)
-
-        self.atualizar_remessas()
-
-    def atualizar_remessas(self):
-        for item in self.remessas_tree.get_children():
-            self.remessas_tree.delete(item)
-        remessas = self.db.listar_remessas()
-        for r in remessas:
-            self.remessas_tree.insert('', tk.END, values=r)
-
-    def excluir_remessa(self):
-        selecionado = self.remessas_tree.selection()
-        if not selecionado:
-            messagebox.showwarning("Aviso", "Selecione uma remessa para excluir!")
-            return
-
-        item = selecionado[0]
-        valores = self.remessas_tree.item(item, 'values')
-        remessa_id, numero_remessa = valores[0], valores[1]
-
-        resposta = messagebox.askyesno("Confirmar Exclusão",
-                                       f"Deseja excluir a remessa {numero_remessa}?\n\n"
-                                       "Isso não pode ser desfeito.")
-        if not resposta:
-            return
-
-        excluir_chips = messagebox.askyesno("Excluir Chips",
-                                            "Deseja também excluir os chips vinculados a esta remessa?")
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
+            faixas = [('dia', primeiro, ultimo)]
+        totais = {}
+        for granularidade, de, ate in faixas:
+            query, params = montar_resumo_movimentos(granularidade, tipo, de.strftime('%Y-%m-%d'),
+                                                     ate.strftime('%Y-%m-%d'), agrupar_por, operadora, responsavel)
+            for linha in self.executar(query, params):
+                chave = linha[1] if agrupar_por else ''
+                totais[chave] = totais.get(chave, 0) + linha[-1]
+        return totais
+
+    @contextmanager
+    def _gatilhos_suspensos(self, cursor):
+        # Desliga os triggers de chips (contadores, índice de busca e livro de movimentos) dentro da transação
+        # corrente (invisível para outras conexões); quem chama aplica os totais em bloco com _somar_contadores,
+        # atualiza chips_busca e grava os movimentos com _registrar_movimentos
+        cursor.execute('UPDATE controle_contadores SET suspenso = 1')
+        yield
+        cursor.execute('UPDATE controle_contadores SET suspenso = 0')
+
+    def _somar_contadores(self, cursor, deltas, tabela='contadores'):
+        # deltas: {(dimensao, chave): [total, disponiveis, retirados]}
+        cursor.executemany(f'INSERT OR IGNORE INTO {tabela} (dimensao, chave) VALUES (?, ?)', list(deltas))
+        cursor.executemany(f'''
+            UPDATE {tabela} SET total = total + ?, disponiveis = disponiveis + ?, retirados = retirados + ?
+            WHERE dimensao = ? AND chave = ?
+        ''', [tuple(valores) + chave for chave, valores in deltas.items()])
+
+    def _deltas_lote(self, cursor, tabela, sinal, condicao=''):
+        # Contadores dos chips de temp.lote_ids em `tabela` (com `condicao` sobre o alias c)
+        deltas = {}
+        cursor.execute(SQL_RESUMO_LOTE_IDS.format(tabela=tabela, condicao=condicao))
+        for operadora, status, remessa_id, data_entrada, data_saida, quantidade in cursor.fetchall():
+            _acumular_chips(deltas, sinal, quantidade, operadora, status, remessa_id, data_entrada, data_saida)
+        return deltas
+
+    def _remover_lote(self, cursor, tabelas, movimento=None):
+        # Apaga de `tabelas` (chips, busca, contadores) os chips de temp.lote_ids, com os triggers suspensos;
+        # com `movimento`, cada chip apagado vai para o livro com esse tipo. Retorna quantos foram apagados
+        chips, busca, contadores = tabelas
+        deltas = self._deltas_lote(cursor, chips, -1)
+        with self._gatilhos_suspensos(cursor):
+            if movimento:
+                self._registrar_movimentos(cursor, SQL_MOVIMENTOS_EXCLUSAO_LOTE.format(tabela=chips),
+                                           (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), movimento))
+            cursor.execute(SQL_DESINDEXAR_LOTE.format(busca=busca, nome_busca=busca.split('.')[-1], tabela=chips))
+            cursor.execute(SQL_EXCLUIR_LOTE.format(tabela=chips))
+            removidos = cursor.rowcount
+            self._somar_contadores(cursor, deltas, contadores)
+        return removidos
+
+    @staticmethod
+    def _carregar_lote_ids(cursor, ids):
+        cursor.execute('DELETE FROM temp.lote_ids')
+        cursor.executemany('INSERT INTO temp.lote_ids (id) VALUES (?)', ((id_chip,) for id_chip in ids))
+
+    def arquivar_retirados(self, idade_dias=IDADE_ARQUIVAMENTO_DIAS, tamanho_lote=TAMANHO_LOTE_ARQUIVAMENTO,
+                           pausa=PAUSA_LOTE_ARQUIVAMENTO, progresso=None):
+        # Move para o arquivo os chips retirados há mais de `idade_dias`, em lotes de `tamanho_lote` com uma
+        # pausa entre eles. Cada lote usa duas transações curtas: a cópia (só o arquivo é gravado) e a remoção de
+        # chips, que descarta antes a cópia de quem mudou no intervalo. Como o SQLite não garante atomicidade
+        # entre bancos anexados em WAL, uma queda entre as duas deixa no máximo um lote copiado e ainda em chips,
+        # que a próxima execução completa. Retorna quantos chips foram arquivados
+        self._preparar_arquivo()
+        limite = (datetime.now() - timedelta(days=idade_dias)).strftime('%Y-%m-%d %H:%M:%S')
+        conn = self.get_connection()
+        conn.execute(SQL_CRIAR_LOTE_IDS)
+        arquivados = 0
         try:
-            if excluir_chips:
-                cursor.execute("DELETE FROM chips WHERE remessa_id=?", (remessa_id,))
-            cursor.execute("DELETE FROM remessas WHERE id=?", (remessa_id,))
-            conn.commit()
-            messagebox.showinfo("Sucesso", f"Remessa {numero_remessa} excluída com sucesso!")
-            self.atualizar_remessas()
-        except Exception as e:
-            messagebox.showerror("Erro", f"Erro ao excluir: {str(e)}")
+            while True:
+                with self.transacao(imediata=True) as cursor:
+                    cursor.execute('DELETE FROM temp.lote_ids')
+                    cursor.execute(SQL_CANDIDATOS_ARQUIVAMENTO, (limite, tamanho_lote))
+                    ids = [id_chip for id_chip, in cursor.execute('SELECT id FROM temp.lote_ids')]
+                    if not ids:
+                        break
+                    self._somar_contadores(cursor, self._deltas_lote(cursor, TABELAS_PRINCIPAL[0], 1, SQL_NAO_ARQUIVADOS),
+                                           TABELAS_ARQUIVO[2])
+                    cursor.execute(SQL_INDEXAR_ARQUIVO_LOTE)
+                    cursor.execute(SQL_COPIAR_PARA_ARQUIVO, (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+                with self.transacao(imediata=True) as cursor:
+                    self._carregar_lote_ids(cursor, ids)
+                    divergentes = [id_chip for id_chip, in cursor.execute(SQL_ARQUIVADOS_DIVERGENTES).fetchall()]
+                    if divergentes:
+                        self._carregar_lote_ids(cursor, divergentes)
+                        self._remover_lote(cursor, TABELAS_ARQUIVO)
+                        self._carregar_lote_ids(cursor, set(ids) - set(divergentes))
+                    arquivados += self._remover_lote(cursor, TABELAS_PRINCIPAL)
+                if progresso:
+                    progresso(arquivados)
+                if len(ids) < tamanho_lote:
+                    break
+                time.sleep(pausa)
         finally:
-            conn.close()
-
-    # -------------------------
-    # ABA ESTATÍSTICAS COM GRÁFICO
-    # -------------------------
-    def criar_aba_estatisticas(self):
-        frame = tk.Frame(self.notebook, bg=COR_FUNDO)
-        self.notebook.add(frame, text="📊 Estatísticas")
-        card = CardFrame(frame)
-        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
-        inner = card.inner_frame
-        tk.Label(inner, text="📊 Estatísticas do Sistema", font=('Segoe UI', 18, 'bold'), bg=COR_CARD).pack(pady=20)
-        self.stats_label = tk.Label(inner, text="", font=('Segoe UI', 14), bg=COR_CARD)
-        self.stats_label.pack(pady=10)
-        ModernButton(inner, "🔄 Atualizar Estatísticas", self.atualizar_estatisticas,
-                     width=220, height=45, bg_color=COR_PRIMARIA, hover_color=COR_SECUNDARIA).pack(pady=20)
-
-    def atualizar_estatisticas(self):
-        stats = self.db.estatisticas()
-        texto = (f"Total de Chips: {stats['total']}\n"
-                 f"Disponíveis: {stats['disponiveis']}\n"
-                 f"Retirados: {stats['retirados']}\n"
-                 f"Total de Remessas: {stats['total_remessas']}")
-        self.stats_label.config(text=texto)
-        if MATPLOTLIB_AVAILABLE:
-            fig, ax = plt.subplots(figsize=(4, 4), dpi=100)
-            valores = [stats['disponiveis'], stats['retirados']]
-            labels = ['Disponíveis', 'Retirados']
-            ax.pie(valores, labels=labels, autopct='%1.1f%%', colors=[COR_SUCESSO, COR_ERRO], startangle=90)
-            ax.set_title('Distribuição de Chips')
-            canvas = FigureCanvasTkAgg(fig, master=self.stats_label.master)
-            canvas.draw()
-            canvas.get_tk_widget().pack(pady=10)
+            conn.execute('DELETE FROM temp.lote_ids')
+        return arquivados
+
+    def _registrar_movimentos(self, cursor, sql, params):
+        # Grava no livro as linhas do INSERT ... SELECT `sql` e soma só essas linhas aos resumos
+        ultimo_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM movimentos').fetchone()[0]
+        cursor.execute(sql, params)
+        for granularidade in RESUMOS_MOVIMENTOS:
+            cursor.execute(_sql_resumir_movimentos(granularidade), (ultimo_id,))
+
+    def recalcular_contadores(self, corrigir=True):
+        # Recalcula os contadores a partir de chips/remessas (e os do arquivo, se anexado) e devolve as divergências
+        # encontradas como [(dimensao, chave, (total, disp, ret) esperado, (total, disp, ret) gravado)];
+        # as do arquivo vêm com a dimensão prefixada por "arquivo."
+        divergencias = []
+        conjuntos = [('', 'contadores', SQL_RECALCULAR_CONTADORES)]
+        if self._com_arquivo():
+            conjuntos.append(('arquivo.', TABELAS_ARQUIVO[2], SQL_RECALCULAR_CONTADORES_ARQUIVO))
+        with self.transacao(imediata=True) as cursor:
+            for prefixo, tabela, sql in conjuntos:
+                esperado = {(d, c): (t, di, r) for d, c, t, di, r in cursor.execute(sql)}
+                gravado = {(d, c): (t, di, r) for d, c, t, di, r in cursor.execute(
+                    f'SELECT dimensao, chave, total, disponiveis, retirados FROM {tabela}')}
+                erradas = [(prefixo + chave[0], chave[1], esperado.get(chave, (0, 0, 0)), gravado.get(chave, (0, 0, 0)))
+                           for chave in sorted(set(esperado) | set(gravado))
+                           if esperado.get(chave, (0, 0, 0)) != gravado.get(chave, (0, 0, 0))]
+                divergencias.extend(erradas)
+                if erradas and corrigir:
+                    cursor.execute(f'DELETE FROM {tabela}')
+                    cursor.execute(f'INSERT INTO {tabela} (dimensao, chave, total, disponiveis, retirados) ' + sql)
+        return divergencias
+
+    def recalcular_resumos_movimentos(self, corrigir=True):
+        # Confere movimentos_dia/movimentos_mes com o livro e devolve as divergências como
+        # [(tabela, 'tipo|período|responsável|operadora', esperado, gravado)]
+        divergencias = []
+        with self.transacao(imediata=True) as cursor:
+            for granularidade, (tabela, tamanho) in RESUMOS_MOVIMENTOS.items():
+                esperado = {tuple(linha[:4]): linha[4] for linha in cursor.execute(f'''
+                    SELECT tipo, substr(data, 1, {tamanho}), responsavel, operadora, COUNT(*)
+                    FROM movimentos GROUP BY 1, 2, 3, 4''')}
+                gravado = {tuple(linha[:4]): linha[4] for linha in cursor.execute(
+                    f'SELECT tipo, periodo, responsavel, operadora, quantidade FROM {tabela}')}
+                erradas = [chave for chave in sorted(set(esperado) | set(gravado))
+                           if esperado.get(chave, 0) != gravado.get(chave, 0)]
+                divergencias.extend((tabela, '|'.join(chave), esperado.get(chave, 0), gravado.get(chave, 0))
+                                    for chave in erradas)
+                if erradas and corrigir:
+                    cursor.execute(f'DELETE FROM {tabela}')
+                    cursor.execute(_sql_resumir_movimentos(granularidade), (0,))
+        return divergencias
 
+# ==========================
+# LINHA DE COMANDO
+# ==========================
+# Códigos de saída (2 é o do argparse para uso incorreto)
+SAIDA_OK = 0
+SAIDA_PARCIAL = 1   # concluiu, mas com recusas/divergências/problemas a relatar
+SAIDA_ERRO = 3
+
+def _emitir(args, colunas, itens, resumo):
+    # itens é percorrido uma única vez (pode ser um gerador) e escrito à medida que chega; resumo é um dict
+    # que pode ser preenchido durante a iteração e por isso só é escrito no fim (no CSV, vai para a stderr)
+    saida = sys.stdout if args.saida in (None, '-') else open(args.saida, 'w', encoding='utf-8', newline='')
+    try:
+        if args.formato == 'csv':
+            escritor = csv.writer(saida, delimiter=';', lineterminator='\n')
+            escritor.writerow(colunas)
+            escritor.writerows(itens)
+            print(json.dumps(resumo, ensure_ascii=False), file=sys.stderr)
+        else:
+            saida.write('{"itens": [')
+            for numero, item in enumerate(itens):
+                saida.write((',\n  ' if numero else '\n  ') + json.dumps(dict(zip(colunas, item)), ensure_ascii=False))
+            saida.write('\n], "resumo": ' + json.dumps(resumo, ensure_ascii=False) + '}\n')
+    finally:
+        if saida is not sys.stdout:
+            saida.close()
+
+def _contar(itens, resumo, chave=None):
+    # Repassa os itens somando em resumo[chave] (ou em resumo[primeira coluna do item], por categoria)
+    for item in itens:
+        categoria = chave or item[0]
+        resumo[categoria] = resumo.get(categoria, 0) + 1
+        yield item
+
+def _cmd_importar(db, args):
+    linhas = ler_linhas_arquivo(args.arquivo)
+    if args.validar:
+        total, validos, falhas = validar_linhas(linhas, args.operadora)
+        resumo = {'linhas': total, 'validos': validos, 'recusados': len(falhas)}
+    else:
+        remessa_id, numero_remessa, sucesso, falhas = db.cadastrar_remessa(linhas, args.operadora, args.observacoes,
+                                                                           args.tamanho_lote)
+        resumo = {'remessa_id': remessa_id, 'numero_remessa': numero_remessa,
+                  'cadastrados': sucesso, 'recusados': len(falhas)}
+    _emitir(args, ('iccid', 'motivo'), ((falha, falha.motivo) for falha in falhas), resumo)
+    return SAIDA_PARCIAL if falhas else SAIDA_OK
+
+def _cmd_retirar(db, args):
+    resultado = db.retirar_chips_lote((iccid for iccid, _ in ler_linhas_arquivo(args.arquivo)), args.por)
+    itens = chain(((iccid, 'retirado', args.por, '') for iccid in resultado['retirados']),
+                  ((iccid, 'ja_retirado', por, quando) for iccid, por, quando in resultado['ja_retirados']),
+                  ((iccid, 'desconhecido', '', '') for iccid in resultado['desconhecidos']))
+    resumo = {chave: len(valores) for chave, valores in resultado.items()}
+    _emitir(args, ('iccid', 'resultado', 'retirado_por', 'data_saida'), itens, resumo)
+    return SAIDA_PARCIAL if resultado['ja_retirados'] or resultado['desconhecidos'] else SAIDA_OK
+
+def _cmd_exportar(db, args):
+    formato = args.formato or (formato_exportacao(args.saida) if args.saida not in (None, '-') else 'csv')
+    if args.remessas:
+        colunas, linhas = CABECALHO_REMESSAS, db.iterar(SQL_LISTAR_REMESSAS)
+        chaves_json = ('id', 'numero_remessa', 'data_remessa', 'operadora', 'quantidade', 'observacoes')
+    else:
+        colunas, linhas = CABECALHO_CHIPS, db.iterar_chips(args.operadora, args.status, data_inicio=args.de,
+                                                            data_fim=args.ate, remessa_id=args.remessa,
+                                                            incluir_arquivo=args.incluir_arquivo)
+        chaves_json = ('iccid', 'operadora', 'status', 'data_entrada', 'data_saida', 'retirado_por')
+    if formato == 'json':
+        resumo = {}
+        _emitir(args, chaves_json, _contar(linhas, resumo, 'linhas'), resumo)
+        return SAIDA_OK
+    if args.saida in (None, '-'):
+        if formato == 'xlsx':
+            raise ValueError("A exportação em XLSX exige --saida ARQUIVO")
+        destino = sys.stdout.buffer if formato == 'csv.gz' else sys.stdout
+    else:
+        destino = args.saida
+    total = escrever_tabela(destino, colunas, linhas, formato)
+    print(json.dumps({'linhas': total}), file=sys.stderr)
+    return SAIDA_OK
+
+def _cmd_estatisticas(db, args):
+    itens = chain((('operadora',) + tuple(linha) for linha in db.estatisticas_por_operadora(args.incluir_arquivo)),
+                  (('remessa',) + tuple(linha) for linha in db.estatisticas_por_remessa()))
+    _emitir(args, ('dimensao', 'chave', 'total', 'disponiveis', 'retirados'), itens,
+            db.estatisticas(args.incluir_arquivo))
+    return SAIDA_OK
+
+def _cmd_conciliar(db, args):
+    resumo = {}
+    itens = _contar(db.conciliar(ler_linhas_arquivo(args.arquivo), args.operadora, args.tamanho_lote,
+                                 args.incluir_arquivo), resumo)
+    _emitir(args, ('categoria', 'iccid', 'detalhe'), itens, resumo)
+    return SAIDA_PARCIAL if resumo else SAIDA_OK
+
+def _cmd_buscar(db, args):
+    chips = db.buscar_iccid(args.trecho, args.modo, args.limite, args.incluir_arquivo)
+    _emitir(args, ('iccid', 'operadora', 'status', 'data_entrada', 'data_saida', 'retirado_por'), chips,
+            {'encontrados': len(chips)})
+    return SAIDA_OK if chips else SAIDA_PARCIAL
+
+def _cmd_verificar_planos(db, args):
+    problemas = verificar_planos_consulta(db)
+    _emitir(args, ('consulta', 'detalhe', 'sql'), ((nome, detalhe, ' '.join(sql.split())) for nome, sql, detalhe in problemas),
+            {'problemas': len(problemas)})
+    return SAIDA_PARCIAL if problemas else SAIDA_OK
+
+def _cmd_contadores(db, args):
+    divergencias = (db.recalcular_contadores(corrigir=args.recalcular)
+                    + db.recalcular_resumos_movimentos(corrigir=args.recalcular))
+    _emitir(args, ('dimensao', 'chave', 'esperado', 'gravado'), divergencias,
+            {'divergencias': len(divergencias), 'corrigido': args.recalcular})
+    return SAIDA_PARCIAL if divergencias and not args.recalcular else SAIDA_OK
+
+def _cmd_movimentos(db, args):
+    colunas = ('periodo',) + ((args.agrupar,) if args.agrupar else ()) + ('quantidade',)
+    if args.granularidade == 'total':
+        totais = db.totais_movimentos(args.tipo, args.de, args.ate, args.agrupar, args.operadora, args.responsavel)
+        periodo = f"{args.de}/{args.ate}"
+        itens = [(periodo,) + ((chave,) if args.agrupar else ()) + (quantidade,)
+                 for chave, quantidade in sorted(totais.items())]
+    else:
+        itens = db.resumo_movimentos(args.tipo, args.de, args.ate, args.granularidade, args.agrupar,
+                                     args.operadora, args.responsavel)
+    _emitir(args, colunas, itens, {'tipo': args.tipo, 'quantidade': sum(item[-1] for item in itens)})
+    return SAIDA_OK
+
+def _cmd_historico(db, args):
+    movimentos = db.historico_chip(args.iccid)
+    _emitir(args, ('data', 'tipo', 'operadora', 'remessa_id', 'responsavel'), movimentos,
+            {'movimentos': len(movimentos)})
+    return SAIDA_OK if movimentos else SAIDA_PARCIAL
+
+def _cmd_arquivar(db, args):
+    arquivados = db.arquivar_retirados(args.idade_dias, args.tamanho_lote, args.pausa,
+                                       lambda total: print(f"{total} arquivados", file=sys.stderr))
+    _emitir(args, ('arquivados',), (), {'arquivados': arquivados, 'arquivo': db.arquivo})
+    return SAIDA_OK
+
+def _cmd_servico(db, args):
+    from servico import ServicoMonitoramento, host_local
+    if args.permitir_rede and not host_local(args.host):
+        print(f"AVISO: o serviço não tem autenticação; qualquer máquina que alcance {args.host}:{args.porta} "
+              "pode cadastrar, retirar e excluir remessas", file=sys.stderr)
+    servico = ServicoMonitoramento(db, args.host, args.porta, args.leitores, args.max_grupo,
+                                   permitir_rede=args.permitir_rede)
+    print(f"atendendo em {servico.url} (Ctrl+C encerra)", file=sys.stderr)
+    try:
+        servico.servir()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servico.encerrar()
+    print(json.dumps(servico.situacao(), ensure_ascii=False), file=sys.stderr)
+    return SAIDA_OK
+
+def criar_parser():
+    comum = argparse.ArgumentParser(add_help=False)
+    comum.add_argument('--formato', choices=('json', 'csv'), default='json')
+    comum.add_argument('--saida', help="arquivo de saída (padrão: saída padrão)")
+    parser = argparse.ArgumentParser(
+        description="Monitoramento de chips. Sem subcomando, abre a interface gráfica.")
+    parser.add_argument('--banco', default='chips.db', help="arquivo SQLite (padrão: chips.db)")
+    parser.add_argument('--banco-arquivo', help="banco dos chips arquivados (padrão: <banco>_arquivo.db)")
+    parser.add_argument('--journal', choices=MODOS_JOURNAL,
+                        help="modo de journal (padrão: wal em disco local, truncate em pasta de rede)")
+    parser.add_argument('--metricas', metavar='ARQUIVO',
+                        help="mede instruções e métodos e grava as métricas ao sair (.prom: Prometheus, senão JSON)")
+    parser.add_argument('--log-lentas', metavar='ARQUIVO', help="log rotativo das instruções lentas")
+    parser.add_argument('--limite-lenta-ms', type=float, help="a partir de quantos ms uma instrução é lenta")
+    comandos = parser.add_subparsers(dest='nome_comando', required=True)
+
+    cmd = comandos.add_parser('importar', aliases=['import'], parents=[comum],
+                              help="cadastra uma remessa a partir de CSV (;) ou XLSX; '-' lê da entrada padrão")
+    cmd.add_argument('arquivo')
+    cmd.add_argument('--operadora', choices=OPERADORAS, default='',
+                     help="operadora da remessa, usada nas linhas sem operadora")
+    cmd.add_argument('--observacoes', default='')
+    cmd.add_argument('--tamanho-lote', type=int, default=TAMANHO_LOTE_PADRAO)
+    cmd.add_argument('--validar', action='store_true', help="só valida o arquivo, sem gravar nada")
+    cmd.set_defaults(comando=_cmd_importar)
+
+    cmd = comandos.add_parser('retirar', aliases=['retire'], parents=[comum],
+                              help="retira os ICCIDs da coluna A do arquivo; '-' lê da entrada padrão")
+    cmd.add_argument('arquivo')
+    cmd.add_argument('--por', required=True, help="responsável pela retirada")
+    cmd.set_defaults(comando=_cmd_retirar)
+
+    cmd = comandos.add_parser('exportar', aliases=['export'],
+                              help="exporta os chips (ou as remessas) em CSV, CSV compactado, XLSX ou JSON")
+    cmd.add_argument('--formato', choices=FORMATOS_EXPORTACAO + ('json',),
+                     help="padrão: pela extensão de --saida, ou csv")
+    cmd.add_argument('--saida', help="arquivo de saída (padrão: saída padrão)")
+    cmd.add_argument('--operadora', choices=OPERADORAS)
+    cmd.add_argument('--status', choices=('Disponível', 'Retirado'))
+    cmd.add_argument('--de', help="data de entrada inicial, AAAA-MM-DD")
+    cmd.add_argument('--ate', help="data de entrada final (inclusive), AAAA-MM-DD")
+    cmd.add_argument('--remessa', type=int, help="id da remessa")
+    cmd.add_argument('--remessas', action='store_true', help="exporta a lista de remessas em vez dos chips")
+    cmd.add_argument('--incluir-arquivo', action='store_true', help="inclui os chips arquivados")
+    cmd.set_defaults(comando=_cmd_exportar)
+
+    cmd = comandos.add_parser('estatisticas', aliases=['stats'], parents=[comum],
+                              help="totais gerais, por operadora e por remessa")
+    cmd.add_argument('--incluir-arquivo', action='store_true',
+                     help="soma os arquivados aos totais gerais e por operadora")
+    cmd.set_defaults(comando=_cmd_estatisticas)
+
+    cmd = comandos.add_parser('conciliar', aliases=['reconcile'], parents=[comum],
+                              help="compara um inventário (CSV/XLSX, ICCID;operadora) com o banco")
+    cmd.add_argument('arquivo')
+    cmd.add_argument('--operadora', choices=OPERADORAS,
+                     help="restringe a lista de chips do banco ausentes no arquivo a uma operadora")
+    cmd.add_argument('--tamanho-lote', type=int, default=TAMANHO_LOTE_PADRAO)
+    cmd.add_argument('--incluir-arquivo', action='store_true', help="considera também os chips arquivados")
+    cmd.set_defaults(comando=_cmd_conciliar)
+
+    cmd = comandos.add_parser('buscar', aliases=['search'], parents=[comum],
+                              help="busca chips pelo início, final ou um trecho do ICCID")
+    cmd.add_argument('trecho')
+    cmd.add_argument('--modo', choices=(BUSCA_FINAL, BUSCA_INICIO, BUSCA_CONTEM), default=BUSCA_FINAL)
+    cmd.add_argument('--limite', type=int, default=LIMITE_BUSCA_ICCID)
+    cmd.add_argument('--incluir-arquivo', action='store_true', help="procura também nos chips arquivados")
+    cmd.set_defaults(comando=_cmd_buscar)
+
+    cmd = comandos.add_parser('movimentos', aliases=['movements'], parents=[comum],
+                              help="entradas, retiradas etc. por dia, mês ou no período, lidas dos resumos")
+    cmd.add_argument('--de', required=True, help="AAAA-MM-DD")
+    cmd.add_argument('--ate', required=True, help="AAAA-MM-DD (inclusive)")
+    cmd.add_argument('--tipo', choices=TIPOS_MOVIMENTO, default=MOVIMENTO_RETIRADA)
+    cmd.add_argument('--granularidade', choices=tuple(RESUMOS_MOVIMENTOS) + ('total',), default='dia')
+    cmd.add_argument('--agrupar', choices=AGRUPAMENTOS_MOVIMENTOS, help="quebra por responsável ou operadora")
+    cmd.add_argument('--operadora', choices=OPERADORAS)
+    cmd.add_argument('--responsavel')
+    cmd.set_defaults(comando=_cmd_movimentos)
+
+    cmd = comandos.add_parser('historico', aliases=['history'], parents=[comum],
+                              help="todos os movimentos registrados de um ICCID")
+    cmd.add_argument('iccid')
+    cmd.set_defaults(comando=_cmd_historico)
+
+    cmd = comandos.add_parser('verificar-planos', parents=[comum],
+                              help="procura consultas que fazem varredura completa de tabela")
+    cmd.set_defaults(comando=_cmd_verificar_planos)
+
+    cmd = comandos.add_parser('contadores', parents=[comum], help="confere os contadores e os resumos de movimentos")
+    cmd.add_argument('--recalcular', action='store_true', help="grava os valores recalculados")
+    cmd.set_defaults(comando=_cmd_contadores)
+
+    cmd = comandos.add_parser('arquivar', aliases=['archive'], parents=[comum],
+                              help="move os chips retirados há muito tempo para o banco de arquivo")
+    cmd.add_argument('--idade-dias', type=int, default=IDADE_ARQUIVAMENTO_DIAS,
+                     help="arquiva os retirados há mais de N dias")
+    cmd.add_argument('--tamanho-lote', type=int, default=TAMANHO_LOTE_ARQUIVAMENTO)
+    cmd.add_argument('--pausa', type=float, default=PAUSA_LOTE_ARQUIVAMENTO, help="segundos entre lotes")
+    cmd.set_defaults(comando=_cmd_arquivar)
+
+    cmd = comandos.add_parser('servico', aliases=['serve'],
+                              help="atende as estações por HTTP/JSON (interface com MONITORAMENTO_SERVICO=host:porta)")
+    cmd.add_argument('--host', default='127.0.0.1', help="endereço local (outros só com --permitir-rede)")
+    cmd.add_argument('--permitir-rede', action='store_true',
+                     help="aceita um --host fora da máquina local; o serviço não tem autenticação")
+    cmd.add_argument('--porta', type=int, default=8765)
+    cmd.add_argument('--leitores', type=int, default=4, help="threads de leitura, cada uma com sua conexão")
+    cmd.add_argument('--max-grupo', type=int, default=64, help="gravações por COMMIT")
+    cmd.set_defaults(comando=_cmd_servico)
+    return parser
 
 # ==========================
 # MAIN
 # ==========================
-def main():
-    root = tk.Tk()
-    app = MonitoramentoApp(root)
-    root.mainloop()
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        from monitoramento_gui import executar_interface
+        executar_interface()
+        return
+    args = criar_parser().parse_args(argv)
+    db = instrumentacao = None
+    if args.metricas or args.log_lentas:
+        from instrumentacao import LIMITE_LENTA_MS, Instrumentacao
+        instrumentacao = Instrumentacao(limite_lenta_ms=args.limite_lenta_ms or LIMITE_LENTA_MS,
+                                        log_lentas=args.log_lentas)
+    try:
+        db = Database(args.banco, instrumentacao=instrumentacao, arquivo=args.banco_arquivo, journal=args.journal)
+        codigo = args.comando(db, args)
+    except BrokenPipeError:
+        # Quem lia a saída fechou o pipe (ex.: "| head"); não é erro do programa
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        codigo = SAIDA_OK
+    except (OSError, ValueError, RuntimeError, sqlite3.Error) as e:
+        print(f"erro: {e}", file=sys.stderr)
+        codigo = SAIDA_ERRO
+    finally:
+        if db:
+            db.fechar()
+        if instrumentacao:
+            if args.metricas:
+                instrumentacao.gravar(args.metricas)
+            instrumentacao.fechar()
+    sys.exit(codigo)
 
 
 if __name__ == "__main__":
+    # monitoramento_gui importa "monitoramento"; sem isto o script seria carregado duas vezes
+    sys.modules.setdefault('monitoramento', sys.modules[__name__])
     main()
@@ -0,0 +1,989 @@
+import importlib.util
+import os
+import queue
+import threading
+import tkinter as tk
+from tkinter import ttk, messagebox, scrolledtext, filedialog
+from itertools import islice
+
+from iccid import resumir_falhas, validar_iccid, validar_iccids
+from monitoramento import (BUSCA_CONTEM, BUSCA_FINAL, BUSCA_INICIO, Database, LIMITE_BUSCA_ICCID, LINHAS_PREVIA,
+                           OPERADORAS, XLSX_AVAILABLE, contar_linhas_arquivo, formato_exportacao, ler_linhas_arquivo,
+                           ler_linhas_texto, validar_linhas)
+
+# Interface gráfica (tkinter). Aberta por "python monitoramento.py" sem subcomando.
+
+# matplotlib é opcional e só é importado quando a aba Estatísticas é aberta
+# (sozinho, acrescenta segundos à abertura do programa)
+MATPLOTLIB_AVAILABLE = importlib.util.find_spec('matplotlib') is not None
+
+def carregar_matplotlib():
+    # Figure direto (sem pyplot): a figura pertence ao widget e não fica registrada num gerenciador global
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    return Figure, FigureCanvasTkAgg
+
+# Paleta de cores modernas
+COR_PRIMARIA = '#6366f1'
+COR_SECUNDARIA = '#8b5cf6'
+COR_ACCENT = '#06b6d4'
+COR_SUCESSO = '#10b981'
+COR_ERRO = '#ef4444'
+COR_FUNDO = '#f8fafc'
+COR_CARD = '#ffffff'
+COR_TEXTO = '#1e293b'
+COR_TEXTO_SECUNDARIO = '#64748b'
+
+# Quantas linhas de detalhe mostrar nas mensagens de resultado
+MAX_DETALHES_RESULTADO = 10
+
+# Intervalo com que a interface recolhe progresso/resultados das tarefas em segundo plano
+INTERVALO_EVENTOS_MS = 100
+
+# Páginas mantidas ao mesmo tempo na Treeview da consulta
+MAX_PAGINAS_CONSULTA = 4
+
+# Busca por parte do ICCID enquanto se digita: espera esta pausa na digitação antes de consultar
+INTERVALO_BUSCA_MS = 250
+MODOS_BUSCA = {'Final': BUSCA_FINAL, 'Início': BUSCA_INICIO, 'Contém': BUSCA_CONTEM}
+
+# Aba de diagnóstico (oculta, Ctrl+Shift+D): métricas da instrumentação do banco. Só existe com
+# MONITORAMENTO_METRICAS=1 no ambiente; sem isso o Database usa conexões comuns, sem custo de medição
+ATALHO_DIAGNOSTICO = '<Control-Shift-D>'
+ARQUIVO_LOG_LENTAS = 'consultas_lentas.log'
+LINHAS_DIAGNOSTICO = 30
+
+# Botão moderno
+class ModernButton(tk.Canvas):
+    def __init__(self, parent, text, command, width=150, height=40,
+    
+                 bg_color=COR_PRIMARIA, hover_color=COR_SECUNDARIA,
+                 text_color='white', font=('Segoe UI', 10, 'bold')):
+        super().__init__(parent, width=width, height=height,
+                         highlightthickness=0, relief=tk.FLAT, bg=parent.cget('bg'))
+        self.command = command
+        self.bg_color = bg_color
+        self.hover_color = hover_color
+        self.text_color = text_color
+        self.font = font
+        self.text = text
+        self.button_id = self.create_rectangle(2, 2, width-2, height-2,
+                                               fill=bg_color, outline='', width=0)
+        self.text_id = self.create_text(width//2, height//2, text=text,
+                                        fill=text_color, font=font)
+        self.bind('<Enter>', self.on_enter)
+        self.bind('<Leave>', self.on_leave)
+        self.tag_bind(self.button_id, '<Button-1>', lambda e: self.command())
+        self.tag_bind(self.text_id, '<Button-1>', lambda e: self.command())
+
+    def on_enter(self, event):
+        self.itemconfig(self.button_id, fill=self.hover_color)
+        self.configure(cursor='hand2')
+
+    def on_leave(self, event):
+        self.itemconfig(self.button_id, fill=self.bg_color)
+        self.configure(cursor='')
+
+class CardFrame(tk.Frame):
+    def __init__(self, parent, **kwargs):
+        bg = kwargs.pop('bg', COR_CARD)
+        super().__init__(parent, bg=bg, **kwargs)
+        self.config(relief=tk.FLAT, bd=0)
+        self.inner_frame = tk.Frame(self, bg=bg, relief=tk.FLAT)
+        self.inner_frame.pack(fill=tk.BOTH, expand=True, padx=2, pady=2)
+
+class GraficoEstatisticas(tk.Frame):
+    # Uma única figura com três gráficos, redesenhada no lugar e só quando os dados mudam
+    def __init__(self, parent, **kwargs):
+        bg = kwargs.pop('bg', COR_CARD)
+        super().__init__(parent, bg=bg, **kwargs)
+        Figure, FigureCanvasTkAgg = carregar_matplotlib()
+        self.figura = Figure(figsize=(10, 4), dpi=100, facecolor=bg)
+        self.ax_status = self.figura.add_subplot(1, 3, 1)
+        self.ax_operadoras = self.figura.add_subplot(1, 3, 2)
+        self.ax_diario = self.figura.add_subplot(1, 3, 3)
+        self.canvas = FigureCanvasTkAgg(self.figura, master=self)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self._assinatura = None
+
+    def atualizar(self, stats, por_operadora, serie_diaria):
+        assinatura = (stats['disponiveis'], stats['retirados'], tuple(por_operadora), tuple(serie_diaria))
+        if assinatura == self._assinatura:
+            return False
+        self._assinatura = assinatura
+
+        ax = self.ax_status
+        ax.clear()
+        if stats['total']:
+            ax.pie([stats['disponiveis'], stats['retirados']], labels=['Disponíveis', 'Retirados'],
+                   autopct='%1.1f%%', colors=[COR_SUCESSO, COR_ERRO], startangle=90)
+        ax.set_title('Distribuição de Chips')
+
+        ax = self.ax_operadoras
+        ax.clear()
+        nomes = [linha[0] for linha in por_operadora]
+        disponiveis = [linha[2] for linha in por_operadora]
+        retirados = [linha[3] for linha in por_operadora]
+        ax.bar(nomes, disponiveis, color=COR_SUCESSO, label='Disponíveis')
+        ax.bar(nomes, retirados, bottom=disponiveis, color=COR_ERRO, label='Retirados')
+        ax.tick_params(axis='x', labelrotation=45, labelsize=8)
+        ax.set_title('Por Operadora')
+        if nomes:
+            ax.legend(fontsize=8)
+
+        ax = self.ax_diario
+        ax.clear()
+        dias = [dia[5:] for dia, _, _ in serie_diaria]
+        ax.plot(dias, [entradas for _, entradas, _ in serie_diaria], color=COR_PRIMARIA, marker='o', label='Entradas')
+        ax.plot(dias, [saidas for _, _, saidas in serie_diaria], color=COR_ERRO, marker='o', label='Retiradas')
+        ax.tick_params(axis='x', labelrotation=45, labelsize=8)
+        ax.set_title('Entradas x Retiradas (30 dias)')
+        if dias:
+            ax.legend(fontsize=8)
+
+        self.figura.tight_layout()
+        self.canvas.draw_idle()
+        return True
+
+# Execução de tarefas em segundo plano
+class TarefaCancelada(Exception):
+    pass
+
+class Tarefa:
+    # funcao(tarefa) roda na thread de trabalho; os callbacks rodam na thread da interface
+    def __init__(self, descricao, funcao, ao_concluir=None, ao_falhar=None, total=None, ao_finalizar=None):
+        self.descricao = descricao
+        self.funcao = funcao
+        self.ao_concluir = ao_concluir
+        self.ao_falhar = ao_falhar
+        self.ao_finalizar = ao_finalizar
+        self.total = total
+        self._cancelada = threading.Event()
+        self._eventos = None
+
+    def cancelar(self):
+        self._cancelada.set()
+
+    @property
+    def cancelada(self):
+        return self._cancelada.is_set()
+
+    def verificar_cancelamento(self):
+        # Levantar dentro de db.transacao() desfaz o que a tarefa já gravou
+        if self._cancelada.is_set():
+            raise TarefaCancelada()
+
+    def informar_progresso(self, atual):
+        self.verificar_cancelamento()
+        self._eventos.put(('progresso', self, atual))
+
+class ExecutorTarefas:
+    # Uma única thread de trabalho consome as tarefas em ordem (as gravações no SQLite já são serializadas);
+    # progresso e resultados voltam por uma fila que a interface esvazia com root.after
+    def __init__(self):
+        self._tarefas = queue.Queue()
+        self._eventos = queue.Queue()
+        self.tarefa_atual = None
+        self._thread = threading.Thread(target=self._trabalhar, name='executor-tarefas', daemon=True)
+        self._thread.start()
+
+    def enviar(self, tarefa):
+        tarefa._eventos = self._eventos
+        self._tarefas.put(tarefa)
+        return tarefa
+
+    def _trabalhar(self):
+        while True:
+            tarefa = self._tarefas.get()
+            if tarefa is None:
+                return
+            self.tarefa_atual = tarefa
+            self._eventos.put(('inicio', tarefa, None))
+            try:
+                tarefa.verificar_cancelamento()
+                resultado = tarefa.funcao(tarefa)
+            except TarefaCancelada:
+                self._eventos.put(('cancelada', tarefa, None))
+            except Exception as e:
+                self._eventos.put(('erro', tarefa, e))
+            else:
+                self._eventos.put(('concluida', tarefa, resultado))
+            finally:
+                self.tarefa_atual = None
+
+    def processar_eventos(self, ao_evento=None):
+        # Deve ser chamado na thread da interface; ao_evento(tipo, tarefa, dado) vê todos os eventos
+        while True:
+            try:
+                tipo, tarefa, dado = self._eventos.get_nowait()
+            except queue.Empty:
+                return
+            if ao_evento:
+                ao_evento(tipo, tarefa, dado)
+            if tipo == 'concluida' and tarefa.ao_concluir:
+                tarefa.ao_concluir(dado)
+            elif tipo == 'erro' and tarefa.ao_falhar:
+                tarefa.ao_falhar(dado)
+            if tipo in ('concluida', 'erro', 'cancelada') and tarefa.ao_finalizar:
+                tarefa.ao_finalizar()
+
+    def encerrar(self, timeout=5):
+        tarefa = self.tarefa_atual
+        if tarefa:
+            tarefa.cancelar()
+        self._tarefas.put(None)
+        self._thread.join(timeout)
+
+class MonitoramentoApp:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("📱 Sistema de Monitoramento de Chips")
+        self.root.geometry("1300x750")
+        self.root.configure(bg=COR_FUNDO)
+        self.instrumentacao = None
+        if os.environ.get('MONITORAMENTO_METRICAS'):
+            from instrumentacao import Instrumentacao
+            self.instrumentacao = Instrumentacao(log_lentas=ARQUIVO_LOG_LENTAS)
+        servico = os.environ.get('MONITORAMENTO_SERVICO')
+        if servico:
+            # Estação cliente de "python monitoramento.py servico": nada de abrir o chips.db daqui
+            from servico import ClienteServico
+            self.db = ClienteServico(servico, instrumentacao=self.instrumentacao)
+            self.root.title(f"📱 Sistema de Monitoramento de Chips — {servico}")
+        else:
+            self.db = Database(instrumentacao=self.instrumentacao, journal=os.environ.get('MONITORAMENTO_JOURNAL'))
+        self.executor = ExecutorTarefas()
+        self._agendamentos = {}
+        self.setup_styles()
+        self.create_header()
+        self.criar_barra_status()
+        self.notebook = ttk.Notebook(self.root)
+        self.notebook.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
+        # As abas são construídas só quando selecionadas pela primeira vez
+        self._abas_pendentes = {}
+        self.notebook.bind('<<NotebookTabChanged>>', self._construir_aba_selecionada)
+        self._registrar_aba("➕ Cadastro Individual", self.criar_aba_cadastro_individual)
+        self._registrar_aba("📦 Cadastro em Lote", self.criar_aba_cadastro_lote)
+        self._registrar_aba("📤 Retirada de Chips", self.criar_aba_retirada)
+        self._registrar_aba("🔍 Consulta de Chips", self.criar_aba_consulta)
+        self._registrar_aba("📋 Remessas", self.criar_aba_remessas)
+        self._registrar_aba("📊 Estatísticas", self.criar_aba_estatisticas)
+        self._construir_aba_selecionada()
+        self.aba_diagnostico = None
+        self.root.bind_all(ATALHO_DIAGNOSTICO, self.abrir_aba_diagnostico)
+        self.root.after(INTERVALO_EVENTOS_MS, self._processar_tarefas)
+
+    def _registrar_aba(self, titulo, construir):
+        frame = tk.Frame(self.notebook, bg=COR_FUNDO)
+        self.notebook.add(frame, text=titulo)
+        self._abas_pendentes[str(frame)] = (frame, construir)
+
+    def _construir_aba_selecionada(self, event=None):
+        pendente = self._abas_pendentes.pop(self.notebook.select(), None)
+        if pendente:
+            frame, construir = pendente
+            construir(frame)
+
+    def setup_styles(self):
+        style = ttk.Style()
+        style.theme_use('clam')
+        style.configure('TNotebook.Tab', padding=[20, 10], font=('Segoe UI', 10, 'bold'))
+        style.map('TNotebook.Tab', background=[('selected', COR_PRIMARIA)], foreground=[('selected', 'white')])
+
+    def create_header(self):
+        header = tk.Frame(self.root, bg=COR_PRIMARIA, height=70)
+        header.pack(fill=tk.X)
+        header.pack_propagate(False)
+        tk.Label(header, text="📱 Monitoramento de Chips", font=('Segoe UI', 20, 'bold'),
+                 bg=COR_PRIMARIA, fg='white').pack(side=tk.LEFT, padx=30)
+
+    # -------------------------
+    # TAREFAS EM SEGUNDO PLANO
+    # -------------------------
+    def criar_barra_status(self):
+        barra = tk.Frame(self.root, bg=COR_CARD)
+        barra.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_label = tk.Label(barra, text="Pronto", font=('Segoe UI', 10), bg=COR_CARD, fg=COR_TEXTO_SECUNDARIO)
+        self.status_label.pack(side=tk.LEFT, padx=20, pady=5)
+        self.cancelar_btn = ttk.Button(barra, text="Cancelar", command=self.cancelar_tarefa, state=tk.DISABLED)
+        self.cancelar_btn.pack(side=tk.RIGHT, padx=20, pady=5)
+        self.status_progresso = ttk.Progressbar(barra, length=300, mode='determinate')
+        self.status_progresso.pack(side=tk.RIGHT, pady=5)
+
+    def executar_em_segundo_plano(self, descricao, funcao, ao_concluir=None, total=None, ao_finalizar=None):
+        # Toda operação de banco da interface passa por aqui para nunca bloquear o mainloop
+        def ao_falhar(erro):
+            messagebox.showerror("Erro", f"{descricao}: {erro}")
+        return self.executor.enviar(Tarefa(descricao, funcao, ao_concluir, ao_falhar, total, ao_finalizar))
+
+    def _agendar(self, nome, funcao, atraso=INTERVALO_BUSCA_MS):
+        # Debounce: cada chamada reinicia a espera; funcao só roda depois de `atraso` ms sem novas chamadas
+        pendente = self._agendamentos.pop(nome, None)
+        if pendente:
+            self.root.after_cancel(pendente)
+
+        def executar():
+            del self._agendamentos[nome]
+            funcao()
+
+        self._agendamentos[nome] = self.root.after(atraso, executar)
+
+    def cancelar_tarefa(self):
+        tarefa = self.executor.tarefa_atual
+        if tarefa:
+            tarefa.cancelar()
+            self.status_label.config(text=f"Cancelando: {tarefa.descricao}...")
+
+    def _processar_tarefas(self):
+        self.executor.processar_eventos(self._evento_tarefa)
+        self.root.after(INTERVALO_EVENTOS_MS, self._processar_tarefas)
+
+    def _evento_tarefa(self, tipo, tarefa, dado):
+        if tipo == 'inicio':
+            self.status_label.config(text=f"{tarefa.descricao}...")
+            self.cancelar_btn.config(state=tk.NORMAL)
+            if tarefa.total:
+                self.status_progresso.config(mode='determinate', maximum=tarefa.total, value=0)
+            else:
+                self.status_progresso.config(mode='indeterminate')
+                self.status_progresso.start(15)
+        elif tipo == 'progresso':
+            if tarefa.total:
+                self.status_progresso.config(value=min(dado, tarefa.total))
+            self.status_label.config(text=f"{tarefa.descricao}... {dado} linhas")
+        else:
+            self.status_progresso.stop()
+            self.status_progresso.config(mode='determinate', value=0)
+            self.cancelar_btn.config(state=tk.DISABLED)
+            textos = {'concluida': "Concluído", 'cancelada': "Cancelado", 'erro': "Falhou"}
+            self.status_label.config(text=f"{tarefa.descricao}: {textos[tipo]}")
+
+    # -------------------------
+    # ABA CADASTRO INDIVIDUAL
+    # -------------------------
+    def criar_aba_cadastro_individual(self, frame):
+        card = CardFrame(frame)
+        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
+        inner = card.inner_frame
+
+        tk.Label(inner, text="ICCID:", font=('Segoe UI', 12, 'bold'), bg=COR_CARD).pack(pady=10)
+        self.iccid_entry = ttk.Entry(inner, width=40)
+        self.iccid_entry.pack(pady=5)
+
+        tk.Label(inner, text="Operadora:", font=('Segoe UI', 12, 'bold'), bg=COR_CARD).pack(pady=10)
+        self.operadora_combo = ttk.Combobox(inner, values=OPERADORAS, width=37, state='readonly')
+        self.operadora_combo.pack(pady=5)
+
+        ModernButton(inner, "✓ Cadastrar Chip", self.cadastrar_chip_individual,
+                     width=180, height=45, bg_color=COR_SUCESSO, hover_color='#059669').pack(pady=20)
+
+    def cadastrar_chip_individual(self):
+        iccid = self.iccid_entry.get().strip()
+        operadora = self.operadora_combo.get().strip()
+        if not iccid or not operadora:
+            messagebox.showerror("Erro", "Preencha todos os campos!")
+            return
+        normalizado, motivo = validar_iccid(iccid)
+        if motivo:
+            messagebox.showerror("Erro", f"{motivo}: {normalizado or iccid}")
+            return
+
+        def concluir(cadastrado):
+            if cadastrado:
+                messagebox.showinfo("Sucesso", f"Chip {normalizado} cadastrado!")
+                self.iccid_entry.delete(0, tk.END)
+                self.operadora_combo.set('')
+            else:
+                messagebox.showerror("Erro", "ICCID já cadastrado!")
+
+        self.executar_em_segundo_plano("Cadastrando chip", lambda tarefa: self.db.adicionar_chip(iccid, operadora),
+                                       concluir)
+
+    # -------------------------
+    # ABA CADASTRO EM LOTE
+    # -------------------------
+    def criar_aba_cadastro_lote(self, frame):
+        card = CardFrame(frame)
+        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
+        inner = card.inner_frame
+
+        tk.Label(inner, text="Operadora da Remessa:", font=('Segoe UI', 12, 'bold'), bg=COR_CARD).pack(pady=10)
+        self.operadora_remessa = ttk.Combobox(inner, values=OPERADORAS, width=37, state='readonly')
+        self.operadora_remessa.pack(pady=5)
+
+        ModernButton(inner, "📁 Importar CSV/XLSX", self.importar_arquivo,
+                     width=180, height=45, bg_color=COR_ACCENT, hover_color='#0891b2').pack(pady=10)
+
+        self.arquivo_importado = None
+        self.total_importado = None
+        self.arquivo_label = tk.Label(inner, text="", font=('Segoe UI', 10), bg=COR_CARD, fg=COR_TEXTO_SECUNDARIO)
+        self.arquivo_label.pack()
+
+        self.chips_text = scrolledtext.ScrolledText(inner, width=80, height=15)
+        self.chips_text.pack(pady=10)
+
+        ModernButton(inner, "✓ Cadastrar Lote", self.cadastrar_lote,
+                     width=180, height=45, bg_color=COR_SUCESSO, hover_color='#059669').pack(pady=10)
+
+    def importar_arquivo(self):
+        # O arquivo não passa pelo widget de texto: só uma prévia é exibida e o cadastro lê direto do disco
+        arquivo = filedialog.askopenfilename(filetypes=[("CSV/XLSX", "*.csv *.xlsx")])
+        if not arquivo:
+            return
+        try:
+            linhas = list(islice(ler_linhas_arquivo(arquivo), LINHAS_PREVIA))
+            iccids, motivos = validar_iccids([iccid for iccid, _ in linhas])
+            previa = [f"{iccid},{operadora}" + (f"   ⚠ {motivos[indice]}" if indice in motivos else '')
+                      for indice, (iccid, (_, operadora)) in enumerate(zip(iccids, linhas))]
+            total = contar_linhas_arquivo(arquivo)
+        except Exception as e:
+            messagebox.showerror("Erro", str(e))
+            return
+        self.arquivo_importado = arquivo
+        self.total_importado = total
+        self.chips_text.config(state=tk.NORMAL)
+        self.chips_text.delete('1.0', tk.END)
+        self.chips_text.insert('1.0', '\n'.join(previa))
+        self.chips_text.config(state=tk.DISABLED)
+        self.arquivo_label.config(text=f"Prévia das primeiras {len(previa)} linhas de "
+                                       f"{os.path.basename(arquivo)} (~{total or '?'} linhas no arquivo)")
+
+    def limpar_importacao(self):
+        self.arquivo_importado = None
+        self.total_importado = None
+        self.arquivo_label.config(text="")
+        self.chips_text.config(state=tk.NORMAL)
+        self.chips_text.delete('1.0', tk.END)
+
+    def cadastrar_lote(self):
+        operadora = self.operadora_remessa.get().strip()
+        arquivo = self.arquivo_importado
+        texto = None if arquivo else self.chips_text.get('1.0', tk.END)
+
+        def linhas():
+            return ler_linhas_arquivo(arquivo) if arquivo else ler_linhas_texto(texto)
+
+        def validar(tarefa):
+            # Primeira passada, sem gravar nada: conta as linhas e junta os recusados para a prévia de erros
+            return validar_linhas(linhas(), operadora, tarefa.informar_progresso)
+
+        def confirmar(resultado):
+            total, validos, falhas = resultado
+            if not validos:
+                messagebox.showerror("Erro", "Nenhum chip válido encontrado!\n\n" + resumir_falhas(falhas, MAX_DETALHES_RESULTADO))
+                return
+            if falhas and not messagebox.askyesno(
+                    "Validação do lote",
+                    f"{len(falhas)} linhas serão recusadas:\n\n{resumir_falhas(falhas, MAX_DETALHES_RESULTADO)}\n\n"
+                    f"Cadastrar os {validos} chips válidos?"):
+                return
+            self.executar_em_segundo_plano("Cadastrando lote", executar, concluir, total=total)
+
+        def executar(tarefa):
+            # Cancelar desfaz a remessa inteira (ver Database.cadastrar_remessa); o progresso avança a cada lote
+            # de TAMANHO_LOTE_PADRAO linhas
+            _, numero_remessa, sucesso, falhas = self.db.cadastrar_remessa(linhas(), operadora,
+                                                                           progresso=tarefa.informar_progresso)
+            return numero_remessa, sucesso, falhas
+
+        def concluir(resultado):
+            numero_remessa, sucesso, falhas = resultado
+            messagebox.showinfo("Resultado", f"Remessa {numero_remessa} criada!\n{sucesso} chips cadastrados.\nFalhas: {len(falhas)}")
+            self.limpar_importacao()
+
+        self.executar_em_segundo_plano("Validando lote", validar, confirmar,
+                                       total=self.total_importado if arquivo else None)
+
+    # -------------------------
+    # ABA RETIRADA EM LOTE
+    # -------------------------
+    def criar_aba_retirada(self, frame):
+        card = CardFrame(frame)
+        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
+        inner = card.inner_frame
+
+        tk.Label(inner, text="Digite os ICCIDs (um por linha):", font=('Segoe UI', 12, 'bold'), bg=COR_CARD).pack(pady=10)
+        self.retirada_text = scrolledtext.ScrolledText(inner, width=60, height=10)
+        self.retirada_text.pack(pady=10)
+
+        # Quem só tem os últimos dígitos do cartão: busca pelo final e duplo clique inclui o ICCID na lista
+        busca_frame = tk.Frame(inner, bg=COR_CARD)
+        busca_frame.pack()
+        tk.Label(busca_frame, text="Buscar pelo final do ICCID:", bg=COR_CARD).pack(side=tk.LEFT, padx=5)
+        self.retirada_busca = ttk.Entry(busca_frame, width=20)
+        self.retirada_busca.pack(side=tk.LEFT)
+        self.retirada_busca.bind('<KeyRelease>', lambda evento: self._agendar('busca_retirada', self.buscar_iccid_retirada))
+        self.retirada_resultados = tk.Listbox(inner, width=60, height=4)
+        self.retirada_resultados.pack(pady=5)
+        self.retirada_resultados.bind('<Double-Button-1>', self._incluir_iccid_retirada)
+        self.retirada_resultados.bind('<Return>', self._incluir_iccid_retirada)
+
+        tk.Label(inner, text="Retirado por:", font=('Segoe UI', 12, 'bold'), bg=COR_CARD).pack(pady=10)
+        self.retirado_por_entry = ttk.Entry(inner, width=40)
+        self.retirado_por_entry.pack(pady=5)
+
+        ModernButton(inner, "✓ Confirmar Retirada em Lote", self.retirar_chips_lote,
+                     width=250, height=50, bg_color=COR_ERRO, hover_color='#dc2626').pack(pady=20)
+
+    def buscar_iccid_retirada(self):
+        trecho = self.retirada_busca.get().strip()
+
+        def concluir(chips):
+            if trecho != self.retirada_busca.get().strip():
+                return
+            self.retirada_resultados.delete(0, tk.END)
+            for iccid, operadora, status, *_ in chips:
+                self.retirada_resultados.insert(tk.END, f"{iccid}  —  {operadora}, {status}")
+
+        self.executar_em_segundo_plano("Buscando ICCID", lambda tarefa: self.db.buscar_iccid(trecho, BUSCA_FINAL),
+                                       concluir)
+
+    def _incluir_iccid_retirada(self, evento=None):
+        selecionado = self.retirada_resultados.curselection()
+        if not selecionado:
+            return
+        iccid = self.retirada_resultados.get(selecionado[0]).split()[0]
+        texto = self.retirada_text.get('1.0', tk.END).strip()
+        self.retirada_text.delete('1.0', tk.END)
+        self.retirada_text.insert('1.0', f"{texto}\n{iccid}" if texto else iccid)
+
+    def retirar_chips_lote(self):
+        iccids = [linha.strip() for linha in self.retirada_text.get('1.0', tk.END).split('\n') if linha.strip()]
+        retirado_por = self.retirado_por_entry.get().strip()
+
+        if not iccids or not retirado_por:
+            messagebox.showerror("Erro", "Preencha todos os campos!")
+            return
+
+        def concluir(resultado):
+            mensagem = f"✓ {len(resultado['retirados'])} chips retirados com sucesso!"
+            if resultado['ja_retirados']:
+                mensagem += f"\n⚠ {len(resultado['ja_retirados'])} já retirados:"
+                for iccid, por, quando in resultado['ja_retirados'][:MAX_DETALHES_RESULTADO]:
+                    mensagem += f"\n   {iccid} — {por or '?'} em {quando or '?'}"
+            if resultado['desconhecidos']:
+                mensagem += f"\n⚠ {len(resultado['desconhecidos'])} não encontrados:"
+                for iccid in resultado['desconhecidos'][:MAX_DETALHES_RESULTADO]:
+                    mensagem += f"\n   {iccid}"
+            messagebox.showinfo("Resultado", mensagem)
+            self.retirada_text.delete('1.0', tk.END)
+            self.retirado_por_entry.delete(0, tk.END)
+
+        # Cancelar desfaz a retirada inteira (ver Database.retirar_chips_lote)
+        self.executar_em_segundo_plano(
+            "Retirando chips",
+            lambda tarefa: self.db.retirar_chips_lote(iccids, retirado_por, progresso=tarefa.informar_progresso),
+            concluir, total=len(iccids))
+
+    # -------------------------
+    # ABA CONSULTA DE CHIPS
+    # -------------------------
+    def criar_aba_consulta(self, frame):
+        card = CardFrame(frame)
+        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
+        inner = card.inner_frame
+
+        filtro_frame = tk.Frame(inner, bg=COR_CARD)
+        filtro_frame.pack(pady=10)
+
+        tk.Label(filtro_frame, text="Operadora:", bg=COR_CARD).pack(side=tk.LEFT, padx=5)
+        self.filtro_operadora = ttk.Combobox(filtro_frame, values=[''] + OPERADORAS, width=20)
+        self.filtro_operadora.pack(side=tk.LEFT, padx=5)
+
+        tk.Label(filtro_frame, text="Status:", bg=COR_CARD).pack(side=tk.LEFT, padx=5)
+        self.filtro_status = ttk.Combobox(filtro_frame, values=['', 'Disponível', 'Retirado'], width=18)
+        self.filtro_status.pack(side=tk.LEFT, padx=5)
+
+        tk.Label(filtro_frame, text="Entrada de:", bg=COR_CARD).pack(side=tk.LEFT, padx=5)
+        self.filtro_data_inicio = ttk.Entry(filtro_frame, width=11)
+        self.filtro_data_inicio.pack(side=tk.LEFT)
+        tk.Label(filtro_frame, text="até:", bg=COR_CARD).pack(side=tk.LEFT, padx=5)
+        self.filtro_data_fim = ttk.Entry(filtro_frame, width=11)
+        self.filtro_data_fim.pack(side=tk.LEFT)
+        self.incluir_arquivados = tk.BooleanVar(value=False)
+        tk.Checkbutton(filtro_frame, text="Incluir arquivados", variable=self.incluir_arquivados,
+                       bg=COR_CARD).pack(side=tk.LEFT, padx=5)
+
+        ModernButton(filtro_frame, "🔍 Buscar", self.atualizar_consulta,
+                     width=120, height=35, bg_color=COR_PRIMARIA, hover_color=COR_SECUNDARIA).pack(side=tk.LEFT, padx=10)
+        ModernButton(filtro_frame, "💾 Exportar",
+                     lambda: self.exportar_chips(self._filtros_consulta, self._total_consulta, 'chips'),
+                     width=120, height=35, bg_color=COR_ACCENT, hover_color='#0891b2').pack(side=tk.LEFT)
+
+        busca_frame = tk.Frame(inner, bg=COR_CARD)
+        busca_frame.pack(pady=5)
+        tk.Label(busca_frame, text="ICCID:", bg=COR_CARD).pack(side=tk.LEFT, padx=5)
+        self.busca_modo = ttk.Combobox(busca_frame, values=list(MODOS_BUSCA), width=8, state='readonly')
+        self.busca_modo.set('Final')
+        self.busca_modo.pack(side=tk.LEFT, padx=5)
+        self.busca_modo.bind('<<ComboboxSelected>>', lambda evento: self._agendar('busca_consulta', self.buscar_iccid))
+        self.busca_entry = ttk.Entry(busca_frame, width=24)
+        self.busca_entry.pack(side=tk.LEFT, padx=5)
+        self.busca_entry.bind('<KeyRelease>', lambda evento: self._agendar('busca_consulta', self.buscar_iccid))
+
+        self.total_consulta_label = tk.Label(inner, text="", font=('Segoe UI', 10), bg=COR_CARD, fg=COR_TEXTO_SECUNDARIO)
+        self.total_consulta_label.pack()
+
+        tree_frame = tk.Frame(inner, bg=COR_CARD)
+        tree_frame.pack(fill=tk.BOTH, expand=True, pady=10)
+        self.tree = ttk.Treeview(tree_frame, columns=('ICCID', 'Operadora', 'Status', 'Entrada', 'Saída', 'Retirado Por'),
+                                 show='headings', height=20)
+        for col in ('ICCID', 'Operadora', 'Status', 'Entrada', 'Saída', 'Retirado Por'):
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=180)
+        self.consulta_scroll = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._rolagem_consulta)
+        self.consulta_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Janela deslizante de páginas: só MAX_PAGINAS_CONSULTA páginas ficam na Treeview
+        self._filtros_consulta = {}
+        self._total_consulta = None
+        self._cursores_pagina = []   # cursor inicial de cada página já descoberta
+        self._paginas_tree = []      # [(número da página, ids dos itens)] presentes na Treeview
+        self._carregando_pagina = False
+        self._geracao_consulta = 0   # descarta resultados de buscas anteriores que cheguem atrasados
+
+    def atualizar_consulta(self):
+        # Datas no formato AAAA-MM-DD; uma data inválida volta como erro da tarefa
+        filtros = {'filtro_operadora': self.filtro_operadora.get() or None,
+                   'filtro_status': self.filtro_status.get() or None,
+                   'data_inicio': self.filtro_data_inicio.get().strip() or None,
+                   'data_fim': self.filtro_data_fim.get().strip() or None,
+                   'incluir_arquivo': self.incluir_arquivados.get()}
+        self._geracao_consulta += 1
+        geracao = self._geracao_consulta
+        self._carregando_pagina = True
+
+        def concluir(resultado):
+            if geracao != self._geracao_consulta:
+                return
+            total, pagina = resultado
+            self.tree.delete(*self.tree.get_children())
+            self._filtros_consulta = filtros
+            self._total_consulta = total
+            self._cursores_pagina = [None]
+            self._paginas_tree = []
+            self.total_consulta_label.config(text=f"{total} chips encontrados")
+            self._aplicar_pagina(0, True, pagina)
+
+        def finalizar():
+            if geracao == self._geracao_consulta:
+                self._carregando_pagina = False
+
+        self.executar_em_segundo_plano(
+            "Consultando chips",
+            lambda tarefa: (self.db.contar_chips(**filtros), self.db.listar_chips_pagina(**filtros)),
+            concluir, ao_finalizar=finalizar)
+
+    def buscar_iccid(self):
+        # Busca enquanto se digita: substitui a listagem pelos resultados; campo vazio volta à listagem filtrada
+        trecho = self.busca_entry.get().strip()
+        if not trecho:
+            self.atualizar_consulta()
+            return
+        modo = MODOS_BUSCA[self.busca_modo.get()]
+        incluir_arquivo = self.incluir_arquivados.get()
+        self._geracao_consulta += 1
+        geracao = self._geracao_consulta
+
+        def concluir(chips):
+            if geracao != self._geracao_consulta:
+                return
+            self.tree.delete(*self.tree.get_children())
+            self._cursores_pagina = [None]
+            self._paginas_tree = []   # sem paginação enquanto a busca está ativa
+            for iccid, operadora, status, entrada, saida, retirado_por in chips:
+                self.tree.insert('', tk.END, values=(iccid, operadora, status, entrada, saida or '', retirado_por or ''))
+            texto = f"{len(chips)} chips com \"{trecho}\""
+            if len(chips) == LIMITE_BUSCA_ICCID:
+                texto += f" (primeiros {LIMITE_BUSCA_ICCID}; digite mais dígitos)"
+            self.total_consulta_label.config(text=texto)
+
+        self.executar_em_segundo_plano("Buscando ICCID", lambda tarefa: self.db.buscar_iccid(trecho, modo, incluir_arquivo=incluir_arquivo),
+                                       concluir)
+
+    def _aplicar_pagina(self, numero, no_fim, pagina):
+        chips, proximo = pagina
+        if proximo is not None and numero + 1 == len(self._cursores_pagina):
+            self._cursores_pagina.append(proximo)
+        itens = []
+        for posicao, (iccid, operadora, status, entrada, saida, retirado_por) in enumerate(chips):
+            itens.append(self.tree.insert('', tk.END if no_fim else posicao,
+                                          values=(iccid, operadora, status, entrada, saida or '', retirado_por or '')))
+        if no_fim:
+            self._paginas_tree.append((numero, itens))
+        else:
+            self._paginas_tree.insert(0, (numero, itens))
+        if len(self._paginas_tree) > MAX_PAGINAS_CONSULTA:
+            _, descartados = self._paginas_tree.pop(0 if no_fim else -1)
+            self.tree.delete(*descartados)
+
+    def _rolagem_consulta(self, primeiro, ultimo):
+        self.consulta_scroll.set(primeiro, ultimo)
+        if self._carregando_pagina or not self._paginas_tree:
+            return
+        if float(ultimo) > 0.9:
+            proxima = self._paginas_tree[-1][0] + 1
+            if proxima < len(self._cursores_pagina):
+                self._buscar_pagina(proxima, True)
+        elif float(primeiro) < 0.1 and self._paginas_tree[0][0] > 0:
+            self._buscar_pagina(self._paginas_tree[0][0] - 1, False)
+
+    def _buscar_pagina(self, numero, no_fim):
+        self._carregando_pagina = True
+        geracao, filtros, cursor = self._geracao_consulta, self._filtros_consulta, self._cursores_pagina[numero]
+
+        def concluir(pagina):
+            if geracao == self._geracao_consulta:
+                self._deslizar_consulta(numero, no_fim, pagina)
+
+        def finalizar():
+            if geracao == self._geracao_consulta:
+                self._carregando_pagina = False
+
+        self.executar_em_segundo_plano(
+            "Carregando página", lambda tarefa: self.db.listar_chips_pagina(cursor=cursor, **filtros),
+            concluir, ao_finalizar=finalizar)
+
+    def _deslizar_consulta(self, numero, no_fim, pagina):
+        # Mantém a mesma linha no topo da área visível depois de incluir/descartar páginas
+        itens = self.tree.get_children()
+        ancora = itens[min(int(self.tree.yview()[0] * len(itens)), len(itens) - 1)] if itens else None
+        self._aplicar_pagina(numero, no_fim, pagina)
+        itens = self.tree.get_children()
+        if ancora is not None and self.tree.exists(ancora):
+            self.tree.yview_moveto(itens.index(ancora) / len(itens))
+
+    # -------------------------
+    # ABA REMESSAS COM EXCLUSÃO
+    # -------------------------
+    def criar_aba_remessas(self, frame):
+        card = CardFrame(frame)
+        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
+        inner = card.inner_frame
+
+        tk.Label(inner, text="📋 Histórico de Remessas", font=('Segoe UI', 16, 'bold'), bg=COR_CARD).pack(pady=10)
+
+        self.remessas_tree = ttk.Treeview(inner, columns=('ID', 'Número', 'Data', 'Operadora', 'Qtd', 'Obs'),
+                                          show='headings', height=20)
+        for col in ('ID', 'Número', 'Data', 'Operadora', 'Qtd', 'Obs'):
+            self.remessas_tree.heading(col, text=col)
+            self.remessas_tree.column(col, width=180)
+        self.remessas_tree.pack(fill=tk.BOTH, expand=True)
+
+        btn_frame = tk.Frame(inner, bg=COR_CARD)
+        btn_frame.pack(pady=10)
+
+        ModernButton(btn_frame, "🔄 Atualizar", self.atualizar_remessas,
+                     width=150, height=40, bg_color=COR_PRIMARIA, hover_color=COR_SECUNDARIA).pack(side=tk.LEFT, padx=5)
+
+        ModernButton(btn_frame, "💾 Exportar Chips", self.exportar_chips_remessa,
+                     width=180, height=40, bg_color=COR_ACCENT, hover_color='#0891b2').pack(side=tk.LEFT, padx=5)
+
+        ModernButton(btn_frame, "🗑 Excluir Remessa", self.excluir_remessa,
+                     width=180, height=40, bg_color=COR_ERRO, hover_color='#dc2626').pack(side=tk.LEFT, padx=5)
+
+        self.atualizar_remessas()
+
+    def atualizar_remessas(self):
+        def concluir(remessas):
+            self.remessas_tree.delete(*self.remessas_tree.get_children())
+            for r in remessas:
+                self.remessas_tree.insert('', tk.END, values=r)
+
+        self.executar_em_segundo_plano("Carregando remessas", lambda tarefa: self.db.listar_remessas(), concluir)
+
+    def exportar_chips(self, filtros, total, nome_sugerido):
+        # Lê do banco e grava no arquivo em blocos, na thread de trabalho; cancelar apaga o arquivo incompleto
+        tipos = [("CSV", "*.csv"), ("CSV compactado", "*.csv.gz")]
+        if XLSX_AVAILABLE:
+            tipos.append(("Excel", "*.xlsx"))
+        arquivo = filedialog.asksaveasfilename(defaultextension='.csv', filetypes=tipos, initialfile=nome_sugerido)
+        if not arquivo:
+            return
+
+        def concluir(quantidade):
+            messagebox.showinfo("Exportação", f"{quantidade} chips exportados para {os.path.basename(arquivo)} "
+                                              f"({formato_exportacao(arquivo)}).")
+
+        self.executar_em_segundo_plano(
+            "Exportando chips",
+            lambda tarefa: self.db.exportar_chips(arquivo, progresso=tarefa.informar_progresso, **filtros),
+            concluir, total=total)
+
+    def exportar_chips_remessa(self):
+        selecionado = self.remessas_tree.selection()
+        if not selecionado:
+            messagebox.showwarning("Aviso", "Selecione uma remessa para exportar!")
+            return
+        remessa_id, numero_remessa, _, _, quantidade = self.remessas_tree.item(selecionado[0], 'values')[:5]
+        self.exportar_chips({'remessa_id': int(remessa_id), 'incluir_arquivo': True}, int(quantidade or 0) or None,
+                            numero_remessa)
+
+    def excluir_remessa(self):
+        selecionado = self.remessas_tree.selection()
+        if not selecionado:
+            messagebox.showwarning("Aviso", "Selecione uma remessa para excluir!")
+            return
+
+        item = selecionado[0]
+        valores = self.remessas_tree.item(item, 'values')
+        remessa_id, numero_remessa, quantidade = valores[0], valores[1], valores[4]
+
+        resposta = messagebox.askyesno("Confirmar Exclusão",
+                                       f"Deseja excluir a remessa {numero_remessa}?\n\n"
+                                       "Isso não pode ser desfeito.")
+        if not resposta:
+            return
+
+        excluir_chips = messagebox.askyesno("Excluir Chips",
+                                            "Deseja também excluir os chips vinculados a esta remessa?")
+
+        def concluir(_):
+            messagebox.showinfo("Sucesso", f"Remessa {numero_remessa} excluída com sucesso!")
+            self.atualizar_remessas()
+
+        # Os chips saem em lotes (transações curtas), com o progresso na barra de status
+        self.executar_em_segundo_plano(
+            f"Excluindo remessa {numero_remessa}",
+            lambda tarefa: self.db.excluir_remessa(remessa_id, excluir_chips, progresso=tarefa.informar_progresso),
+            concluir, total=int(quantidade or 0) or None if excluir_chips else None)
+
+    # -------------------------
+    # ABA ESTATÍSTICAS COM GRÁFICO
+    # -------------------------
+    def criar_aba_estatisticas(self, frame):
+        card = CardFrame(frame)
+        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
+        inner = card.inner_frame
+        tk.Label(inner, text="📊 Estatísticas do Sistema", font=('Segoe UI', 18, 'bold'), bg=COR_CARD).pack(pady=20)
+        self.stats_label = tk.Label(inner, text="", font=('Segoe UI', 14), bg=COR_CARD)
+        self.stats_label.pack(pady=10)
+        ModernButton(inner, "🔄 Atualizar Estatísticas", self.atualizar_estatisticas,
+                     width=220, height=45, bg_color=COR_PRIMARIA, hover_color=COR_SECUNDARIA).pack(pady=20)
+        self.grafico_estatisticas = None
+        if MATPLOTLIB_AVAILABLE:
+            self.grafico_estatisticas = GraficoEstatisticas(inner)
+            self.grafico_estatisticas.pack(fill=tk.BOTH, expand=True, pady=10)
+
+    def atualizar_estatisticas(self):
+        self.executar_em_segundo_plano(
+            "Atualizando estatísticas",
+            lambda tarefa: (self.db.estatisticas(), self.db.estatisticas_por_operadora(),
+                            self.db.serie_movimentos_diarios()),
+            self._exibir_estatisticas)
+
+    def _exibir_estatisticas(self, resultado):
+        stats, por_operadora, serie_diaria = resultado
+        texto = (f"Total de Chips: {stats['total']}\n"
+                 f"Disponíveis: {stats['disponiveis']}\n"
+                 f"Retirados: {stats['retirados']}\n"
+                 f"Total de Remessas: {stats['total_remessas']}")
+        for operadora, total, disponiveis, retirados in por_operadora:
+            texto += f"\n{operadora}: {total} ({disponiveis} disponíveis, {retirados} retirados)"
+        self.stats_label.config(text=texto)
+        if self.grafico_estatisticas:
+            self.grafico_estatisticas.atualizar(stats, por_operadora, serie_diaria)
+
+    # -------------------------
+    # ABA DIAGNÓSTICO (OCULTA)
+    # -------------------------
+    def abrir_aba_diagnostico(self, event=None):
+        if self.instrumentacao is None:
+            messagebox.showinfo("Diagnóstico", "A medição está desligada. Abra o programa com "
+                                               "MONITORAMENTO_METRICAS=1 para ver as métricas do banco.")
+            return
+        if self.aba_diagnostico is None:
+            self.aba_diagnostico = tk.Frame(self.notebook, bg=COR_FUNDO)
+            self.notebook.add(self.aba_diagnostico, text="🩺 Diagnóstico")
+            self.criar_aba_diagnostico(self.aba_diagnostico)
+        self.notebook.select(self.aba_diagnostico)
+        self.atualizar_diagnostico()
+
+    def criar_aba_diagnostico(self, frame):
+        card = CardFrame(frame)
+        card.pack(fill=tk.BOTH, expand=True, padx=30, pady=30)
+        inner = card.inner_frame
+        tk.Label(inner, text="🩺 Desempenho do Banco", font=('Segoe UI', 16, 'bold'), bg=COR_CARD).pack(pady=10)
+
+        controles = tk.Frame(inner, bg=COR_CARD)
+        controles.pack(fill=tk.X, pady=5)
+        self.medicao_ativa = tk.BooleanVar(value=self.instrumentacao.ativa)
+        ttk.Checkbutton(controles, text="Medição ativa", variable=self.medicao_ativa,
+                        command=self._alternar_medicao).pack(side=tk.LEFT, padx=5)
+        tk.Label(controles, text=f"Instruções lentas (≥ {self.instrumentacao.limite_lenta_ms:.0f} ms) vão para "
+                                 f"{ARQUIVO_LOG_LENTAS}", font=('Segoe UI', 9), bg=COR_CARD,
+                 fg=COR_TEXTO_SECUNDARIO).pack(side=tk.LEFT, padx=15)
+
+        self.diagnostico_text = scrolledtext.ScrolledText(inner, height=25, font=('Consolas', 9), wrap=tk.NONE)
+        self.diagnostico_text.pack(fill=tk.BOTH, expand=True, pady=5)
+
+        btn_frame = tk.Frame(inner, bg=COR_CARD)
+        btn_frame.pack(pady=10)
+        ModernButton(btn_frame, "🔄 Atualizar", self.atualizar_diagnostico,
+                     width=150, height=40, bg_color=COR_PRIMARIA, hover_color=COR_SECUNDARIA).pack(side=tk.LEFT, padx=5)
+        ModernButton(btn_frame, "🧹 Zerar", self.zerar_diagnostico,
+                     width=150, height=40, bg_color=COR_TEXTO_SECUNDARIO, hover_color='#475569').pack(side=tk.LEFT, padx=5)
+        ModernButton(btn_frame, "💾 Salvar JSON", lambda: self.salvar_metricas('json'),
+                     width=170, height=40, bg_color=COR_ACCENT, hover_color='#0891b2').pack(side=tk.LEFT, padx=5)
+        ModernButton(btn_frame, "💾 Salvar Prometheus", lambda: self.salvar_metricas('prometheus'),
+                     width=200, height=40, bg_color=COR_ACCENT, hover_color='#0891b2').pack(side=tk.LEFT, padx=5)
+
+    def _alternar_medicao(self):
+        self.instrumentacao.ativar(self.medicao_ativa.get())
+        self.atualizar_diagnostico()
+
+    def atualizar_diagnostico(self):
+        # O instantâneo só lê contadores em memória; não passa pelo banco nem pela thread de trabalho
+        dados = self.instrumentacao.instantaneo()
+        linhas = [f"Medição {'ativa' if dados['ativa'] else 'desligada'} — dados desde {dados['desde']}", '']
+        for titulo, chave, itens in (("MÉTODOS", 'metodo', dados['metodos']),
+                                     ("CONSULTAS (por tempo total)", 'sql', dados['consultas'])):
+            linhas.append(f"{titulo}")
+            linhas.append(f"{'qtd':>8} {'total ms':>11} {'p50':>9} {'p95':>9} {'máx':>9} {'lentas':>6}  nome")
+            for item in itens[:LINHAS_DIAGNOSTICO]:
+                linhas.append(f"{item['quantidade']:>8} {item['total_ms']:>11.1f} {item['p50_ms']:>9.2f} "
+                              f"{item['p95_ms']:>9.2f} {item['max_ms']:>9.2f} {item['lentas']:>6}  {item[chave]}")
+            if len(itens) > LINHAS_DIAGNOSTICO:
+                linhas.append(f"... e mais {len(itens) - LINHAS_DIAGNOSTICO}")
+            linhas.append('')
+        self.diagnostico_text.delete('1.0', tk.END)
+        self.diagnostico_text.insert('1.0', '\n'.join(linhas))
+
+    def zerar_diagnostico(self):
+        self.instrumentacao.zerar()
+        self.atualizar_diagnostico()
+
+    def salvar_metricas(self, formato):
+        extensao = '.prom' if formato == 'prometheus' else '.json'
+        caminho = filedialog.asksaveasfilename(title="Salvar métricas", defaultextension=extensao,
+                                               initialfile=f"metricas{extensao}")
+        if not caminho:
+            return
+        try:
+            self.instrumentacao.gravar(caminho, formato)
+        except OSError as e:
+            messagebox.showerror("Erro", f"Não foi possível salvar as métricas: {e}")
+
+
+def executar_interface():
+    root = tk.Tk()
+    app = MonitoramentoApp(root)
+    if os.environ.get('MONITORAMENTO_MEDIR_INICIO'):
+        # Usado por medir_inicializacao.py: avisa quando a janela foi pintada pela primeira vez e sai
+        root.wait_visibility(root)
+        root.update_idletasks()
+        print('PRIMEIRA_PINTURA', flush=True)
+        app.executor.encerrar()
+        root.destroy()
+        return
+    root.mainloop()
+    app.executor.encerrar()
+    app.db.fechar()
+    if app.instrumentacao:
+        app.instrumentacao.fechar()
+
+
+if __name__ == "__main__":
+    executar_interface()
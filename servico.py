@@ -0,0 +1,348 @@
+import ipaddress
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.client import HTTPConnection, RemoteDisconnected
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from urllib.parse import urlsplit
+
+from iccid import FalhaChip
+from monitoramento import (CABECALHO_CHIPS, CABECALHO_REMESSAS, TAMANHO_LOTE_EXCLUSAO, TAMANHO_LOTE_PADRAO,
+                           TAMANHO_LOTE_RETIRADA, TAMANHO_PAGINA, escrever_tabela)
+
+# Modo serviço: um único processo é dono do banco e atende as estações por HTTP/JSON
+# (POST /api/<método> com {"args": [...], "kwargs": {...}} -> {"resultado": ...} ou {"erro", "tipo"}).
+# As gravações vão para uma fila consumida por uma só thread, que junta os pedidos pendentes em um grupo:
+# uma transação IMMEDIATE e um COMMIT para o grupo inteiro, com um SAVEPOINT por pedido (o erro de um não
+# desfaz os outros). As leituras rodam em um conjunto fixo de threads, cada uma com sua conexão WAL, em
+# paralelo com a gravação. Nenhuma estação abre o chips.db diretamente, e "database is locked" deixa de existir.
+# Não há autenticação (qualquer um que alcance a porta cadastra, retira e exclui): por padrão o serviço só aceita
+# endereços locais, e outro host exige permitir_rede=True.
+HOST_PADRAO = '127.0.0.1'
+PORTA_PADRAO = 8765
+LEITORES_PADRAO = 4
+MAX_GRUPO = 64              # pedidos de gravação por COMMIT
+JANELA_GRUPO_MS = 0         # espera extra por mais pedidos antes de gravar o grupo (0: só os que já estão na fila)
+TAMANHO_MAX_PEDIDO = 256 * 1024 * 1024
+TIMEOUT_CLIENTE = 600
+
+METODOS_LEITURA = frozenset({
+    'listar_chips', 'listar_chips_pagina', 'contar_chips', 'buscar_iccid', 'listar_remessas', 'estatisticas',
+    'estatisticas_por_operadora', 'estatisticas_por_remessa', 'serie_movimentos_diarios', 'historico_chip',
+    'resumo_movimentos', 'totais_movimentos', 'gerar_numero_remessa', 'versao_esquema',
+})
+METODOS_ESCRITA = frozenset({
+    'adicionar_chip', 'adicionar_chips_lote', 'cadastrar_remessa', 'criar_remessa', 'definir_quantidade_remessa',
+    'retirar_chips_lote', 'excluir_remessa',
+})
+
+# Exceções que o cliente recria com o mesmo tipo; as demais chegam como ErroServico
+ERROS_REMOTOS = {erro.__name__: erro for erro in (
+    ValueError, TypeError, KeyError, sqlite3.IntegrityError, sqlite3.OperationalError, sqlite3.DatabaseError)}
+
+
+class ErroServico(RuntimeError):
+    pass
+
+
+def host_local(host):
+    # 'localhost', 127.0.0.0/8 e ::1
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# FalhaChip é uma str com .motivo, que o JSON perderia: nos resultados com recusas viaja como [iccid, motivo]
+def _falhas_para_json(falhas):
+    return [[falha, falha.motivo] for falha in falhas]
+
+def _falhas_de_json(falhas):
+    return [FalhaChip(iccid, motivo) for iccid, motivo in falhas]
+
+CODIFICAR_RESULTADO = {
+    'adicionar_chips_lote': lambda r: [r[0], _falhas_para_json(r[1])],
+    'cadastrar_remessa': lambda r: [r[0], r[1], r[2], _falhas_para_json(r[3])],
+}
+DECODIFICAR_RESULTADO = {
+    'adicionar_chips_lote': lambda r: (r[0], _falhas_de_json(r[1])),
+    'cadastrar_remessa': lambda r: (r[0], r[1], r[2], _falhas_de_json(r[3])),
+    'listar_chips_pagina': lambda r: (r[0], tuple(r[1]) if r[1] else None),
+}
+
+
+class ServicoMonitoramento:
+    def __init__(self, db, host=HOST_PADRAO, porta=PORTA_PADRAO, leitores=LEITORES_PADRAO, max_grupo=MAX_GRUPO,
+                 janela_grupo_ms=JANELA_GRUPO_MS, permitir_rede=False):
+        # db: Database já aberto (o serviço não o fecha); porta 0 escolhe uma porta livre
+        if not (permitir_rede or host_local(host)):
+            raise ValueError(f"O serviço não tem autenticação e só atende endereços locais ({host} recusado); "
+                             "para aceitar outras máquinas, use permitir_rede (--permitir-rede na linha de comando)")
+        self.db = db
+        self.max_grupo = max_grupo
+        self.janela_grupo = janela_grupo_ms / 1000
+        self.grupos = 0
+        self.gravacoes = 0
+        self._fila = Queue()
+        self._leitores = ThreadPoolExecutor(leitores, thread_name_prefix='leitor')
+        self._escritor = threading.Thread(target=self._gravar, name='escritor', daemon=True)
+        self._servidor = ThreadingHTTPServer((host, porta), _Manipulador)
+        self._servidor.daemon_threads = True
+        self._servidor.servico = self
+        self._thread_servidor = None
+
+    @property
+    def url(self):
+        host, porta = self._servidor.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def iniciar(self):
+        # Atende em segundo plano; servir() é a versão que bloqueia
+        self._escritor.start()
+        self._thread_servidor = threading.Thread(target=self._servidor.serve_forever, name='servidor', daemon=True)
+        self._thread_servidor.start()
+        return self
+
+    def servir(self):
+        self._escritor.start()
+        self._servidor.serve_forever()
+
+    def encerrar(self):
+        if self._escritor.is_alive():
+            self._servidor.shutdown()
+        self._servidor.server_close()
+        if self._escritor.is_alive():
+            self._fila.put(None)
+            self._escritor.join()
+        self._leitores.shutdown()
+
+    def chamar(self, metodo, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        if metodo in METODOS_LEITURA:
+            return self._leitores.submit(getattr(self.db, metodo), *args, **kwargs).result()
+        if metodo in METODOS_ESCRITA:
+            futuro = Future()
+            self._fila.put((metodo, args, kwargs, futuro))
+            return futuro.result()
+        raise KeyError(metodo)
+
+    def situacao(self):
+        return {'grupos': self.grupos, 'gravacoes': self.gravacoes, 'fila': self._fila.qsize(),
+                'gravacoes_por_grupo': round(self.gravacoes / self.grupos, 2) if self.grupos else 0.0}
+
+    def _gravar(self):
+        while True:
+            pedido = self._fila.get()
+            if pedido is None:
+                return
+            grupo = [pedido]
+            limite = time.monotonic() + self.janela_grupo
+            while len(grupo) < self.max_grupo:
+                try:
+                    pedido = self._fila.get(timeout=max(0.0, limite - time.monotonic())) if self.janela_grupo \
+                        else self._fila.get_nowait()
+                except Empty:
+                    break
+                if pedido is None:
+                    self._fila.put(None)
+                    break
+                grupo.append(pedido)
+            self._gravar_grupo(grupo)
+
+    def _gravar_grupo(self, grupo):
+        resultados = []
+        try:
+            with self.db.transacao(imediata=True):
+                for metodo, args, kwargs, futuro in grupo:
+                    try:
+                        with self.db.transacao():
+                            resultados.append((futuro, getattr(self.db, metodo)(*args, **kwargs), None))
+                    except Exception as e:
+                        resultados.append((futuro, None, e))
+        except Exception as e:
+            # BEGIN ou COMMIT falhou: nada do grupo foi gravado
+            for *_, futuro in grupo:
+                futuro.set_exception(e)
+            return
+        self.grupos += 1
+        self.gravacoes += len(grupo)
+        for futuro, resultado, erro in resultados:
+            if erro is None:
+                futuro.set_result(resultado)
+            else:
+                futuro.set_exception(erro)
+
+
+class _Manipulador(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Cabeçalho e corpo saem em duas escritas; com Nagle, a segunda espera o ACK atrasado do cliente (~40 ms)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == '/saude':
+            self._responder(200, self.server.servico.situacao())
+        else:
+            self._responder(404, {'erro': f"caminho desconhecido: {self.path}", 'tipo': 'KeyError'})
+
+    def do_POST(self):
+        if not self.path.startswith('/api/'):
+            self._responder(404, {'erro': f"caminho desconhecido: {self.path}", 'tipo': 'KeyError'})
+            return
+        metodo = self.path[len('/api/'):]
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        if tamanho > TAMANHO_MAX_PEDIDO:
+            self.close_connection = True
+            self._responder(413, {'erro': f"pedido maior que {TAMANHO_MAX_PEDIDO} bytes", 'tipo': 'ValueError'})
+            return
+        try:
+            pedido = json.loads(self.rfile.read(tamanho) or b'{}')
+            resultado = self.server.servico.chamar(metodo, pedido.get('args', ()), pedido.get('kwargs'))
+        except KeyError as e:
+            codigo = 404 if e.args == (metodo,) else 500
+            self._responder(codigo, {'erro': f"método desconhecido: {metodo}" if codigo == 404 else str(e),
+                                     'tipo': 'KeyError'})
+        except (ValueError, TypeError) as e:
+            self._responder(400, {'erro': str(e), 'tipo': type(e).__name__})
+        except Exception as e:
+            self._responder(500, {'erro': str(e), 'tipo': type(e).__name__})
+        else:
+            codificar = CODIFICAR_RESULTADO.get(metodo)
+            self._responder(200, {'resultado': codificar(resultado) if codificar else resultado})
+
+    def _responder(self, codigo, corpo):
+        dados = json.dumps(corpo, ensure_ascii=False).encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+class ClienteServico:
+    # Mesma interface do Database (nos métodos atendidos pelo serviço), para a interface gráfica usar no lugar dele
+    def __init__(self, url, timeout=TIMEOUT_CLIENTE, instrumentacao=None):
+        partes = urlsplit(url if '//' in url else f"http://{url}")
+        self.host = partes.hostname or HOST_PADRAO
+        self.porta = partes.port or PORTA_PADRAO
+        self.timeout = timeout
+        self.instrumentacao = instrumentacao
+        self._local = threading.local()
+        self._conexoes = []
+        self._lock = threading.Lock()
+        if instrumentacao:
+            # Só importado aqui: sem medição, a estação cliente nem carrega o módulo de instrumentação
+            from instrumentacao import METODOS_NAO_MEDIDOS
+            instrumentacao.instrumentar(self, METODOS_NAO_MEDIDOS | {'chamar'})
+
+    def _conexao(self):
+        # Uma conexão HTTP persistente por thread
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = self._local.conexao = HTTPConnection(self.host, self.porta, timeout=self.timeout)
+            with self._lock:
+                self._conexoes.append(conexao)
+        return conexao
+
+    def chamar(self, metodo, *args, **kwargs):
+        corpo = json.dumps({'args': args, 'kwargs': kwargs}, ensure_ascii=False).encode('utf-8')
+        conexao = self._conexao()
+        reaproveitada = conexao.sock is not None
+        try:
+            conexao.request('POST', f"/api/{metodo}", corpo, {'Content-Type': 'application/json'})
+            resposta = conexao.getresponse()
+        except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # Conexão ociosa fechada pelo servidor antes de receber o pedido: reabre uma vez
+            conexao.close()
+            if not reaproveitada:
+                raise
+            conexao.request('POST', f"/api/{metodo}", corpo, {'Content-Type': 'application/json'})
+            resposta = conexao.getresponse()
+        dados = json.loads(resposta.read())
+        if resposta.status != 200:
+            raise ERROS_REMOTOS.get(dados.get('tipo'), ErroServico)(dados.get('erro'))
+        decodificar = DECODIFICAR_RESULTADO.get(metodo)
+        return decodificar(dados['resultado']) if decodificar else dados['resultado']
+
+    def situacao(self):
+        conexao = self._conexao()
+        conexao.request('GET', '/saude')
+        return json.loads(conexao.getresponse().read())
+
+    def fechar(self):
+        with self._lock:
+            conexoes, self._conexoes = self._conexoes, []
+        for conexao in conexoes:
+            conexao.close()
+        self._local = threading.local()
+
+    # Iteráveis e callbacks não passam pelo JSON: as linhas são lidas aqui (com o progresso da leitura)
+    # e enviadas de uma vez, para a remessa continuar sendo gravada em uma única transação no serviço
+    def cadastrar_remessa(self, linhas, operadora, observacoes='', tamanho_lote=TAMANHO_LOTE_PADRAO, progresso=None):
+        return self.chamar('cadastrar_remessa', _ler_linhas(linhas, tamanho_lote, progresso), operadora,
+                           observacoes, tamanho_lote)
+
+    def adicionar_chips_lote(self, chips, remessa_id=None, tamanho_lote=TAMANHO_LOTE_PADRAO, progresso=None,
+                             data_entrada=None):
+        return self.chamar('adicionar_chips_lote', _ler_linhas(chips, tamanho_lote, progresso), remessa_id,
+                           tamanho_lote, data_entrada=data_entrada)
+
+    def retirar_chips_lote(self, iccids, retirado_por, data_saida=None, tamanho_lote=TAMANHO_LOTE_RETIRADA,
+                           progresso=None):
+        # Como na exclusão: uma chamada só, e o progresso fica no total ao final
+        iccids = list(iccids)
+        resultado = self.chamar('retirar_chips_lote', iccids, retirado_por, data_saida, tamanho_lote)
+        if progresso:
+            progresso(len(iccids))
+        return resultado
+
+    def excluir_remessa(self, remessa_id, excluir_chips=False, tamanho_lote=TAMANHO_LOTE_EXCLUSAO, progresso=None):
+        # No serviço a exclusão entra num grupo de gravação (um COMMIT só); o progresso fica no total ao final
+        excluidos = self.chamar('excluir_remessa', remessa_id, excluir_chips, tamanho_lote)
+        if progresso:
+            progresso(excluidos)
+        return excluidos
+
+    def iterar_chips(self, filtro_operadora=None, filtro_status=None, **filtros):
+        # Página a página (paginação por chave), sem trazer a consulta inteira em uma resposta
+        cursor = None
+        while True:
+            linhas, cursor = self.listar_chips_pagina(filtro_operadora, filtro_status, cursor, TAMANHO_PAGINA,
+                                                      **filtros)
+            yield from linhas
+            if cursor is None:
+                return
+
+    def exportar_chips(self, destino, formato=None, progresso=None, **filtros):
+        return escrever_tabela(destino, CABECALHO_CHIPS, self.iterar_chips(**filtros), formato, progresso, 'Chips')
+
+    def exportar_remessas(self, destino, formato=None, progresso=None):
+        return escrever_tabela(destino, CABECALHO_REMESSAS, self.listar_remessas(), formato, progresso, 'Remessas')
+
+
+def _ler_linhas(linhas, tamanho_lote, progresso):
+    lidas = []
+    for linha in linhas:
+        lidas.append(linha)
+        if progresso and len(lidas) % tamanho_lote == 0:
+            progresso(len(lidas))
+    if progresso:
+        progresso(len(lidas))
+    return lidas
+
+
+def _metodo_remoto(nome):
+    def metodo(self, *args, **kwargs):
+        return self.chamar(nome, *args, **kwargs)
+    metodo.__name__ = metodo.__qualname__ = nome
+    return metodo
+
+for _nome in sorted((METODOS_LEITURA | METODOS_ESCRITA) - set(vars(ClienteServico))):
+    setattr(ClienteServico, _nome, _metodo_remoto(_nome))
@@ -0,0 +1,357 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from iccid import digito_verificador
+from monitoramento import (BUSCA_CONTEM, BUSCA_FINAL, BUSCA_INICIO, MIGRACOES, MOTIVO_JA_ARQUIVADO,
+                           MOTIVO_JA_CADASTRADO, Database, verificar_planos_consulta)
+
+ICCIDS = [corpo + digito_verificador(corpo) for corpo in ('8955000000000000001', '8955000000000000002',
+                                                           '8955000000000000003')]
+
+
+def gerar_iccid(serial, digitos=20):
+    # Outro emissor (56) que o de ICCIDS, para as duas listas nunca se cruzarem
+    corpo = f'8956{serial:0{digitos - 5}d}'
+    return corpo + digito_verificador(corpo)
+
+
+class BancoTemporario(unittest.TestCase):
+    # Cada teste num chips.db novo (todas as migrações aplicadas), numa pasta temporária
+    def setUp(self):
+        self.pasta = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.pasta.name, 'chips.db'))
+
+    def tearDown(self):
+        self.db.fechar()
+        self.pasta.cleanup()
+
+
+class MigracoesTest(unittest.TestCase):
+    # Bancos criados por versões anteriores do programa, com dados, abertos pelo Database atual
+    def setUp(self):
+        self.pasta = tempfile.TemporaryDirectory()
+        self.caminho = os.path.join(self.pasta.name, 'chips.db')
+
+    def tearDown(self):
+        self.pasta.cleanup()
+
+    def abrir(self):
+        db = Database(self.caminho)
+        self.addCleanup(db.fechar)
+        self.assertEqual(db.versao_esquema(), len(MIGRACOES))
+        self.assertEqual(db.recalcular_contadores(corrigir=False), [])
+        self.assertEqual(db.recalcular_resumos_movimentos(corrigir=False), [])
+        self.assertEqual(verificar_planos_consulta(db), [])
+        return db
+
+    def test_banco_sem_versao(self):
+        # Esquema de antes das migrações (user_version 0); '8900' é um ICCID fora do padrão gravado na época
+        conn = sqlite3.connect(self.caminho)
+        conn.executescript('''
+            CREATE TABLE chips (id INTEGER PRIMARY KEY AUTOINCREMENT, iccid TEXT UNIQUE NOT NULL,
+                                operadora TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'Disponível',
+                                data_entrada TEXT NOT NULL, data_saida TEXT, retirado_por TEXT, observacoes TEXT,
+                                remessa_id INTEGER, FOREIGN KEY (remessa_id) REFERENCES remessas(id));
+            CREATE TABLE remessas (id INTEGER PRIMARY KEY AUTOINCREMENT, numero_remessa TEXT UNIQUE NOT NULL,
+                                   data_remessa TEXT NOT NULL, operadora TEXT, quantidade INTEGER, observacoes TEXT);
+        ''')
+        conn.execute("INSERT INTO remessas VALUES (1, 'REM-20240105-0003', '2024-01-05 09:00:00', 'Vivo', 2, '')")
+        conn.executemany('INSERT INTO chips (iccid, operadora, status, data_entrada, data_saida, retirado_por, '
+                         'remessa_id) VALUES (?, ?, ?, ?, ?, ?, ?)', [
+            (ICCIDS[0], 'Vivo', 'Disponível', '2024-01-05 09:00:00', None, None, 1),
+            (gerar_iccid(100), 'Vivo', 'Retirado', '2024-01-05 09:00:00', '2024-02-01 14:30:00', 'Ana', 1),
+            ('8900', 'Claro', 'Disponível', '2024-01-06 10:00:00', None, None, None)])
+        conn.commit()
+        conn.close()
+
+        db = self.abrir()
+
+        self.assertEqual(db.listar_chips(), [
+            ('8900', 'Claro', 'Disponível', '2024-01-06 10:00:00', None, None),
+            (gerar_iccid(100), 'Vivo', 'Retirado', '2024-01-05 09:00:00', '2024-02-01 14:30:00', 'Ana'),
+            (ICCIDS[0], 'Vivo', 'Disponível', '2024-01-05 09:00:00', None, None)])
+        self.assertEqual(db.estatisticas(), {'total': 3, 'disponiveis': 2, 'retirados': 1, 'total_remessas': 1})
+        self.assertEqual(db.historico_chip(gerar_iccid(100)), [
+            ('2024-01-05 09:00:00', 'entrada', 'Vivo', 1, ''), ('2024-02-01 14:30:00', 'retirada', 'Vivo', 1, 'Ana')])
+        # A sequência do dia parte do maior número já usado
+        self.assertEqual(db.executar("SELECT ultimo FROM sequencias_remessa WHERE dia = '20240105'").fetchone(), (3,))
+
+    def test_banco_em_texto_da_versao_9(self):
+        # Última versão antes do armazenamento compacto: os triggers de então mantêm contadores, busca e livro
+        conn = sqlite3.connect(self.caminho, isolation_level=None)
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        for migracao in MIGRACOES[:9]:
+            migracao(cursor)
+        cursor.execute('PRAGMA user_version = 9')
+        cursor.executemany("INSERT INTO chips (iccid, operadora, data_entrada) "
+                           "VALUES (?, 'Tim', '2024-03-01 08:00:00')", [(gerar_iccid(serial),) for serial in range(50)])
+        cursor.execute("UPDATE chips SET status = 'Retirado', data_saida = '2024-03-02 08:00:00', retirado_por = 'Bia' "
+                       'WHERE id <= 10')
+        cursor.execute('COMMIT')
+        conn.close()
+
+        db = self.abrir()
+
+        self.assertEqual(db.estatisticas(), {'total': 50, 'disponiveis': 40, 'retirados': 10, 'total_remessas': 0})
+        self.assertEqual([linha[0] for linha in db.buscar_iccid(gerar_iccid(42)[-6:])], [gerar_iccid(42)])
+        self.assertEqual(db.totais_movimentos('retirada', '2024-03-01', '2024-03-31', 'responsavel'), {'Bia': 10})
+
+
+class CadastroRemessaTest(BancoTemporario):
+    def test_lote_so_de_duplicados_nao_cria_remessa(self):
+        remessa_id, _, sucesso, falhas = self.db.cadastrar_remessa([(iccid, 'Vivo') for iccid in ICCIDS], 'Vivo')
+        self.assertEqual((sucesso, falhas), (3, []))
+        proximo = self.db.gerar_numero_remessa()
+
+        with self.assertRaises(ValueError) as erro:
+            self.db.cadastrar_remessa([(iccid, 'Vivo') for iccid in ICCIDS], 'Vivo')
+
+        self.assertIn('Já cadastrado: 3', str(erro.exception))
+        self.assertEqual([linha[0] for linha in self.db.listar_remessas()], [remessa_id])
+        self.assertEqual(self.db.gerar_numero_remessa(), proximo)
+        self.assertEqual(self.db.estatisticas()['total_remessas'], 1)
+
+
+class ContadoresTest(BancoTemporario):
+    def test_operacoes_em_lote_mantem_contadores(self):
+        # As operações em lote suspendem os triggers e somam os totais por conta própria
+        remessa_id = self.db.cadastrar_remessa([(gerar_iccid(serial), 'Vivo') for serial in range(30)], 'Vivo',
+                                               tamanho_lote=7)[0]
+        outra_id = self.db.cadastrar_remessa([(gerar_iccid(serial), 'Claro') for serial in range(30, 40)], 'Claro')[0]
+        self.db.adicionar_chip(ICCIDS[0], 'Tim')
+        self.db.retirar_chips_lote([gerar_iccid(serial) for serial in range(0, 40, 3)], 'Ana', tamanho_lote=4)
+        self.db.excluir_remessa(outra_id, excluir_chips=True, tamanho_lote=3)
+
+        self.assertEqual(self.db.recalcular_contadores(corrigir=False), [])
+        self.assertEqual(self.db.estatisticas(), {'total': 31, 'disponiveis': 21, 'retirados': 10, 'total_remessas': 1})
+        self.assertEqual(self.db.estatisticas_por_operadora(), [('Tim', 1, 1, 0), ('Vivo', 30, 20, 10)])
+        self.assertEqual(self.db.contar_chips(remessa_id=remessa_id, filtro_status='Retirado'), 10)
+
+    def test_recalcular_corrige_divergencias(self):
+        self.db.cadastrar_remessa([(iccid, 'Vivo') for iccid in ICCIDS], 'Vivo')
+        with self.db.transacao() as cursor:
+            cursor.execute("UPDATE contadores SET total = total + 5 WHERE dimensao = 'geral'")
+            cursor.execute("DELETE FROM contadores WHERE dimensao = 'operadora'")
+
+        divergencias = self.db.recalcular_contadores(corrigir=False)
+
+        self.assertEqual(divergencias, [('geral', '', (3, 3, 0), (8, 3, 0)),
+                                        ('operadora', 'Vivo', (3, 3, 0), (0, 0, 0))])
+        self.assertEqual(self.db.estatisticas()['total'], 8)
+        self.assertEqual(self.db.recalcular_contadores(), divergencias)
+        self.assertEqual(self.db.recalcular_contadores(corrigir=False), [])
+        self.assertEqual(self.db.estatisticas()['total'], 3)
+
+
+class PaginacaoTest(BancoTemporario):
+    def setUp(self):
+        # 22 chips com a mesma data_entrada (um lote) entre 5 mais antigos e 5 mais novos
+        super().setUp()
+        for serial, data in ((0, '2024-05-01 08:00:00'), (5, '2024-05-02 08:00:00'), (27, '2024-05-03 08:00:00')):
+            quantidade = 22 if serial == 5 else 5
+            self.db.adicionar_chips_lote([(gerar_iccid(serial + i), 'Vivo') for i in range(quantidade)],
+                                         data_entrada=data)
+        self.db.retirar_chips_lote([gerar_iccid(serial) for serial in range(1, 32, 2)], 'Ana')
+
+    def paginas(self, limite, **filtros):
+        linhas, cursor, paginas = [], None, 0
+        while True:
+            pagina, cursor = self.db.listar_chips_pagina(cursor=cursor, limite=limite, **filtros)
+            linhas += pagina
+            paginas += 1
+            if cursor is None:
+                return linhas, paginas
+
+    def test_paginas_cobrem_empates_de_data_entrada(self):
+        for limite in (1, 4, 7, 22, 32, 500):
+            linhas, paginas = self.paginas(limite)
+            self.assertEqual(linhas, self.db.listar_chips(), limite)
+            self.assertEqual(paginas, 32 // limite + 1, limite)
+
+    def test_paginas_com_filtro(self):
+        for limite in (3, 16):
+            linhas, _ = self.paginas(limite, filtro_status='Retirado')
+            self.assertEqual(linhas, self.db.listar_chips(filtro_status='Retirado'))
+            self.assertEqual(len(linhas), 16)
+
+
+class BuscaIccidTest(BancoTemporario):
+    def setUp(self):
+        # ICCIDs de 19 e 20 dígitos com os mesmos seriais e um fora do padrão (de um banco antigo, via view chips)
+        super().setUp()
+        self.iccids = [gerar_iccid(serial, digitos) for serial in (7, 70, 123, 1230, 12345, 99999)
+                       for digitos in (19, 20)]
+        self.remessa_id = self.db.cadastrar_remessa([(iccid, 'Vivo') for iccid in self.iccids], 'Vivo')[0]
+        with self.db.transacao() as cursor:
+            cursor.execute("INSERT INTO chips (iccid, operadora, data_entrada) VALUES ('89560001230', 'Tim', "
+                           "'2024-01-01 00:00:00')")
+        self.iccids.append('89560001230')
+
+    def buscar(self, trecho, modo):
+        return sorted(linha[0] for linha in self.db.buscar_iccid(trecho, modo))
+
+    def test_prefixo_final_e_trecho(self):
+        for trecho in ('89', '8956', '89560000000000123', '895600000000001230', self.iccids[0], self.iccids[-1]):
+            self.assertEqual(self.buscar(trecho, BUSCA_INICIO),
+                             sorted(iccid for iccid in self.iccids if iccid.startswith(trecho)), trecho)
+        for trecho in ('123', '1230', '9999', '001237', self.iccids[5][-7:]):
+            self.assertEqual(self.buscar(trecho, BUSCA_FINAL),
+                             sorted(iccid for iccid in self.iccids if iccid.endswith(trecho)), trecho)
+            self.assertEqual(self.buscar(trecho, BUSCA_CONTEM),
+                             sorted(iccid for iccid in self.iccids if trecho in iccid), trecho)
+
+    def test_minimo_de_digitos_e_limite(self):
+        self.assertEqual(self.db.buscar_iccid('12', BUSCA_FINAL), [])
+        self.assertEqual(self.db.buscar_iccid(' 1-2 '), [])
+        self.assertEqual(len(self.db.buscar_iccid('8956', BUSCA_INICIO, limite=5)), 5)
+        self.assertEqual(len(self.db.buscar_iccid('000', limite=5)), 5)
+
+    def test_indice_acompanha_exclusoes(self):
+        self.db.excluir_remessa(self.remessa_id, excluir_chips=True)
+        self.assertEqual(self.buscar('1230', BUSCA_CONTEM), ['89560001230'])
+        self.assertEqual(self.buscar('8956', BUSCA_INICIO), ['89560001230'])
+
+
+class MovimentosTest(BancoTemporario):
+    def setUp(self):
+        # Entradas em 30/01, 31/01 e 01/02 (Vivo e Claro); retiradas em 31/01 (Ana) e 15/03 (Bia)
+        super().setUp()
+        for inicio, quantidade, operadora, data in ((0, 6, 'Vivo', '2024-01-30 10:00:00'),
+                                                    (6, 4, 'Claro', '2024-01-31 23:59:59'),
+                                                    (10, 5, 'Vivo', '2024-02-01 00:00:00')):
+            chips = [(gerar_iccid(serial), operadora) for serial in range(inicio, inicio + quantidade)]
+            self.db.adicionar_chips_lote(chips, data_entrada=data, tamanho_lote=4)
+        self.db.retirar_chips_lote([gerar_iccid(serial) for serial in range(0, 8)], 'Ana', '2024-01-31 12:00:00')
+        self.db.retirar_chips_lote([gerar_iccid(serial) for serial in range(10, 13)], 'Bia', '2024-03-15 09:00:00')
+
+    def test_livro_aceita_apenas_inclusoes(self):
+        with self.assertRaisesRegex(sqlite3.IntegrityError, 'apenas inclusões'):
+            with self.db.transacao() as cursor:
+                cursor.execute("UPDATE movimentos SET responsavel = 'Outro'")
+        with self.assertRaisesRegex(sqlite3.IntegrityError, 'apenas inclusões'):
+            with self.db.transacao() as cursor:
+                cursor.execute('DELETE FROM movimentos')
+        self.assertEqual(self.db.executar('SELECT COUNT(*) FROM movimentos').fetchone(), (26,))
+
+    def test_historico_do_chip(self):
+        self.assertEqual(self.db.historico_chip(gerar_iccid(7)), [
+            ('2024-01-31 23:59:59', 'entrada', 'Claro', None, ''),
+            ('2024-01-31 12:00:00', 'retirada', 'Claro', None, 'Ana')])
+
+    def test_resumos(self):
+        self.assertEqual(self.db.recalcular_resumos_movimentos(corrigir=False), [])
+        self.assertEqual(self.db.resumo_movimentos('entrada', '2024-01-01', '2024-02-29'),
+                         [('2024-01-30', 6), ('2024-01-31', 4), ('2024-02-01', 5)])
+        self.assertEqual(self.db.resumo_movimentos('entrada', '2024-01-31', '2024-03-31', 'mes', 'operadora'),
+                         [('2024-01', 'Claro', 4), ('2024-01', 'Vivo', 6), ('2024-02', 'Vivo', 5)])
+        self.assertEqual(self.db.resumo_movimentos('retirada', '2024-01-01', '2024-12-31', 'mes', 'responsavel'),
+                         [('2024-01', 'Ana', 8), ('2024-03', 'Bia', 3)])
+        # Meses inteiros vêm do resumo mensal e as pontas do diário
+        self.assertEqual(self.db.totais_movimentos('entrada', '2024-01-31', '2024-02-01', 'operadora'),
+                         {'Claro': 4, 'Vivo': 5})
+        self.assertEqual(self.db.totais_movimentos('entrada', '2024-01-15', '2024-03-31'), {'': 15})
+        self.assertEqual(self.db.totais_movimentos('retirada', '2024-01-01', '2024-03-14', responsavel='Ana'),
+                         {'': 8})
+
+    def test_recalcular_resumos_corrige_divergencias(self):
+        with self.db.transacao() as cursor:
+            cursor.execute("UPDATE movimentos_mes SET quantidade = 1 WHERE tipo = 'retirada' AND responsavel = 'Bia'")
+        self.assertEqual(self.db.recalcular_resumos_movimentos(),
+                         [('movimentos_mes', 'retirada|2024-03|Bia|Vivo', 3, 1)])
+        self.assertEqual(self.db.recalcular_resumos_movimentos(corrigir=False), [])
+
+
+class ArquivoTest(BancoTemporario):
+    def setUp(self):
+        # 10 chips; os 4 primeiros retirados em 2020 vão para o arquivo
+        super().setUp()
+        self.db.cadastrar_remessa([(gerar_iccid(serial), 'Vivo') for serial in range(10)], 'Vivo')
+        self.db.retirar_chips_lote([gerar_iccid(serial) for serial in range(4)], 'Ana', '2020-06-01 10:00:00')
+        self.db.retirar_chips_lote([gerar_iccid(4)], 'Bia')
+        self.assertEqual(self.db.arquivar_retirados(pausa=0), 4)
+
+    def test_arquivados_continuam_cadastrados(self):
+        self.assertFalse(self.db.adicionar_chip(gerar_iccid(0), 'Vivo'))
+        sucesso, falhas = self.db.adicionar_chips_lote([(gerar_iccid(serial), 'Vivo') for serial in (1, 5, 20)])
+        self.assertEqual(sucesso, 1)
+        self.assertEqual(sorted((str(falha), falha.motivo) for falha in falhas),
+                         [(gerar_iccid(1), MOTIVO_JA_ARQUIVADO), (gerar_iccid(5), MOTIVO_JA_CADASTRADO)])
+        with self.assertRaisesRegex(ValueError, 'Nenhum chip cadastrado'):
+            self.db.cadastrar_remessa([(gerar_iccid(2), 'Vivo'), (gerar_iccid(3), 'Vivo')], 'Vivo')
+
+    def test_retirada_informa_arquivados(self):
+        resultado = self.db.retirar_chips_lote([gerar_iccid(serial) for serial in (0, 4, 5, 30)], 'Caio')
+        self.assertEqual(resultado['retirados'], [gerar_iccid(5)])
+        self.assertEqual(sorted(iccid for iccid, _, _ in resultado['ja_retirados']), [gerar_iccid(0), gerar_iccid(4)])
+        self.assertIn((gerar_iccid(0), 'Ana', '2020-06-01 10:00:00'), resultado['ja_retirados'])
+        self.assertEqual(resultado['desconhecidos'], [gerar_iccid(30)])
+
+    def test_consultas_com_arquivo(self):
+        self.assertEqual(self.db.recalcular_contadores(corrigir=False), [])
+        self.assertEqual(self.db.estatisticas(), {'total': 6, 'disponiveis': 5, 'retirados': 1, 'total_remessas': 1})
+        self.assertEqual(self.db.estatisticas(incluir_arquivo=True)['retirados'], 5)
+        self.assertEqual(len(self.db.listar_chips(incluir_arquivo=True)), 10)
+        self.assertEqual(self.db.contar_chips(filtro_status='Retirado', incluir_arquivo=True), 5)
+        self.assertEqual(self.db.buscar_iccid(gerar_iccid(2)[-8:], BUSCA_FINAL), [])
+        self.assertEqual([linha[0] for linha in self.db.buscar_iccid(gerar_iccid(2)[-8:], BUSCA_FINAL,
+                                                                     incluir_arquivo=True)], [gerar_iccid(2)])
+
+
+class ConciliacaoTest(BancoTemporario):
+    def setUp(self):
+        # Banco: 0 a 5 Vivo, 6 a 9 Claro, o 2 retirado. Inventário fora de ordem, com cabeçalho, espaços e uma
+        # linha repetida; o 7 vem sem operadora (não conta como divergência)
+        super().setUp()
+        self.db.cadastrar_remessa([(gerar_iccid(serial), 'Vivo') for serial in range(6)], 'Vivo')
+        self.db.cadastrar_remessa([(gerar_iccid(serial), 'Claro') for serial in range(6, 10)], 'Claro')
+        self.db.retirar_chips_lote([gerar_iccid(2)], 'Ana', '2024-04-01 10:00:00')
+        self.inventario = [('ICCID', 'Operadora'), (gerar_iccid(5), 'Vivo'), (gerar_iccid(2), 'Vivo'),
+                           (gerar_iccid(1), 'Claro'), (gerar_iccid(50), 'Vivo'), (f' {gerar_iccid(5)} ', 'Vivo'),
+                           (gerar_iccid(0), 'Vivo'), (gerar_iccid(6), 'Claro'), (gerar_iccid(7), '')]
+
+    def test_categorias(self):
+        esperado = [
+            ('operadora_divergente', gerar_iccid(1), 'arquivo: Claro, banco: Vivo'),
+            ('retirado_no_banco', gerar_iccid(2), 'Ana em 2024-04-01 10:00:00'),
+            ('ausente_no_arquivo', gerar_iccid(3), 'Vivo'),
+            ('ausente_no_arquivo', gerar_iccid(4), 'Vivo'),
+            ('duplicado_no_arquivo', gerar_iccid(5), ''),
+            ('ausente_no_arquivo', gerar_iccid(8), 'Claro'),
+            ('ausente_no_arquivo', gerar_iccid(9), 'Claro'),
+            ('nao_cadastrado', gerar_iccid(50), ''),
+        ]
+        # Blocos menores que o inventário passam pela intercalação dos arquivos temporários
+        for tamanho_lote in (2, 3, 100000):
+            self.assertEqual(list(self.db.conciliar(self.inventario, tamanho_lote=tamanho_lote)), esperado,
+                             tamanho_lote)
+        self.assertEqual(list(self.db.conciliar(self.inventario, 'Vivo', tamanho_lote=2)),
+                         [linha for linha in esperado if linha[2] != 'Claro'])
+
+    def test_arquivados(self):
+        # Os dois retirados já passaram da retenção e vão para o arquivo
+        self.db.retirar_chips_lote([gerar_iccid(3)], 'Bia', '2020-06-01 10:00:00')
+        self.assertEqual(self.db.arquivar_retirados(pausa=0), 2)
+        inventario = [(gerar_iccid(serial), '') for serial in range(10)]
+        self.assertEqual(list(self.db.conciliar(inventario)), [
+            ('nao_cadastrado', gerar_iccid(2), ''), ('nao_cadastrado', gerar_iccid(3), '')])
+        self.assertEqual(list(self.db.conciliar(inventario, incluir_arquivo=True, tamanho_lote=4)), [
+            ('retirado_no_banco', gerar_iccid(2), 'Ana em 2024-04-01 10:00:00'),
+            ('retirado_no_banco', gerar_iccid(3), 'Bia em 2020-06-01 10:00:00')])
+
+
+class PlanosConsultaTest(BancoTemporario):
+    def test_nenhuma_consulta_varre_tabela(self):
+        self.db.cadastrar_remessa([(iccid, 'Vivo') for iccid in ICCIDS], 'Vivo')
+        self.assertEqual(verificar_planos_consulta(self.db), [])
+
+    def test_nenhuma_consulta_do_arquivo_varre_tabela(self):
+        self.db._preparar_arquivo()
+        self.assertTrue(self.db.arquivo_disponivel)
+        self.assertEqual(verificar_planos_consulta(self.db), [])
+
+
+if __name__ == '__main__':
+    unittest.main()